@@ -0,0 +1,497 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+from urllib.parse import parse_qsl
+import json
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag, unquote_etag
+from flask_restful import abort
+
+from main import (InventoryVersionModel, PartModel, adjust_quantity_statement, build_part, change_entry, change_event,
+                  change_state_query, changed_after, changes_get_args, changes_page, changes_query, check_arguments, check_limit,
+                  check_since, compress, compression_levels, create_app, cursor_page, db, duplicate_part_query,
+                  encode_json, encoded_etag, inventory_get_args, inventory_query, inventory_row_queries,
+                  inventory_version_query, is_not_modified, latest_change, low_stock_args, low_stock_query,
+                  matched_etag, migrate_schema, negotiate_encoding, numbered_page, parse_part, parse_search,
+                  part_cache, part_change_query, part_label, part_patch_args, part_types, part_validators, prepare_quantity_entries,
+                  quantity_results, refused_skus_query, search_query, serialize_part, sqlite_pragmas,
+                  stock_levels_query, stock_report, trigger_dialects, validate_part, validator_headers, version_etag)
+
+
+async_drivers = {                               # Asyncio driver used in place of each backend's default one
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def async_url(url):                             # sqlite:///database.db -> sqlite+aiosqlite:///database.db
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in async_drivers:
+        raise ValueError(f"No asyncio driver known for '{backend}' databases")
+    return url.set(drivername=async_drivers[backend])
+
+
+def json_body(value, request, status=200, headers=None):    # Compact JSON response, encoded and compressed like the WSGI app's
+    config = request.app.state.config
+    body = encode_json(value, config['FAST_JSON'])
+    headers = dict(headers or {})
+    if config['COMPRESSION_ENABLED']:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), config)
+        if encoding is not None and len(body) >= config['COMPRESSION_MIN_SIZE']:
+            body = compress(body, encoding, compression_levels[encoding][0])
+            headers['Content-Encoding'] = encoding
+            if 'ETag' in headers:
+                etag, weak = unquote_etag(headers['ETag'])
+                headers['ETag'] = quote_etag(encoded_etag(etag, encoding), weak)
+    return Response(body, status_code=status, media_type='application/json', headers=headers)
+
+
+def not_modified_response(request, etag, last_modified=None):
+    headers = validator_headers(matched_etag(request.headers, etag), last_modified)
+    if request.app.state.config['COMPRESSION_ENABLED']:
+        headers['Vary'] = 'Accept-Encoding'
+    return Response(status_code=304, headers=headers)
+
+
+async def collection_etag(request, session, values):   # ETag of a collection response, or None when the database keeps no version
+    if request.app.state.engine.dialect.name not in trigger_dialects:
+        return None
+    return version_etag(await session.scalar(inventory_version_query()), {'path': request.url.path, **values})
+
+
+async def handle_abort(request, exc):           # Turns the aborts raised by the shared helpers into the WSGI app's error bodies
+    data = getattr(exc, 'data', None) or {'message': exc.description}
+    return json_body(data, request, exc.code)
+
+
+def body_mimetype(request):
+    return request.headers.get('content-type', '').partition(';')[0].strip().lower()
+
+
+def is_json(request):                           # Like Flask's request.is_json
+    mimetype = body_mimetype(request)
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+async def read_json(request):                   # Decoded JSON body, or None when there is no body or it isn't sent as JSON
+    if not is_json(request):
+        return None
+    body = await request.body()
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        abort(400, message="Failed to decode JSON object")
+
+
+async def read_form(request):                   # Fields of a form body, the first of each name like Flask's request.form.to_dict()
+    mimetype = body_mimetype(request)
+    if mimetype == 'application/x-www-form-urlencoded':
+        fields = parse_qsl((await request.body()).decode('utf-8', 'replace'), keep_blank_values=True)
+    elif mimetype == 'multipart/form-data':     # Parsed by Starlette, which needs python-multipart for it
+        fields = (await request.form()).multi_items()
+    else:
+        return {}
+    values = {}
+    for name, value in fields:
+        values.setdefault(name, value)
+    return values
+
+
+async def request_values(request):              # Query string merged with the JSON or form body, like main.request_values
+    values = dict(request.query_params)
+    if is_json(request):
+        payload = await read_json(request)
+        if isinstance(payload, dict):
+            values.update(payload)
+    else:
+        values.update(await read_form(request))
+    return values
+
+
+def parse_args(parser, values):                 # Aborts with the same error body as the Flask app when an argument is missing or invalid
+    return check_arguments(parser.parse(values))
+
+
+async def find_cached_part(request, sku):       # Returns (cache entry, None, None) on a hit, otherwise (None, part from the database or None, read)
+    logged = request.app.state.engine.dialect.name in trigger_dialects
+    async with request.app.state.sessions() as session:
+        if not request.app.state.config['PART_CACHE_ENABLED']:
+            return None, await session.get(PartModel, sku), None
+        cached = part_cache.get(sku)
+        if cached and cached[3] is not None:    # Checked against the change log, like main.changed_since
+            if changed_after(cached[3][1], *(await session.execute(part_change_query(sku))).one()):
+                cached = None
+        if cached:
+            return cached, None, None
+        started = part_cache.begin()
+        tag = (None, latest_change(*(await session.execute(change_state_query())).one())) if logged else None
+        return None, await session.get(PartModel, sku), (tag, started)
+
+
+def cache_part(request, result, read):          # Serializes a part read from the database into a cache entry, cached when read says how
+    config = request.app.state.config
+    entry = (encode_json(serialize_part(result), config['FAST_JSON']), result.quantity, result.date_last_updated)
+    if read is not None:
+        part_cache.set(result.sku, *entry, *read)
+    return entry
+
+
+async def add_part(request):                    # PUT /part/
+    args = check_arguments(parse_part(await request_values(request)))
+
+    error = validate_part(args)
+    if error:
+        abort(error[0], message=error[1])
+
+    async with request.app.state.sessions() as session:
+        if await session.get(PartModel, args['sku']):
+            abort(409, message="SKU taken")
+
+        if await session.scalar(duplicate_part_query(args)):
+            abort(409, message=f"This {part_label(args['class_name'])} already exists in the inventory")
+
+        session.add(build_part(args, datetime.now()))
+        try:
+            await session.commit()
+        except IntegrityError:                  # Another request added the same SKU or part since the checks above
+            await session.rollback()
+            if await session.get(PartModel, args['sku']):
+                abort(409, message="SKU taken")
+            abort(409, message=f"This {part_label(args['class_name'])} already exists in the inventory")
+    part_cache.invalidate(args['sku'])
+
+    return json_body({"message": "Part sucessfully added"}, request, 201)
+
+
+async def get_or_delete_part(request):          # GET and DELETE /part/<sku>
+    sku = request.path_params['sku']
+
+    if request.method == 'GET':
+        cached, result, read = await find_cached_part(request, sku)
+        if not cached and not result:
+            abort(404, message="Could not find part with that SKU")
+
+        validators = part_validators(sku, cached[2] if cached else result.date_last_updated)
+        if is_not_modified(request.headers, *validators):   # Answered before the part is serialized
+            return not_modified_response(request, *validators)
+
+        if not cached:
+            cached = cache_part(request, result, read)
+        return Response(cached[0], media_type='application/json', headers=validator_headers(*validators))
+
+    async with request.app.state.sessions() as session:
+        result = await session.get(PartModel, sku)
+        if result:
+            await session.delete(result)
+            await session.commit()
+            part_cache.invalidate(sku)
+            return json_body(204, request)      # Same body and status as the WSGI app
+
+    abort(404, message="Could not find part with that SKU")
+
+
+async def get_quantity(request):                # GET /quantity/<sku>
+    sku = request.path_params['sku']
+    cached, result, read = await find_cached_part(request, sku)
+    if result:
+        cached = cache_part(request, result, read)
+    if cached:
+        validators = part_validators(sku, cached[2])
+        if is_not_modified(request.headers, *validators):
+            return not_modified_response(request, *validators)
+        return json_body({'sku': sku, 'quantity': cached[1]}, request, headers=validator_headers(*validators))
+
+    abort(404, message="Could not find part with that SKU")
+
+
+async def adjust_quantities(session, entries):  # Applies many absolute or relative quantity changes in one transaction
+    results, pending = prepare_quantity_entries(entries)
+
+    applied = [True] * len(pending)
+    if pending:
+        result = await session.execute(adjust_quantity_statement, [params for index, params in pending])
+
+        if result.rowcount != len(pending):
+            # Some entries were refused, so redo them one at a time to find out which
+            await session.rollback()
+            for position, (index, params) in enumerate(pending):
+                applied[position] = (await session.execute(adjust_quantity_statement, params)).rowcount == 1
+
+    existing_skus = set(await session.scalars(refused_skus_query(pending, applied)))
+    await session.commit()
+
+    return quantity_results(results, pending, applied, existing_skus)
+
+
+async def patch_inventory(request):             # PATCH /inventory/
+    entries = await read_json(request)
+    async with request.app.state.sessions() as session:
+        if isinstance(entries, list):           # A JSON array changes many quantities at once
+            return json_body(await adjust_quantities(session, entries), request)
+
+        args = parse_args(part_patch_args, await request_values(request))
+
+        sku = args['sku']
+        quantity = args['quantity']
+
+        if quantity < 0:
+            abort(400, message="Quantity cannot be negative")
+
+        if args['reorder_point'] is not None and args['reorder_point'] < 0:
+            abort(400, message="Reorder point cannot be negative")
+
+        result = await session.get(PartModel, sku)
+        if result:
+            result.quantity = quantity
+            if args['reorder_point'] is not None:
+                result.reorder_point = args['reorder_point']
+            result.date_last_updated = datetime.now()
+            await session.commit()
+            part_cache.invalidate(sku)
+            return json_body({"message": "Quantity successfully changed"}, request)
+
+    abort(404, message="Could not find part with that SKU")
+
+
+def stream_inventory(request, stream_format, cursor, limit, headers):   # Streams the inventory as a JSON array or NDJSON
+    config = request.app.state.config
+    query = inventory_query(cursor).execution_options(yield_per=config['INVENTORY_STREAM_BATCH'])
+    if limit is not None:
+        query = query.limit(limit)
+
+    async def generate():
+        async with request.app.state.sessions() as session:
+            parts = await session.stream_scalars(query)
+            if stream_format == 'ndjson':
+                async for part in parts:
+                    yield encode_json(serialize_part(part), config['FAST_JSON']) + b'\n'
+                return
+
+            separator = b''
+            yield b'['
+            async for part in parts:
+                yield separator + encode_json(serialize_part(part), config['FAST_JSON'])
+                separator = b','
+            yield b']'
+
+    media_type = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+
+async def get_inventory(request):               # GET /inventory/
+    config = request.app.state.config
+    args = parse_args(inventory_get_args, dict(request.query_params))
+
+    check_limit(args['limit'], config['INVENTORY_MAX_PAGE_SIZE'])
+
+    async with request.app.state.sessions() as session:
+        etag = await collection_etag(request, session, args)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(request, etag)
+        headers = validator_headers(etag)
+
+        if args['stream']:
+            return stream_inventory(request, args['stream'], args['cursor'], args['limit'], headers)
+
+        if args['limit'] is not None or args['cursor'] is not None:
+            limit = args['limit'] or config['INVENTORY_MAX_PAGE_SIZE']
+            parts = (await session.scalars(inventory_query(args['cursor']).limit(limit + 1))).all()
+            return json_body(cursor_page(parts, limit), request, headers=headers)
+
+        inventory_list = []
+        for serializer, query in inventory_row_queries():
+            inventory_list.extend(serializer.from_row(row) for row in await session.execute(query))
+
+    return json_body(inventory_list, request, headers=headers)
+
+
+async def search(request):                      # GET /search/
+    config = request.app.state.config
+    values = await request_values(request)
+    args = check_arguments(parse_search(values))
+
+    if args['class_name'] not in part_types:
+        return json_body({"message": "No parts found"}, request)
+
+    check_limit(args['limit'], config['INVENTORY_MAX_PAGE_SIZE'])
+
+    if args['offset'] is not None and args['offset'] < 0:
+        abort(400, message="Offset cannot be negative")
+
+    query, paging = search_query(args, values)
+
+    limit = args['limit'] or config['INVENTORY_MAX_PAGE_SIZE']
+    async with request.app.state.sessions() as session:
+        etag = await collection_etag(request, session, values)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(request, etag)
+        headers = validator_headers(etag)
+
+        if paging == 'offset':
+            offset = args['offset'] or 0
+            parts = (await session.scalars(query.offset(offset).limit(limit + 1))).all()
+            return json_body(numbered_page(parts, offset, limit), request, headers=headers)
+        if paging == 'cursor':
+            parts = (await session.scalars(query.limit(limit + 1))).all()
+            return json_body(cursor_page(parts, limit), request, headers=headers)
+
+        search_list = [serialize_part(part) for part in await session.scalars(query)]
+
+    if len(search_list) == 0:
+        return json_body({"message": "No parts found"}, request, headers=headers)
+
+    return json_body(search_list, request, headers=headers)
+
+
+async def get_stock_levels(request):           # GET /stock/
+    async with request.app.state.sessions() as session:
+        etag = await collection_etag(request, session, {})
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(request, etag)
+        levels = await session.execute(stock_levels_query())
+    return json_body(stock_report(levels), request, headers=validator_headers(etag))
+
+
+async def get_low_stock(request):               # GET /stock/low
+    config = request.app.state.config
+    args = parse_args(low_stock_args, dict(request.query_params))
+
+    check_limit(args['limit'], config['INVENTORY_MAX_PAGE_SIZE'])
+
+    query = low_stock_query(args['class_name'], args['cursor'])
+    async with request.app.state.sessions() as session:
+        etag = await collection_etag(request, session, args)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(request, etag)
+        headers = validator_headers(etag)
+
+        if args['limit'] is not None or args['cursor'] is not None:
+            limit = args['limit'] or config['INVENTORY_MAX_PAGE_SIZE']
+            parts = (await session.scalars(query.limit(limit + 1))).all()
+            return json_body(cursor_page(parts, limit), request, headers=headers)
+
+        low_stock_list = [serialize_part(part) for part in await session.scalars(query)]
+
+    return json_body(low_stock_list, request, headers=headers)
+
+
+async def stream_changes(request, since):       # Streams changes as Server-Sent Events until the client goes away
+    config = request.app.state.config
+    last_seq = since
+    idle = 0.0
+    while True:
+        async with request.app.state.sessions() as session:
+            rows = (await session.execute(changes_query(last_seq, config['INVENTORY_STREAM_BATCH']))).all()
+            compacted_seq = await session.scalar(select(InventoryVersionModel.compacted_seq))
+            events = [change_event(change_entry(*row), config['FAST_JSON']) for row in rows]
+
+        if compacted_seq is not None and last_seq < compacted_seq:
+            yield b'event: reset\ndata: {}\n\n'
+            return
+
+        if events:
+            yield b''.join(events)
+            last_seq = rows[-1][0]
+            idle = 0.0
+            continue
+
+        await asyncio.sleep(config['CHANGES_POLL_INTERVAL'])
+        idle += config['CHANGES_POLL_INTERVAL']
+        if idle >= config['CHANGES_KEEPALIVE']:     # Keeps proxies from closing an idle connection
+            yield b': keepalive\n\n'
+            idle = 0.0
+
+
+async def get_changes(request):                 # GET /changes
+    config = request.app.state.config
+    args = parse_args(changes_get_args, dict(request.query_params))
+
+    check_limit(args['limit'], config['INVENTORY_MAX_PAGE_SIZE'])
+    limit = args['limit'] or config['INVENTORY_MAX_PAGE_SIZE']
+
+    async with request.app.state.sessions() as session:
+        latest_seq, compacted_seq = (await session.execute(change_state_query())).one()
+
+    since = args['since']
+    if args['stream'] and request.headers.get('Last-Event-ID', '').isdigit():
+        since = int(request.headers['Last-Event-ID'])
+
+    if since is None:
+        if not args['stream']:              # Tells a new replica where to start before it downloads /inventory/
+            return json_body({'changes': [], 'last_seq': latest_change(latest_seq, compacted_seq), 'more': False},
+                             request)
+        since = latest_change(latest_seq, compacted_seq)
+
+    check_since(since, compacted_seq)
+
+    if args['stream']:
+        return StreamingResponse(stream_changes(request, since), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache'})
+
+    # Waiting only costs a sleeping coroutine here, not a worker thread
+    deadline = time.monotonic() + min(max(args['wait'] or 0, 0), config['CHANGES_MAX_WAIT'])
+    while True:
+        async with request.app.state.sessions() as session:
+            rows = (await session.execute(changes_query(since, limit + 1))).all()
+            if rows or time.monotonic() >= deadline:
+                return json_body(changes_page(rows, since, limit), request)
+        await asyncio.sleep(config['CHANGES_POLL_INTERVAL'])
+
+
+def create_async_app(config=None):              # Builds the asyncio API from the same configuration as create_app
+    flask_app = create_app(config)
+    config = flask_app.config
+    if config['SHARD_BY'] is not None:
+        raise ValueError("The asyncio app serves a single database, unset SHARD_BY or serve main.app")
+    with flask_app.app_context():               # Flask-SQLAlchemy has resolved relative SQLite paths by now
+        url = db.engine.url
+
+    options = dict(config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if 'pool_size' in options:                  # aiosqlite defaults to NullPool, which takes no sizing
+        options.setdefault('poolclass', AsyncAdaptedQueuePool)
+    engine = create_async_engine(async_url(url), **options)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', sqlite_pragmas(config))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with engine.begin() as connection:
+            await connection.run_sync(migrate_schema)
+        yield
+        await engine.dispose()
+
+    routes = [
+        Route('/part/', add_part, methods=['PUT']),
+        Route('/part/{sku:int}', get_or_delete_part, methods=['GET', 'DELETE']),
+        Route('/quantity/{sku:int}', get_quantity, methods=['GET']),
+        Route('/inventory/', get_inventory, methods=['GET']),
+        Route('/inventory/', patch_inventory, methods=['PATCH']),
+        Route('/search/', search, methods=['GET']),
+        Route('/stock/', get_stock_levels, methods=['GET']),
+        Route('/stock/low', get_low_stock, methods=['GET']),
+        Route('/changes', get_changes, methods=['GET']),
+    ]
+
+    app = Starlette(routes=routes, exception_handlers={HTTPException: handle_abort}, lifespan=lifespan)
+    app.state.config = config
+    app.state.engine = engine
+    app.state.sessions = async_sessionmaker(engine, expire_on_commit=False)
+    return app
+
+
+app = create_async_app()        # Served by an ASGI server, e.g. "uvicorn async_app:app"
@@ -0,0 +1,581 @@
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from datetime import datetime
+
+from flask_restful import marshal, reqparse
+from sqlalchemy import create_engine, insert, select
+from werkzeug.serving import make_server
+
+import main
+from main import app, create_app, db, migrate_schema, PartModel, part_characteristics, part_models, part_schemas, part_serializers
+from main import shard_names, shard_of
+
+# Benchmarks for the inventory API. Every command prints its results as JSON so runs can be compared.
+# Run "python bench.py <command> --help" for the options of each command.
+
+
+parts_table = PartModel.__table__
+
+class_names = ['resistor', 'solder', 'wire', 'display_cable', 'ethernet_cable']
+solder_types = ['lead', 'lead-free', 'rosin-core', 'acid-core']
+display_cable_types = ['hdmi', 'vga', 'displayport', 'micro-hdmi']
+alpha_or_beta_types = ['male', 'female']
+speeds = ['10mbps', '100mbps', '1gbps', '10gbps']
+
+
+def synthetic_part(sku):                        # A valid part whose characteristics are unique within its class
+    class_name = class_names[sku % len(class_names)]
+    n = sku // len(class_names) + 1
+    part = {column.name: None for column in parts_table.columns}
+    part.update(sku=sku, class_name=class_name, date_last_updated=datetime.now(), quantity=n % 500)
+
+    if class_name == 'resistor':
+        part.update(resistance=n, tolerance=n % 20 + 1)
+    elif class_name == 'solder':
+        part.update(solder_type=solder_types[n % 4], solder_length=n / 100)
+    elif class_name == 'wire':
+        part.update(gauge=float(n % 40 + 1), wire_length=n / 100)
+    elif class_name == 'display_cable':
+        part.update(display_cable_type=display_cable_types[n % 4], display_cable_length=n / 100,
+                    display_cable_color=f'#{n:06X}')
+    else:
+        part.update(alpha_type=alpha_or_beta_types[n % 2], beta_type=alpha_or_beta_types[n // 2 % 2],
+                    speed=speeds[n % 4], ethernet_cable_length=n / 100)
+
+    return part
+
+
+def seed(engine, rows, start_sku=1, batch=10000):      # Inserts synthetic parts straight into the parts table
+    with engine.begin() as connection:
+        for start in range(start_sku, start_sku + rows, batch):
+            end = min(start + batch, start_sku + rows)
+            connection.execute(insert(parts_table), [synthetic_part(sku) for sku in range(start, end)])
+
+
+def percentile(samples, fraction):              # samples must be sorted
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def latency_summary(samples):                   # Milliseconds
+    if not samples:
+        return {'count': 0}
+
+    samples = sorted(samples)
+    return {'count': len(samples),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 4),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 4),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 4),
+            'max_ms': round(samples[-1] * 1000, 4)}
+
+
+def time_calls(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def temporary_engine():                         # Fresh SQLite database file, removed when the benchmark ends
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return create_engine(f'sqlite:///{path}'), path
+
+
+# Indexes: search and Add_Part latency with and without the indexes on the parts table
+
+
+def index_queries(rows):                        # Selective searches plus the duplicate check Add_Part runs for each class
+    c = parts_table.c
+    middle = synthetic_part(rows // 2 // 5 * 5 + 3)      # A display cable near the middle of the table
+    return {
+        'search_tolerance': select(c.sku).where(c.tolerance == 7).limit(100),
+        'search_solder_length': select(c.sku).where(c.solder_length == 12.34),
+        'search_wire_length': select(c.sku).where(c.wire_length == 56.78),
+        'search_display_cable_color': select(c.sku).where(c.display_cable_color == middle['display_cable_color']),
+        'search_ethernet_cable_length': select(c.sku).where(c.ethernet_cable_length == 9.99),
+        'duplicate_check_resistor': select(c.sku).where(c.class_name == 'resistor', c.resistance == 1234,
+                                                        c.tolerance == 15),
+        'duplicate_check_ethernet_cable': select(c.sku).where(c.class_name == 'ethernet_cable', c.alpha_type == 'male',
+                                                              c.beta_type == 'female', c.speed == '1gbps',
+                                                              c.ethernet_cable_length == 42.0),
+    }
+
+
+def measure_indexes(engine, rows, repeat, inserts, first_new_sku):
+    results = {}
+    with engine.connect() as connection:
+        for name, query in index_queries(rows).items():
+            results[name] = time_calls(lambda: connection.execute(query).all(), repeat)
+
+    # Add_Part's write path: SKU check, duplicate check, insert and commit of one part at a time
+    next_sku = iter(range(first_new_sku, first_new_sku + inserts))
+    c = parts_table.c
+
+    def add_part():
+        part = synthetic_part(next(next_sku))
+        identity = [c[name] == part[name] for name in part_characteristics[part['class_name']]]
+        with engine.begin() as connection:
+            connection.execute(select(c.sku).where(c.sku == part['sku'])).first()
+            connection.execute(select(c.sku).where(c.class_name == part['class_name'], *identity)).first()
+            connection.execute(insert(parts_table), part)
+
+    results['add_part'] = time_calls(add_part, inserts)
+    return results
+
+
+def bench_indexes(args):
+    engine, path = temporary_engine()
+    try:
+        db.metadata.create_all(engine)
+        for index in parts_table.indexes:
+            index.drop(engine)
+
+        start = time.perf_counter()
+        seed(engine, args.rows)
+        seed_seconds = time.perf_counter() - start
+
+        before = measure_indexes(engine, args.rows, args.repeat, args.inserts, args.rows + 1)
+
+        start = time.perf_counter()
+        for index in parts_table.indexes:
+            index.create(engine)
+        index_seconds = time.perf_counter() - start
+
+        after = measure_indexes(engine, args.rows, args.repeat, args.inserts, args.rows + args.inserts + 1)
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+    return {'benchmark': 'indexes', 'rows': args.rows, 'seed_seconds': round(seed_seconds, 3),
+            'index_build_seconds': round(index_seconds, 3), 'before': before, 'after': after}
+
+
+# Serialize: per-row cost of turning each class of part into response JSON
+
+
+def serialize_before(part):                     # What responses cost before: marshal, json.dumps(indent=4), then Flask-RESTful encoding that string again
+    return json.dumps(json.dumps(marshal(part, part_schemas[part.class_name]), indent=4)).encode()
+
+
+def serialize_after(part):
+    return main.dump_json(part_serializers[part.class_name].from_part(part))
+
+
+def time_per_row(serialize, parts, repeat):     # Best of repeat runs over every part, in microseconds per row
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for part in parts:
+            serialize(part)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(parts) * 1000000, 3)
+
+
+def bench_serialize(args):
+    results = {}
+    with app.app_context():
+        for class_index, class_name in enumerate(class_names):
+            skus = range(class_index, args.rows * len(class_names), len(class_names))
+            columns = ('sku', 'class_name', 'date_last_updated', 'quantity') + part_characteristics[class_name]
+            parts = [part_models[class_name](**{column: row[column] for column in columns})
+                     for row in map(synthetic_part, skus)]
+
+            app.config['FAST_JSON'] = False
+            results[class_name] = {'before_us': time_per_row(serialize_before, parts, args.repeat),
+                                   'after_us': time_per_row(serialize_after, parts, args.repeat)}
+            if main.orjson:
+                app.config['FAST_JSON'] = True
+                results[class_name]['after_orjson_us'] = time_per_row(serialize_after, parts, args.repeat)
+
+    return {'benchmark': 'serialize', 'rows_per_class': args.rows, 'orjson': main.orjson is not None,
+            'per_row': results}
+
+
+# Validate: per-request cost of parsing and checking a part body
+
+
+def reqparse_put_args():                        # The reqparse parser every PUT /part/ ran before, with every characteristic of every class
+    parser = reqparse.RequestParser()
+    arguments = main.part_put_args.args + [argument for parser_args in main.class_put_args.values()
+                                           for argument in parser_args.args]
+    for argument in arguments:
+        parser.add_argument(argument.name, type=argument.type, help=argument.help, required=argument.required)
+    return parser
+
+
+def validate_before(parser):
+    args = parser.parse_args()
+    return main.validate_part(args)
+
+
+def validate_after(parser):
+    args = main.check_arguments(main.parse_part(main.request_values()))
+    return main.validate_part(args)
+
+
+def time_per_request(validate, parser, body, requests):     # Microseconds per request, each in a fresh request context
+    start = time.perf_counter()
+    for _ in range(requests):
+        with app.test_request_context('/part/', method='PUT', json=body):
+            if validate(parser):
+                raise AssertionError("Synthetic part failed validation")
+    return round((time.perf_counter() - start) / requests * 1000000, 3)
+
+
+def bench_validate(args):
+    parser = reqparse_put_args()
+    results = {}
+    for class_index, class_name in enumerate(class_names):
+        part = synthetic_part(class_index)
+        body = {column: part[column] for column in ('sku', 'class_name', 'quantity') + part_characteristics[class_name]}
+        timings = {}
+        for name, validate in (('context_us', lambda parser: None), ('before_us', validate_before),
+                               ('after_us', validate_after)):
+            timings[name] = min(time_per_request(validate, parser, body, args.requests) for _ in range(args.repeat))
+        results[class_name] = timings
+
+    return {'benchmark': 'validate', 'requests': args.requests, 'per_request': results}
+
+
+# Throughput: mixed reads and writes over HTTP against a pre-forked server with a varying number of workers
+
+
+def serve_workers(config, workers):             # Forks workers sharing one listening socket, returns (port, pids)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    port = listener.getsockname()[1]
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            server = make_server('127.0.0.1', port, create_app(config), threaded=True, fd=listener.fileno())
+            server.serve_forever()
+            os._exit(0)
+        pids.append(pid)
+
+    listener.close()
+    return port, pids
+
+
+def stop_workers(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+read_write_workload = [                         # (operation, share of requests)
+    ('get_part', 0.5),
+    ('get_quantity', 0.3),
+    ('patch_quantity', 0.2),
+]
+
+scanner_workload = [                            # A shift change: scanners setting quantities, with a few checking them
+    ('patch_quantity', 0.9),
+    ('get_quantity', 0.1),
+]
+
+burst_workload = [                              # A write burst on ethernet cables while scanners set quantities of every class
+    ('bulk_add_cables', 0.05),
+    ('patch_quantity', 0.95),
+]
+
+throughput_workloads = {'read_write': read_write_workload, 'scanner': scanner_workload, 'burst': burst_workload}
+
+endpoint_workload = [                           # Scanner heavy reads with some writes, paging and searches across every endpoint
+    ('get_part', 0.40),
+    ('get_quantity', 0.25),
+    ('patch_quantity', 0.10),
+    ('add_part', 0.05),
+    ('inventory_page', 0.08),
+    ('search', 0.10),
+    ('stock_levels', 0.02),
+]
+
+
+def new_part_body(sku):                         # PUT /part/ body for a part that is not in the seeded inventory
+    part = synthetic_part(sku)
+    return {name: value for name, value in part.items() if value is not None and name != 'date_last_updated'}
+
+
+def search_body(sku):                           # Searches for the class and first characteristic of an existing part
+    part = synthetic_part(sku)
+    characteristic = part_characteristics[part['class_name']][0]
+    return {'class_name': part['class_name'], characteristic: part[characteristic], 'limit': 50}
+
+
+def workload_request(name, rows, new_skus):     # (method, path, JSON body) of one request
+    sku = random.randint(1, rows)
+    if name == 'get_part':
+        return 'GET', f'/part/{sku}', None
+    if name == 'get_quantity':
+        return 'GET', f'/quantity/{sku}', None
+    if name == 'patch_quantity':
+        return 'PATCH', '/inventory/', {'sku': sku, 'quantity': random.randint(0, 500)}
+    if name == 'add_part':
+        return 'PUT', '/part/', new_part_body(next(new_skus))
+    if name == 'bulk_add_cables':               # synthetic_part makes every SKU ending in 4 or 9 an ethernet cable
+        cable_skus = (new_sku for new_sku in new_skus if new_sku % 5 == 4)
+        return 'POST', '/parts/bulk', [new_part_body(next(cable_skus)) for _ in range(200)]
+    if name == 'inventory_page':
+        return 'GET', f'/inventory/?limit=100&cursor={sku}', None
+    if name == 'search':
+        return 'GET', '/search/', search_body(sku)
+    if name == 'stock_levels':
+        return 'GET', '/stock/', None
+    raise ValueError(f"Unknown operation {name}")
+
+
+def new_sku_counter(rows, client):              # SKUs for parts added by one client, never shared with another client
+    return iter(range(rows + 1 + client * 10000000, rows + 1 + (client + 1) * 10000000))
+
+
+def summarize_run(latencies, errors, seconds):
+    requests = sum(len(samples) for samples in latencies.values())
+    return {'requests': requests, 'errors': errors, 'seconds': round(seconds, 3), 'rps': round(requests / seconds, 1),
+            'all': latency_summary([sample for samples in latencies.values() for sample in samples]),
+            'operations': {name: latency_summary(samples) for name, samples in latencies.items()}}
+
+
+def http_client(port, rows, workload, seconds, client):     # One client process, returns {operation: latencies} and errors
+    random.seed(client)
+    names = [name for name, share in workload]
+    weights = [share for name, share in workload]
+    new_skus = new_sku_counter(rows, client)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = {name: [] for name in names}
+    errors = 0
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        method, path, body = workload_request(name, rows, new_skus)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            continue
+        latencies[name].append(time.perf_counter() - start)
+
+    connection.close()
+    return latencies, errors
+
+
+def drive_http(port, rows, workload, clients, seconds):     # Runs client processes against a server and summarizes them
+    context = multiprocessing.get_context('fork')
+    with context.Pool(clients) as pool:
+        runs = pool.starmap(http_client, [(port, rows, workload, seconds, client) for client in range(clients)])
+
+    latencies = {name: [] for name, share in workload}
+    errors = 0
+    for run_latencies, run_errors in runs:
+        errors += run_errors
+        for name, samples in run_latencies.items():
+            latencies[name].extend(samples)
+
+    return summarize_run(latencies, errors, seconds)
+
+
+def drive_test_client(test_client, rows, workload, requests):   # Sends requests one at a time through Flask's test client
+    random.seed(0)
+    names = [name for name, share in workload]
+    weights = [share for name, share in workload]
+    new_skus = new_sku_counter(rows, 0)
+    latencies = {name: [] for name in names}
+    errors = 0
+
+    run_start = time.perf_counter()
+    for _ in range(requests):
+        name = random.choices(names, weights)[0]
+        method, path, body = workload_request(name, rows, new_skus)
+
+        start = time.perf_counter()
+        response = test_client.open(path, method=method, json=body)
+        response.get_data()
+        latencies[name].append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            errors += 1
+
+    return summarize_run(latencies, errors, time.perf_counter() - run_start)
+
+
+def peak_rss_mb(pid='self'):                    # Highest resident memory of a process so far, from /proc
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def seed_shards(config, rows):                  # Seeds each shard's database with the synthetic parts that belong on it
+    for shard in shard_names(config):
+        engine = create_engine(config['SHARD_DATABASE_URI'].format(shard=shard))
+        migrate_schema(engine)
+        parts = [part for part in map(synthetic_part, range(1, rows + 1))
+                 if shard_of(config, part['class_name'], part['sku']) == shard]
+        with engine.begin() as connection:
+            for start in range(0, len(parts), 10000):
+                connection.execute(insert(parts_table), parts[start:start + 10000])
+        engine.dispose()
+
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def bench_throughput(args):
+    engine, path = temporary_engine()
+    shard_directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SQLITE_JOURNAL_MODE': args.journal_mode,
+                  'METRICS_ENABLED': False, 'SEARCH_MIRROR_ENABLED': False,
+                  'QUANTITY_WRITE_BEHIND': args.write_behind != 'off'}
+        if args.write_behind != 'off':
+            config['QUANTITY_ACK'] = args.write_behind
+
+        if args.shard_by != 'none':
+            config.update({'SHARD_BY': args.shard_by, 'SHARD_COUNT': args.shard_count,
+                           'SHARD_DATABASE_URI': f'sqlite:///{shard_directory}/shard_{{shard}}.db'})
+            seed_shards(config, args.rows)
+        else:
+            migrate_schema(engine)
+            seed(engine, args.rows)
+        engine.dispose()
+
+        workload = throughput_workloads[args.workload]
+        for workers in args.workers:
+            port, pids = serve_workers(config, workers)
+            try:
+                time.sleep(0.5)                 # Lets the workers start accepting
+                results[str(workers)] = drive_http(port, args.rows, workload, args.clients, args.seconds)
+            finally:
+                stop_workers(pids)
+    finally:
+        remove_database(path)
+        shutil.rmtree(shard_directory)
+
+    return {'benchmark': 'throughput', 'rows': args.rows, 'clients': args.clients, 'seconds': args.seconds,
+            'journal_mode': args.journal_mode, 'write_behind': args.write_behind, 'workload': dict(workload),
+            'shard_by': args.shard_by, 'shard_count': args.shard_count if args.shard_by == 'sku' else None,
+            'cpus': os.cpu_count(),
+            'by_workers': results}
+
+
+# Load: every endpoint under a realistic mix, through the test client or a local HTTP server
+
+
+def bench_load(args):
+    engine, path = temporary_engine()
+    try:
+        migrate_schema(engine)
+        start = time.perf_counter()
+        seed(engine, args.rows)
+        seed_seconds = time.perf_counter() - start
+        engine.dispose()
+
+        config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'METRICS_ENABLED': False, 'SEARCH_MIRROR_ENABLED': False}
+        if args.driver == 'client':
+            load_app = create_app(config)
+            run = drive_test_client(load_app.test_client(), args.rows, endpoint_workload, args.requests)
+            run['peak_rss_mb'] = peak_rss_mb()
+        else:
+            port, pids = serve_workers(config, args.workers)
+            try:
+                time.sleep(0.5)                 # Lets the workers start accepting
+                run = drive_http(port, args.rows, endpoint_workload, args.clients, args.seconds)
+                run['peak_rss_mb'] = {'workers': [peak_rss_mb(pid) for pid in pids]}
+            finally:
+                stop_workers(pids)
+    finally:
+        remove_database(path)
+
+    return {'benchmark': 'load', 'driver': args.driver, 'rows': args.rows, 'seed_seconds': round(seed_seconds, 3),
+            'workload': dict(endpoint_workload), 'cpus': os.cpu_count(), 'result': run}
+
+
+def main_command():
+    parser = argparse.ArgumentParser(description="Benchmarks for the inventory API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    indexes = commands.add_parser('indexes', help="Search and insert latency with and without indexes")
+    indexes.add_argument('--rows', type=int, default=1000000, help="Parts in the table")
+    indexes.add_argument('--repeat', type=int, default=20, help="Times each search is run")
+    indexes.add_argument('--inserts', type=int, default=200, help="Parts added one at a time")
+    indexes.set_defaults(run=bench_indexes)
+
+    serialize = commands.add_parser('serialize', help="Per-row serialization cost for each class of part")
+    serialize.add_argument('--rows', type=int, default=10000, help="Parts of each class")
+    serialize.add_argument('--repeat', type=int, default=5, help="Runs over the parts, the best is reported")
+    serialize.set_defaults(run=bench_serialize)
+
+    validate = commands.add_parser('validate', help="Per-request cost of parsing and checking a part, reqparse against the compiled arguments")
+    validate.add_argument('--requests', type=int, default=5000, help="Requests of each class in a run")
+    validate.add_argument('--repeat', type=int, default=5, help="Runs of each, the best is reported")
+    validate.set_defaults(run=bench_validate)
+
+    throughput = commands.add_parser('throughput', help="Mixed read/write HTTP throughput across worker counts")
+    throughput.add_argument('--rows', type=int, default=10000, help="Parts in the inventory")
+    throughput.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker process counts to compare")
+    throughput.add_argument('--clients', type=int, default=8, help="Concurrent client processes")
+    throughput.add_argument('--seconds', type=float, default=10, help="Length of each run")
+    throughput.add_argument('--journal-mode', default='WAL', help="SQLite journal mode, e.g. WAL or DELETE")
+    throughput.add_argument('--workload', choices=sorted(throughput_workloads), default='read_write',
+                            help="read_write mixes reads with some writes, scanner is mostly quantity changes, "
+                                 "burst adds ethernet cables in bulk alongside quantity changes")
+    throughput.add_argument('--write-behind', choices=('off', 'flush', 'enqueue'), default='off',
+                            help="Queues quantity changes, answering once written (flush) or once queued (enqueue)")
+    throughput.add_argument('--shard-by', choices=('none', 'class_name', 'sku'), default='none',
+                            help="Spreads the parts over one database per class or SHARD_COUNT databases by SKU")
+    throughput.add_argument('--shard-count', type=int, default=4, help="Databases used with --shard-by sku")
+    throughput.set_defaults(run=bench_throughput)
+
+    load = commands.add_parser('load', help="Every endpoint under a realistic mix of requests")
+    load.add_argument('--rows', type=int, default=10000, help="Parts seeded into the inventory, e.g. 10000, 100000 or 1000000")
+    load.add_argument('--driver', choices=('client', 'http'), default='client',
+                      help="Flask's test client in this process, or a local HTTP server")
+    load.add_argument('--requests', type=int, default=5000, help="Requests sent by the test client driver")
+    load.add_argument('--workers', type=int, default=2, help="Server worker processes for the http driver")
+    load.add_argument('--clients', type=int, default=8, help="Concurrent client processes for the http driver")
+    load.add_argument('--seconds', type=float, default=10, help="Length of an http driver run")
+    load.set_defaults(run=bench_load)
+
+    parser.add_argument('--output', help="Also writes the results to this file")
+
+    args = parser.parse_args()
+    results = json.dumps(args.run(args), indent=4)
+    print(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results + '\n')
+
+
+if __name__ == "__main__":
+    main_command()
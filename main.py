@@ -1,32 +1,122 @@
-from flask import Flask
-from flask_restful import Api, Resource, reqparse, abort, fields, marshal
+from flask import Flask, Response, current_app, g, has_app_context, request, stream_with_context
+from flask.cli import with_appcontext
+from flask_restful import Api, Resource, abort, fields
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import and_, bindparam, case, event, func, insert, inspect, literal, or_, select, text, tuple_, update
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import DeclarativeBase
-from datetime import datetime
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, quote_etag
+from datetime import datetime, timedelta, timezone
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+import atexit
+import bisect
+import click
+import csv
+import hashlib
+import heapq
+import io
+import itertools
+import math
+import operator
+import os
+import re
+import struct
+import sys
+import threading
+import time
 import json
+import zlib
+
+try:
+    import orjson
+except ImportError:                             # orjson is optional, see FAST_JSON below
+    orjson = None
+
+try:
+    import brotli
+except ImportError:                             # brotli and zstandard are optional, gzip is always offered, see COMPRESSION_ENABLED below
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
 
-app = Flask(__name__)
-api = Api(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-
-db.init_app(app)
+class RoutedSession(Session):                   # db.session, sending every statement to the shard it was routed to, see ShardRouter
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get('shard')
+        if bind is None and shard is not None:
+            return self._db.engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutedSession})
+
+default_config = {                              # Each can be overridden with an INVENTORY_<name> environment variable
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///database.db',
+    'PART_CACHE_ENABLED': True,                 # Set to False to serve every part lookup from the database
+    'PART_CACHE_SIZE': 4096,                    # Max number of parts held in the cache
+    'PART_CACHE_TTL': 60,                       # Seconds before a cached part is considered stale
+    'INVENTORY_MAX_PAGE_SIZE': 1000,            # Largest limit accepted by GET /inventory/
+    'INVENTORY_STREAM_BATCH': 500,              # Rows fetched from the database at a time when streaming
+    'FAST_JSON': False,                         # Set to True to encode responses with orjson when it is installed
+    'BULK_CHUNK_SIZE': 500,                     # Parts checked and inserted per transaction by POST /parts/bulk
+    'METRICS_ENABLED': True,                    # Records request latency and SQL counts for /metrics
+    'METRICS_DEBUG_HEADER': False,              # Adds an X-Request-Metrics header with each request's own timings
+    'DB_POOL_SIZE': 10,                         # Connections kept open per worker process
+    'DB_MAX_OVERFLOW': 20,                      # Extra connections a worker may open under load
+    'SQLITE_JOURNAL_MODE': 'WAL',               # WAL lets readers carry on while a write is in progress
+    'SQLITE_SYNCHRONOUS': 'NORMAL',             # With WAL, only syncs at checkpoints; a power loss can drop the last commits
+    'SQLITE_BUSY_TIMEOUT': 5000,                # Milliseconds a connection waits for the write lock before failing
+    'SQLITE_MMAP_SIZE': 268435456,              # Bytes of the database file read through memory mapping
+    'SHARD_BY': None,                           # 'class_name' keeps each class of part in a database of its own,
+                                                # 'sku' spreads parts over SHARD_COUNT databases by SKU
+    'SHARD_COUNT': 4,                           # Databases parts are spread over when SHARD_BY is 'sku'
+    'SHARD_DATABASE_URI': 'sqlite:///database_{shard}.db',     # Database of each shard, {shard} is a class name or a number
+    'SHARD_THREADS': 8,                         # Threads per worker running a query on several shards at once
+    'SHARD_PLACEMENT_CACHE_SIZE': 100000,       # SKUs whose shard each worker remembers when SHARD_BY is 'class_name'
+    'CHANGES_POLL_INTERVAL': 0.5,               # Seconds between checks for new changes while GET /changes waits
+    'CHANGES_MAX_WAIT': 30,                     # Longest wait accepted by a GET /changes long poll
+    'CHANGES_KEEPALIVE': 15,                    # Seconds between keepalive comments on an idle change stream
+    'CHANGES_RETENTION': 604800,                # Seconds deletes stay in the change log before compact-changes drops them
+    'SNAPSHOT_CHUNK_SIZE': 10000,               # Parts read, encoded and inserted at a time by snapshot export and import
+    'ADMIN_ENABLED': False,                     # Serves /admin/snapshot, whose PUT replaces the whole inventory
+    'COMPRESSION_ENABLED': True,                # Compresses responses with zstd, brotli or gzip, whichever the client prefers
+    'COMPRESSION_MIN_SIZE': 1024,               # Bytes below which a body is sent as it is
+    'INVENTORY_DUMP_CACHED': True,              # Serves the full GET /inventory/ from memory, rebuilt and compressed after writes
+    'INVENTORY_DUMP_INTERVAL': 1.0,             # Seconds between checks for writes that made the cached inventory stale
+    'SEARCH_MIRROR_ENABLED': True,              # Keeps the nearest and text search indexes loaded from a thread started by a worker's first request
+    'SEARCH_MIRROR_INTERVAL': 1.0,              # Seconds between background updates of the nearest and text search indexes
+    'MULTI_GET_MAX_SKUS': 2000,                 # Most SKUs one GET or POST /parts can fetch
+    'QUANTITY_WRITE_BEHIND': False,             # Queues quantity changes and writes them in batches from a background thread
+    'QUANTITY_FLUSH_INTERVAL': 0.05,            # Seconds between writes of queued quantity changes
+    'QUANTITY_FLUSH_SIZE': 1000,                # Queued SKUs that trigger a write before the interval is up
+    'QUANTITY_ACK': 'flush',                    # 'flush' answers once a change is committed, 'enqueue' once it is queued,
+                                                # which is faster but loses the last interval of changes if the process dies
+}
 
 class PartModel(db.Model):
     __tablename__ = 'parts'
 
     sku = db.Column(db.Integer, primary_key=True, nullable=False, autoincrement=True)
-    class_name = db.Column(db.String(100), nullable=False)
+    class_name = db.Column(db.String(100), nullable=False, index=True)
     date_last_updated = db.Column(db.DateTime, nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, index=True)
+    reorder_point = db.Column(db.Integer, nullable=True)      # Quantity at or below which the part is reported as low stock
 
     __mapper_args__ = {
         'polymorphic_identity': 'part',
-        'polymorphic_on': class_name
+        'polymorphic_on': class_name,
+        'with_polymorphic': '*'         # Loads subclass columns with the base row so one query resolves any part
     }
 
     def __repr__(self):
@@ -34,409 +124,2040 @@ class PartModel(db.Model):
                 f"date_last_updated = {self.date_last_updated}, quantity = {self.quantity})")
 
 
-class ResistorModel(PartModel):
-    __tablename__ = 'resistors'
-    __mapper_args__ = {'polymorphic_identity': 'resistor'}
+def identity_index(class_name, *columns):      # Unique index on the characteristics that identify a part of one class
+    # Other classes leave these columns NULL, and NULLs never collide in a unique index.
+    # The index also serves searches on its leading column, so that column has no index of its own.
+    return db.Index(f'uq_parts_{class_name}_identity', *columns, unique=True)
 
-    def __init__(self, resistance, tolerance, sku, class_name, date_last_updated, quantity, *args, **kwargs):
-        super().__init__(sku=sku, class_name=class_name, date_last_updated=date_last_updated, quantity=quantity, *args, **kwargs)
-        self.resistance = resistance
-        self.tolerance = tolerance
 
-    resistance = db.Column(db.Integer, nullable=True)
-    tolerance = db.Column(db.Integer, nullable=True)
+def part_label(class_name):                     # 'display_cable' -> 'display cable'
+    return class_name.replace('_', ' ')
 
-    def __repr__(self):
-        return (f"Resistor(sku = {self.sku}, resistance = {self.resistance}, tolerance = {self.tolerance})")
 
+def quoted_list(values):                        # ['a', 'b', 'c'] -> "'a', 'b', and 'c'"
+    quoted = [f"'{value}'" for value in values]
+    if len(quoted) < 3:
+        return ' and '.join(quoted)
+    return ', '.join(quoted[:-1]) + ', and ' + quoted[-1]
 
-class SolderModel(PartModel):
-    __tablename__ = 'solders'
-    __mapper_args__ = {'polymorphic_identity': 'solder'}
 
-    def __init__(self, solder_type, solder_length, sku, class_name, date_last_updated, quantity, *args, **kwargs):
-        super().__init__(sku=sku, class_name=class_name, date_last_updated=date_last_updated, quantity=quantity, *args, **kwargs)
-        self.solder_type = solder_type
-        self.solder_length = solder_length
+column_types = {int: db.Integer, float: db.Float, str: db.String}     # Python type of a characteristic -> its column type
+type_names = {int: 'integer', float: 'float', str: 'string'}
 
-    solder_type = db.Column(db.String, nullable=True)
-    solder_length = db.Column(db.Float, nullable=True)
 
-    def __repr__(self):
-        return (f"Solder(sku = {self.sku}, solder_type = {self.solder_type}, solder_length = {self.solder_length})")
+class PartType:                                 # Declares one class of part; its model, index, arguments, schema and messages are built from this
 
+    def __init__(self, class_name, characteristics, valid_values=None, identity=None, searchable=None):
+        self.class_name = class_name
+        self.label = part_label(class_name)
+        self.characteristics = characteristics                  # Name -> Python type, in column order
+        self.valid_values = valid_values or {}                  # Characteristics with a fixed set of values
+        self.value_sets = {characteristic: frozenset(values) for characteristic, values in self.valid_values.items()}
+        self.identity = identity or tuple(characteristics)      # Required, and together unique within the class
+        self.searchable = searchable or tuple(characteristics)
+        self.invalid_value_messages = {
+            characteristic: f"Invalid {part_label(characteristic)}. "
+                            f"Valid {part_label(characteristic)}s are {quoted_list(values)}"
+            for characteristic, values in self.valid_values.items()}
+        self.model = self.build_model()
+        identity_index(class_name, *(getattr(self.model, characteristic) for characteristic in self.identity))
 
-class WireModel(PartModel):
-    __tablename__ = 'wires'
-    __mapper_args__ = {'polymorphic_identity': 'wire'}
+    def build_model(self):                      # Single table inheritance subclass of PartModel, its columns live on parts
+        name = ''.join(word.capitalize() for word in self.class_name.split('_'))
+        characteristics = tuple(self.characteristics)
 
-    def __init__(self, gauge, wire_length, sku, class_name, date_last_updated, quantity, *args, **kwargs):
-        super().__init__(sku=sku, class_name=class_name, date_last_updated=date_last_updated, quantity=quantity, *args, **kwargs)
-        self.gauge = gauge
-        self.wire_length = wire_length
+        def __repr__(part):
+            values = ', '.join(f"{characteristic} = {getattr(part, characteristic)}" for characteristic in characteristics)
+            return f"{name}(sku = {part.sku}, {values})"
 
-    gauge = db.Column(db.Float, nullable=True)
-    wire_length = db.Column(db.Float, nullable=True)
+        namespace = {'__mapper_args__': {'polymorphic_identity': self.class_name}, '__repr__': __repr__}
+        for characteristic, kind in self.characteristics.items():
+            indexed = characteristic in self.searchable and characteristic != self.identity[0]
+            namespace[characteristic] = db.Column(column_types[kind], nullable=True, index=indexed)
+        return type(f'{name}Model', (PartModel,), namespace)
 
-    def __repr__(self):
-        return (f"Wire(sku = {self.sku}, gauge = {self.gauge}, wire_length = {self.wire_length})")
 
+part_types = {part_type.class_name: part_type for part_type in (
+    PartType('resistor', {'resistance': int, 'tolerance': int}),
+    PartType('solder', {'solder_type': str, 'solder_length': float},
+             valid_values={'solder_type': ('lead', 'lead-free', 'rosin-core', 'acid-core')}),
+    PartType('wire', {'gauge': float, 'wire_length': float}),
+    PartType('display_cable', {'display_cable_type': str, 'display_cable_length': float, 'display_cable_color': str},
+             valid_values={'display_cable_type': ('hdmi', 'vga', 'displayport', 'micro-hdmi')}),
+    PartType('ethernet_cable', {'alpha_type': str, 'beta_type': str, 'speed': str, 'ethernet_cable_length': float},
+             valid_values={'alpha_type': ('male', 'female'), 'beta_type': ('male', 'female'),
+                           'speed': ('10mbps', '100mbps', '1gbps', '10gbps')}),
+)}
+
+part_models = {class_name: part_type.model for class_name, part_type in part_types.items()}
+
+# The generated models under the names they had when they were written out by hand, for code importing them from main
+ResistorModel = part_models['resistor']
+SolderModel = part_models['solder']
+WireModel = part_models['wire']
+DisplayCableModel = part_models['display_cable']
+EthernetCableModel = part_models['ethernet_cable']
+
+part_characteristics = {                        # Characteristics that are required for and identify each class of part
+    class_name: part_type.identity for class_name, part_type in part_types.items()}
 
-class DisplayCableModel(PartModel):
-    __tablename__ = 'display_cables'
-    __mapper_args__ = {'polymorphic_identity': 'display_cable'}
+invalid_class_message = f"Invalid class name. Valid class names are {quoted_list(part_types)}"
 
-    def __init__(self, display_cable_type, display_cable_length, display_cable_color, sku, class_name, date_last_updated, quantity, *args, **kwargs):
-        super().__init__(sku=sku, class_name=class_name, date_last_updated=date_last_updated, quantity=quantity, *args, **kwargs)
-        self.display_cable_type = display_cable_type
-        self.display_cable_length = display_cable_length
-        self.display_cable_color = display_cable_color
 
-    display_cable_type = db.Column(db.String, nullable=True)
-    display_cable_length = db.Column(db.Float, nullable=True)
-    display_cable_color = db.Column(db.String, nullable=True)
+low_stock = PartModel.quantity <= PartModel.reorder_point
+
+# Only hold low stock parts, so listing them, with or without a class, never reads the rest of the table
+db.Index('ix_parts_low_stock', PartModel.class_name, PartModel.sku, sqlite_where=low_stock, postgresql_where=low_stock)
+db.Index('ix_parts_low_stock_sku', PartModel.sku, sqlite_where=low_stock, postgresql_where=low_stock)
+
+
+class StockLevelModel(db.Model):                # Part count, total quantity and low stock count per class and per value of its characteristics
+    __tablename__ = 'stock_levels'
+
+    class_name = db.Column(db.String(100), primary_key=True)
+    attribute = db.Column(db.String(100), primary_key=True)    # '' on the row holding the totals of the whole class
+    value = db.Column(db.String, primary_key=True)
+    part_count = db.Column(db.Integer, nullable=False)
+    total_quantity = db.Column(db.Integer, nullable=False)
+    low_stock_count = db.Column(db.Integer, nullable=False)
 
     def __repr__(self):
-        return (f"DisplayCable(sku = {self.sku}, display_cable_type = {self.display_cable_type}, "
-                f"display_cable_length = {self.display_cable_length}, display_cable_color = {self.display_cable_color})")
+        return (f"StockLevel(class_name = {self.class_name}, attribute = {self.attribute}, value = {self.value}, "
+                f"part_count = {self.part_count}, total_quantity = {self.total_quantity}, "
+                f"low_stock_count = {self.low_stock_count})")
+
 
+class InventoryVersionModel(db.Model):          # Single row counting the changes made to the parts table
+    __tablename__ = 'inventory_version'
 
-class EthernetCableModel(PartModel):
-    __tablename__ = 'ethernet_cables'
-    __mapper_args__ = {'polymorphic_identity': 'ethernet_cable'}
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    compacted_seq = db.Column(db.Integer, nullable=True)     # Deletes up to this change were dropped from part_changes
 
-    def __init__(self, alpha_type, beta_type, speed, ethernet_cable_length, sku, class_name, date_last_updated, quantity, *args, **kwargs):
-        super().__init__(sku=sku, class_name=class_name, date_last_updated=date_last_updated, quantity=quantity, *args, **kwargs)
-        self.alpha_type = alpha_type
-        self.beta_type = beta_type
-        self.speed = speed
-        self.ethernet_cable_length = ethernet_cable_length
+    def __repr__(self):
+        return f"InventoryVersion(version = {self.version}, compacted_seq = {self.compacted_seq})"
 
-    alpha_type = db.Column(db.String, nullable=True)
-    beta_type = db.Column(db.String, nullable=True)
-    speed = db.Column(db.String, nullable=True)
-    ethernet_cable_length = db.Column(db.Float, nullable=True)
+
+class PartChangeModel(db.Model):                # Latest change to each SKU, numbered in the order changes were committed
+    __tablename__ = 'part_changes'
+    __table_args__ = {'sqlite_autoincrement': True}     # Sequence numbers are never reused, even once rows are deleted
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    sku = db.Column(db.Integer, nullable=False, index=True)
+    operation = db.Column(db.String(10), nullable=False)    # 'insert', 'update' or 'delete'
+    changed_at = db.Column(db.DateTime, nullable=False)     # UTC
 
     def __repr__(self):
-        return (f"EthernetCable(sku = {self.sku}, alpha_type = {self.alpha_type}, "
-                f"beta_type = {self.beta_type}, speed = {self.speed}, ethernet_cable_length = {self.ethernet_cable_length})")
+        return f"PartChange(seq = {self.seq}, sku = {self.sku}, operation = {self.operation}, changed_at = {self.changed_at})"
+
+
+stock_level_attributes = {                      # Characteristics with a fixed set of values, each counted in stock_levels
+    class_name: tuple(part_type.valid_values) for class_name, part_type in part_types.items()}
+
+
+def stock_level_statements(class_name, row, sign):     # SQL that counts (sign '+') or uncounts (sign '-') a part of class_name a trigger sees as row
+    targets = [("''", "''")] + [(f"'{attribute}'", f"{row}.{attribute}") for attribute in stock_level_attributes[class_name]]
+    statements = []
+    for attribute, value in targets:
+        if sign == '+':
+            statements.append(f"INSERT INTO stock_levels (class_name, attribute, value, part_count, total_quantity, "
+                              f"low_stock_count) SELECT '{class_name}', {attribute}, {value}, 0, 0, 0 "
+                              f"WHERE {value} IS NOT NULL ON CONFLICT DO NOTHING")
+        statements.append(f"UPDATE stock_levels SET part_count = part_count {sign} 1, "
+                          f"total_quantity = total_quantity {sign} {row}.quantity, "
+                          f"low_stock_count = low_stock_count {sign} "
+                          f"CASE WHEN {row}.quantity <= {row}.reorder_point THEN 1 ELSE 0 END "
+                          f"WHERE class_name = '{class_name}' AND attribute = {attribute} AND value = {value}")
+    if sign == '-':                             # Only uncounting can leave a value no part has
+        statements.append(f"DELETE FROM stock_levels WHERE class_name = '{class_name}' AND part_count = 0")
+    return statements
+
+
+def stock_level_moves(class_name):              # SQL moving quantity and low stock counts when an update keeps every counted value
+    targets = [("''", "''")] + [(f"'{attribute}'", f"NEW.{attribute}") for attribute in stock_level_attributes[class_name]]
+    return [f"UPDATE stock_levels SET total_quantity = total_quantity - OLD.quantity + NEW.quantity, "
+            f"low_stock_count = low_stock_count "
+            f"- CASE WHEN OLD.quantity <= OLD.reorder_point THEN 1 ELSE 0 END "
+            f"+ CASE WHEN NEW.quantity <= NEW.reorder_point THEN 1 ELSE 0 END "
+            f"WHERE class_name = '{class_name}' AND attribute = {attribute} AND value = {value}"
+            for attribute, value in targets]
+
+
+def keeps_stock_values(class_name, same):       # Condition of an update that leaves a part of class_name counted under the same values
+    return ' AND '.join([f"OLD.class_name = '{class_name}'", f"NEW.class_name = '{class_name}'"] +
+                        [f"OLD.{attribute} {same} NEW.{attribute}" for attribute in stock_level_attributes[class_name]])
+
+
+trigger_dialects = ('sqlite', 'postgresql')     # Databases whose parts table gets the triggers below
+
+
+def change_statements(row, operation, now):     # SQL that records operation on the part a trigger sees as row in part_changes
+    # Replacing the SKU's previous entry keeps one entry per SKU, which is all a replica needs to catch up
+    return [f"DELETE FROM part_changes WHERE sku = {row}.sku",
+            f"INSERT INTO part_changes (sku, operation, changed_at) VALUES ({row}.sku, {operation}, {now})"]
+
+
+def part_triggers(dialect_name):                # Statements (re)creating the triggers that keep stock_levels, inventory_version and part_changes up to date
+    # Bumping the version locks its row until commit, so changes get their sequence numbers in commit order
+    bump = "UPDATE inventory_version SET version = version + 1"
+
+    if dialect_name == 'sqlite':
+        # Each class's triggers only touch its own counters, so a quantity change runs a handful of statements
+        triggers = {
+            'parts_insert': ('AFTER INSERT ON parts', [bump] + change_statements('NEW', "'insert'", 'CURRENT_TIMESTAMP')),
+            'parts_delete': ('AFTER DELETE ON parts', [bump] + change_statements('OLD', "'delete'", 'CURRENT_TIMESTAMP')),
+            'parts_update': ('AFTER UPDATE ON parts', [bump] + change_statements('NEW', "'update'", 'CURRENT_TIMESTAMP')),
+        }
+        for class_name in part_types:
+            kept = keeps_stock_values(class_name, 'IS')
+            # Only an update setting the class or a counted characteristic can move a part between counters
+            moved = f"AFTER UPDATE OF {', '.join(('class_name',) + stock_level_attributes[class_name])} ON parts"
+            triggers.update({
+                f'stock_levels_insert_{class_name}': (f"AFTER INSERT ON parts WHEN NEW.class_name = '{class_name}'",
+                                                      stock_level_statements(class_name, 'NEW', '+')),
+                f'stock_levels_delete_{class_name}': (f"AFTER DELETE ON parts WHEN OLD.class_name = '{class_name}'",
+                                                      stock_level_statements(class_name, 'OLD', '-')),
+                f'stock_levels_update_{class_name}': (f"AFTER UPDATE OF quantity, reorder_point ON parts WHEN {kept}",
+                                                      stock_level_moves(class_name)),
+                f'stock_levels_update_from_{class_name}': (f"{moved} WHEN OLD.class_name = '{class_name}' AND NOT ({kept})",
+                                                           stock_level_statements(class_name, 'OLD', '-')),
+                f'stock_levels_update_to_{class_name}': (f"{moved} WHEN NEW.class_name = '{class_name}' AND NOT ({kept})",
+                                                         stock_level_statements(class_name, 'NEW', '+')),
+            })
+        statements = [f"DROP TRIGGER IF EXISTS {name}"     # Earlier versions counted every class in these
+                      for name in ('stock_levels_insert', 'stock_levels_delete', 'stock_levels_update')]
+        for name, (timing, body) in triggers.items():
+            statements.append(f"DROP TRIGGER IF EXISTS {name}")
+            statements.append(f"CREATE TRIGGER {name} {timing} BEGIN {'; '.join(body)}; END")
+        return statements
+
+    if dialect_name == 'postgresql':
+        now = "(now() AT TIME ZONE 'UTC')"
+
+        def by_class(row, statements):          # IF ... ELSIF ... running the statements of the row's class
+            return ' ELSIF '.join(f"{row}.class_name = '{class_name}' THEN {'; '.join(statements(class_name))};"
+                                  for class_name in part_types)
+
+        moves = ' ELSIF '.join(f"{keeps_stock_values(class_name, 'IS NOT DISTINCT FROM')} THEN "
+                               f"{'; '.join(stock_level_moves(class_name))};" for class_name in part_types)
+        add = by_class('NEW', lambda class_name: stock_level_statements(class_name, 'NEW', '+'))
+        remove = by_class('OLD', lambda class_name: stock_level_statements(class_name, 'OLD', '-'))
+        return [
+            f"CREATE OR REPLACE FUNCTION count_stock_levels() RETURNS trigger AS $$ BEGIN "
+            f"IF TG_OP = 'INSERT' THEN IF {add} END IF; "
+            f"ELSIF TG_OP = 'DELETE' THEN IF {remove} END IF; "
+            f"ELSIF {moves} "
+            f"ELSE IF {remove} END IF; IF {add} END IF; END IF; "
+            f"{bump}; "
+            f"IF TG_OP = 'DELETE' THEN {'; '.join(change_statements('OLD', 'lower(TG_OP)', now))}; "
+            f"ELSE {'; '.join(change_statements('NEW', 'lower(TG_OP)', now))}; END IF; "
+            f"RETURN NULL; END; $$ LANGUAGE plpgsql",
+            "DROP TRIGGER IF EXISTS stock_levels_parts ON parts",
+            "CREATE TRIGGER stock_levels_parts AFTER INSERT OR UPDATE OR DELETE ON parts "
+            "FOR EACH ROW EXECUTE FUNCTION count_stock_levels()",
+        ]
+
+    return []                                   # Other databases only get stock_levels recounted by migrate, and no versions
+
+
+def recount_stock_levels(connection):           # Rebuilds stock_levels from the parts table
+    connection.execute(StockLevelModel.__table__.delete())
+    columns = ['class_name', 'attribute', 'value', 'part_count', 'total_quantity', 'low_stock_count']
+    counts = [func.count(), func.sum(PartModel.quantity), func.sum(case((low_stock, 1), else_=0))]
+
+    class_totals = select(PartModel.class_name, literal(''), literal(''), *counts).group_by(PartModel.class_name)
+    connection.execute(insert(StockLevelModel).from_select(columns, class_totals))
+
+    for class_name, attributes in stock_level_attributes.items():     # Each class only counts its own characteristics, like the triggers
+        for attribute in attributes:
+            value = PartModel.__table__.c[attribute]
+            value_totals = (select(PartModel.class_name, literal(attribute), value, *counts)
+                            .where(PartModel.class_name == class_name, value.is_not(None)).group_by(PartModel.class_name, value))
+            connection.execute(insert(StockLevelModel).from_select(columns, value_totals))
+
+
+def migrate_schema(bind=None):                  # Brings a new or existing database up to date with the models
+    if bind is None and shard_router.enabled:   # Every shard holds the whole schema, with its own triggers and counters
+        for engine in shard_router.engines():
+            migrate_schema(engine)
+        return
+
+    if not isinstance(bind, Connection):
+        with (bind if bind is not None else db.engine).begin() as connection:
+            return migrate_schema(connection)
+
+    db.metadata.create_all(bind)
+
+    for table in db.metadata.sorted_tables:     # Columns added to the models since the tables were created
+        existing_columns = {column['name'] for column in inspect(bind).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                bind.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                  f"{column.type.compile(bind.dialect)}"))
+
+    for index in PartModel.__table__.indexes:
+        index.create(bind, checkfirst=True)
+
+    if bind.scalar(select(func.count()).select_from(InventoryVersionModel)) == 0:
+        bind.execute(insert(InventoryVersionModel).values(id=1, version=0))
+
+    for statement in part_triggers(bind.dialect.name):
+        bind.execute(text(statement))
+    recount_stock_levels(bind)
+
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():                          # flask --app main migrate
+    migrate_schema()
+
+
+def compact_changes(retention, bind=None):      # Drops deletes older than retention seconds from part_changes, returns how many
+    if bind is None and shard_router.enabled:
+        return sum(compact_changes(retention, engine) for engine in shard_router.engines())
+
+    if not isinstance(bind, Connection):
+        with (bind if bind is not None else db.engine).begin() as connection:
+            return compact_changes(retention, connection)
+
+    # Only deletes are dropped, since every part still in the inventory has exactly one entry
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=retention)
+    horizon = bind.scalar(select(func.max(PartChangeModel.seq))
+                          .where(PartChangeModel.operation == 'delete', PartChangeModel.changed_at < cutoff))
+    if horizon is None:
+        return 0
 
+    removed = bind.execute(PartChangeModel.__table__.delete()
+                           .where(PartChangeModel.operation == 'delete', PartChangeModel.seq <= horizon)).rowcount
+    compacted_seq = bind.scalar(select(InventoryVersionModel.compacted_seq))
+    bind.execute(update(InventoryVersionModel).values(compacted_seq=max(compacted_seq or 0, horizon)))
+    return removed
 
-part_put_args = reqparse.RequestParser()          # Parses the data that is passed in
-part_put_args.add_argument("sku", type=int, help="SKU is required", required=True)
 
-part_put_args.add_argument("class_name", type=str, help="Class name is required", required=True)
-part_put_args.add_argument("quantity", type=int, help="Quantity is required", required=True)
+@click.command('compact-changes')
+@click.option('--retention', type=int, default=None, help="Seconds to keep deletes, CHANGES_RETENTION by default")
+@with_appcontext
+def compact_changes_command(retention):         # flask --app main compact-changes
+    if retention is None:
+        retention = current_app.config['CHANGES_RETENTION']
+    click.echo(f"Removed {compact_changes(retention)} deletes from the change log")
 
-part_put_args.add_argument("resistance", type=int, help="Invalid resistance, must be integer", required=False)
-part_put_args.add_argument("tolerance", type=int, help="Invalid tolerance, must be integer", required=False)
 
-part_put_args.add_argument("solder_type", type=str, help="Invalid solder type, must be string", required=False)
-part_put_args.add_argument("solder_length", type=float, help="Invalid solder length, must be float", required=False)
+def request_values(location=None):              # Raw values from the query string, with the body merged in unless location is 'args'
+    values = request.args.to_dict()
+    if location == 'args':
+        return values
+    if request.is_json:
+        body = request.get_json()           # A malformed body is a 400, a body that isn't an object is ignored
+        if isinstance(body, dict):
+            values.update(body)
+    else:
+        values.update(request.form.to_dict())   # Form bodies, which reqparse read as well
+    return values
 
-part_put_args.add_argument("gauge", type=float, help="Invalid gauge, must be float", required=False)
-part_put_args.add_argument("wire_length", type=float, help="Invalid wire length, must be float", required=False)
 
-part_put_args.add_argument("display_cable_type", type=str, help="Invalid display cable type, must be string", required=False)
-part_put_args.add_argument("display_cable_length", type=float, help="Invalid display cable length, must be float", required=False)
-part_put_args.add_argument("display_cable_color", type=str, help="Invalid display cable color, must be string", required=False)
+def to_int(value):                              # Like int(), but refuses booleans and floats with a fraction instead of truncating them
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    return int(value)
 
-part_put_args.add_argument("alpha_type", type=str, help="Invalid alpha type, must be string", required=False)
-part_put_args.add_argument("beta_type", type=str, help="Invalid beta type, must be string", required=False)
-part_put_args.add_argument("speed", type=str, help="Invalid speed, must be string", required=False)
-part_put_args.add_argument("ethernet_cable_length", type=float, help="Invalid ethernet cable length, must be float", required=False)
 
+def to_float(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return float(value)
+
+
+def to_str(value):                              # Strings only, so a number is never taken for a type or a color
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return value
+
+
+coercions = {int: to_int, float: to_float, str: to_str}
+
+Argument = namedtuple('Argument', ('name', 'type', 'coerce', 'help', 'required', 'default', 'choices'))
+
+
+class RequestArguments:                         # Declared like a reqparse parser, checks a dict of raw values in one pass
+
+    def __init__(self, location=None):
+        self.location = location            # 'args' reads only the query string, otherwise the JSON or form body too
+        self.args = []
+
+    def add_argument(self, name, type=str, help=None, required=False, default=None, choices=None):
+        self.args.append(Argument(name, type, coercions[type], help, required, default,
+                                  frozenset(choices) if choices else None))
+
+    def parse(self, values):                # Returns (args, None), or (None, (name, help)) for the first missing or invalid argument
+        args = {}
+        for name, type, coerce, help, required, default, choices in self.args:
+            value = values.get(name)
+            if value is None:
+                if required:
+                    return None, (name, help)
+                args[name] = default
+                continue
+
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError):
+                return None, (name, help)
+            if choices and value not in choices:
+                return None, (name, help)
+            args[name] = value
+
+        return args, None
+
+    def parse_args(self):                   # Parses the current request, aborting on an error
+        return check_arguments(self.parse(request_values(self.location)))
+
+
+def check_arguments(result):                    # Aborts with the {name: help} body reqparse used, otherwise returns the args
+    args, error = result
+    if error:
+        abort(400, message={error[0]: error[1]})
+    return args
+
+
+part_put_args = RequestArguments()              # Arguments every part has, those of its class are in class_put_args
+part_put_args.add_argument("sku", type=int, help="SKU is required", required=True)
+
+part_put_args.add_argument("class_name", type=str, help="Class name is required", required=True)
+part_put_args.add_argument("quantity", type=int, help="Quantity is required", required=True)
+part_put_args.add_argument("reorder_point", type=int, help="Invalid reorder point, must be integer", required=False)
 
 
-part_search_args = reqparse.RequestParser()
+part_search_args = RequestArguments()           # Arguments of every search, those of the searched class are in class_search_args
 part_search_args.add_argument("sku", type=int, help="SKU", required=False)
 
 part_search_args.add_argument("class_name", type=str, help="Class name is required", required=True)
 part_search_args.add_argument("quantity", type=int, help="Quantity", required=False)
 
-part_search_args.add_argument("resistance", type=int, help="Resistance", required=False)
-part_search_args.add_argument("tolerance", type=int, help="Tolerance", required=False)
+part_search_args.add_argument("match", type=str, choices=('any', 'all'), default='any',
+                              help="Invalid match, must be 'any' or 'all'", required=False)
+part_search_args.add_argument("limit", type=int, help="Invalid limit, must be integer", required=False)
+part_search_args.add_argument("cursor", type=int, help="Invalid cursor, must be integer", required=False)
+part_search_args.add_argument("offset", type=int, help="Invalid offset, must be integer", required=False)
+part_search_args.add_argument("order_by", type=str, help="Invalid order_by, must be string", required=False)
+part_search_args.add_argument("low_stock_below", type=int, help="Invalid low_stock_below, must be integer", required=False)
 
-part_search_args.add_argument("solder_type", type=str, help="Solder Type", required=False)
-part_search_args.add_argument("solder_length", type=float, help="Solder Length", required=False)
 
-part_search_args.add_argument("gauge", type=float, help="Gauge", required=False)
-part_search_args.add_argument("wire_length", type=float, help="Wire Length", required=False)
+class_put_args = {}                             # Characteristics of each class of part, so a request only checks its own
+class_search_args = {}
+for class_name, part_type in part_types.items():
+    class_put_args[class_name] = RequestArguments()
+    for characteristic, kind in part_type.characteristics.items():
+        class_put_args[class_name].add_argument(characteristic, type=kind, required=False,
+                                                help=f"Invalid {part_label(characteristic)}, must be {type_names[kind]}")
 
-part_search_args.add_argument("display_cable_type", type=str, help="Display Cable Type", required=False)
-part_search_args.add_argument("display_cable_length", type=float, help="Display Cable Length", required=False)
-part_search_args.add_argument("display_cable_color", type=str, help="Display Cable Color", required=False)
+    class_search_args[class_name] = RequestArguments()
+    for characteristic in part_type.searchable:
+        class_search_args[class_name].add_argument(characteristic, type=part_type.characteristics[characteristic],
+                                                   help=part_label(characteristic).title(), required=False)
 
-part_search_args.add_argument("alpha_type", type=str, help="Alpha Type", required=False)
-part_search_args.add_argument("beta_type", type=str, help="Beta Type", required=False)
-part_search_args.add_argument("speed", type=str, help="Speed", required=False)
-part_search_args.add_argument("ethernet_cable_length", type=float, help="Ethernet Cable Length", required=False)
 
+def parse_class_values(parser, class_parsers, values):     # Parses the common arguments, then those of the class named in them
+    args, error = parser.parse(values)
+    if error or args['class_name'] not in class_parsers:
+        return args, error
 
-part_patch_args = reqparse.RequestParser()
+    characteristics, error = class_parsers[args['class_name']].parse(values)
+    if error:
+        return None, error
+    args.update(characteristics)
+    return args, None
+
+
+def parse_part(values):                         # Coerces a raw part, returns (args, (name, help)) on error
+    return parse_class_values(part_put_args, class_put_args, values)
+
+
+def parse_search(values):
+    return parse_class_values(part_search_args, class_search_args, values)
+
+part_patch_args = RequestArguments()
 part_patch_args.add_argument("sku", type=int, help="SKU is required", required=True)
 part_patch_args.add_argument("quantity", type=int, help="New quantity is required", required=True)
+part_patch_args.add_argument("reorder_point", type=int, help="Invalid reorder point, must be integer", required=False)
 
 
+inventory_get_args = RequestArguments(location='args')
+inventory_get_args.add_argument("limit", type=int, help="Invalid limit, must be integer", required=False)
+inventory_get_args.add_argument("cursor", type=int, help="Invalid cursor, must be integer", required=False)
+inventory_get_args.add_argument("stream", type=str, choices=('json', 'ndjson'),
+                                help="Invalid stream format, must be 'json' or 'ndjson'", required=False)
 
-resistor_schema = {
-    'sku': fields.Integer,
-    'class_name': fields.String,
-    'date_last_updated': fields.DateTime(dt_format='iso8601'),
-    'quantity': fields.Integer,
-    'resistance': fields.Integer,
-    'tolerance': fields.Integer,
-}
 
-solder_schema = {
-    'sku': fields.Integer,
-    'class_name': fields.String,
-    'date_last_updated': fields.DateTime(dt_format='iso8601'),
-    'quantity': fields.Integer,
-    'solder_type': fields.String,
-    'solder_length': fields.Float,
-}
+changes_get_args = RequestArguments(location='args')
+changes_get_args.add_argument("since", type=int, help="Invalid since, must be integer", required=False)
+changes_get_args.add_argument("limit", type=int, help="Invalid limit, must be integer", required=False)
+changes_get_args.add_argument("wait", type=float, help="Invalid wait, must be a number of seconds", required=False)
+changes_get_args.add_argument("stream", type=str, choices=('sse',),
+                              help="Invalid stream format, must be 'sse'", required=False)
+
+
+low_stock_args = RequestArguments(location='args')
+low_stock_args.add_argument("class_name", type=str, help="Invalid class name, must be string", required=False)
+low_stock_args.add_argument("limit", type=int, help="Invalid limit, must be integer", required=False)
+low_stock_args.add_argument("cursor", type=int, help="Invalid cursor, must be integer", required=False)
 
-wire_schema = {
-    'sku': fields.Integer,
-    'class_name': fields.String,
-    'date_last_updated': fields.DateTime(dt_format='iso8601'),
-    'quantity': fields.Integer,
-    'gauge': fields.Float,
-    'wire_length': fields.Float,
-}
 
-display_cable_schema = {
-    'sku': fields.Integer,
-    'class_name': fields.String,
-    'date_last_updated': fields.DateTime(dt_format='iso8601'),
-    'quantity': fields.Integer,
-    'display_cable_type': fields.String,
-    'display_cable_length': fields.Float,
-    'display_cable_color': fields.String,
-}
 
-ethernet_cable_schema = {
+field_types = {int: fields.Integer, float: fields.Float, str: fields.String}
+
+common_schema = {
     'sku': fields.Integer,
     'class_name': fields.String,
     'date_last_updated': fields.DateTime(dt_format='iso8601'),
     'quantity': fields.Integer,
-    'alpha_type': fields.String,
-    'beta_type': fields.String,
-    'speed': fields.String,
-    'ethernet_cable_length': fields.Float,
+    'reorder_point': fields.Integer,
 }
 
+part_schemas = {
+    class_name: dict(common_schema, **{characteristic: field_types[kind]
+                                       for characteristic, kind in part_type.characteristics.items()})
+    for class_name, part_type in part_types.items()}
 
-def generate_schema(subclass):                  # Generates a schema for a part based on its class
-    schema = {}
-    if subclass == ResistorModel:
-        schema = resistor_schema
-    elif subclass == SolderModel:
-        schema = solder_schema
-    elif subclass == WireModel:
-        schema = wire_schema
-    elif subclass == DisplayCableModel:
-        schema = display_cable_schema
-    elif subclass == EthernetCableModel:
-        schema = ethernet_cable_schema
 
-    return schema
+class PartSerializer:                           # Turns parts of one class into plain dicts with a single pass over its schema
 
-class Add_Part(Resource):
+    def __init__(self, schema):
+        self.columns = tuple(schema)
+        self.table_columns = [PartModel.__table__.c[column] for column in self.columns]
+        self.read = operator.attrgetter(*self.columns)
+        self.dates = [column for column, field in schema.items() if isinstance(field, fields.DateTime)]
+
+    def from_row(self, row):                    # row holds the schema's columns in order, e.g. a raw SQL row
+        part = dict(zip(self.columns, row))
+        for column in self.dates:
+            if part[column] is not None:
+                part[column] = part[column].isoformat()
+        return part
+
+    def from_part(self, part):
+        return self.from_row(self.read(part))
+
+
+part_serializers = {class_name: PartSerializer(schema) for class_name, schema in part_schemas.items()}
+
+
+def serialize_part(part):                       # Serializes a part of any class with its own schema
+    return part_serializers[part.class_name].from_part(part)
+
+
+def serialize_parts(parts):                     # Serializes a list of parts, timed once for the whole list
+    start = time.perf_counter()
+    serialized = [serialize_part(part) for part in parts]
+    add_serialize_time(start)
+    return serialized
+
+
+def json_bytes(value, fast=False):              # Compact JSON bytes, with orjson when fast is set and it is installed
+    if orjson and fast:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def encode_json(value, fast=False):             # json_bytes, timed towards the request's serialize time
+    start = time.perf_counter()
+    encoded = json_bytes(value, fast)
+    add_serialize_time(start)
+    return encoded
 
-    def put(self):                          # Adds a part
-        args = part_put_args.parse_args()
 
+def dump_json(value):
+    return encode_json(value, current_app.config['FAST_JSON'])
+
+
+def json_response(value, status=200, headers=None):     # Sends JSON straight to the client so Flask-RESTful doesn't encode it a second time
+    return Response(dump_json(value), status=status, mimetype='application/json', headers=headers)
+
+
+def validate_part(args):                        # Checks a parsed part against the rules for its class, returns (status, message) or None
+    class_name = args['class_name']
+
+    if class_name not in part_types:
+        return 400, invalid_class_message
+
+    if args['quantity'] < 0:
+        return 400, "Quantity cannot be negative"
+
+    if args.get('reorder_point') is not None and args['reorder_point'] < 0:
+        return 400, "Reorder point cannot be negative"
+
+    part_type = part_types[class_name]
+    if any(not args[characteristic] for characteristic in part_type.identity):
+        return 400, f"{part_type.label.capitalize()} characteristics not provided"
+
+    for characteristic, values in part_type.value_sets.items():
+        if args.get(characteristic) is not None and args[characteristic] not in values:
+            return 400, part_type.invalid_value_messages[characteristic]
+
+    return None
+
+
+def part_identity(args):                        # Values of the characteristics that identify a part within its class
+    return tuple(args[characteristic] for characteristic in part_characteristics[args['class_name']])
+
+
+def duplicate_part_query(args):                 # Query for a part of the same class with the same characteristics
+    class_name = args['class_name']
+    characteristics = dict(zip(part_characteristics[class_name], part_identity(args)))
+    return select(part_models[class_name]).filter_by(**characteristics).limit(1)
+
+
+def find_duplicate_part(args):
+    parts = fetch_parts(duplicate_part_query(args), shards=shard_router.class_shards(args['class_name']))
+    return parts[0] if parts else None
+
+
+def part_row(args, current_datetime):           # Column values for a new part
+    row = {'sku': args['sku'], 'class_name': args['class_name'],
+           'date_last_updated': current_datetime, 'quantity': args['quantity'],
+           'reorder_point': args.get('reorder_point')}
+    for characteristic in part_types[args['class_name']].characteristics:
+        row[characteristic] = args.get(characteristic)
+    return row
+
+
+def build_part(args, current_datetime):
+    return part_models[args['class_name']](**part_row(args, current_datetime))
+
+
+def read_bulk_items():                          # Reads the parts of a bulk request from a JSON array or NDJSON body
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)          # Reported as an invalid part
+        return items
+
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        abort(400, message="Request body must be a JSON array or NDJSON of parts")
+    return items
+
+
+def bulk_result(index, sku, status, message):
+    return {'index': index, 'sku': sku, 'status': status, 'message': message}
+
+
+def add_part_chunk(chunk, results, seen_skus, seen_characteristics):    # Checks collisions for a chunk with set-based queries and inserts it in one transaction
+    skus = [args['sku'] for index, args in chunk]
+    taken_skus = {row[0] for row in fetch_rows(select(PartModel.sku).where(PartModel.sku.in_(skus)))}
+
+    taken_characteristics = set()
+    chunk_by_class = {}
+    for index, args in chunk:
+        chunk_by_class.setdefault(args['class_name'], []).append(part_identity(args))
+    for class_name, identities in chunk_by_class.items():
+        columns = [getattr(part_models[class_name], characteristic) for characteristic in part_characteristics[class_name]]
+        query = (select(*columns).where(PartModel.class_name == class_name)
+                 .where(tuple_(*columns).in_(identities)))
+        taken_characteristics.update((class_name, tuple(row))
+                                     for row in fetch_rows(query, shard_router.class_shards(class_name)))
+
+    current_datetime = datetime.now()
+    rows_by_shard = {}                          # (shard or None, class_name) -> rows to insert
+    for index, args in chunk:
         sku = args['sku']
-        class_name = args['class_name']
-        current_datetime = datetime.now()
+        identity = (args['class_name'], part_identity(args))
+
+        if sku in taken_skus or sku in seen_skus:
+            results[index] = bulk_result(index, sku, 409, "SKU taken")
+            continue
+
+        if identity in taken_characteristics or identity in seen_characteristics:
+            results[index] = bulk_result(index, sku, 409,
+                                         f"This {part_label(args['class_name'])} already exists in the inventory")
+            continue
+
+        seen_skus.add(sku)
+        seen_characteristics.add(identity)
+        target = (shard_router.part_shard(args['class_name'], sku), args['class_name'])
+        rows_by_shard.setdefault(target, []).append(part_row(args, current_datetime))
+        results[index] = bulk_result(index, sku, 201, "Part sucessfully added")
+
+    try:
+        for (shard, class_name), rows in rows_by_shard.items():
+            if shard is not None:
+                shard_router.use(shard)
+            db.session.execute(insert(part_models[class_name]), rows)
+        db.session.commit()                     # One transaction per shard written to
+    except IntegrityError:                  # Another request added one of these parts since the checks above
+        db.session.rollback()
+        for index, args in chunk:
+            if results[index]['status'] == 201:
+                results[index] = bulk_result(index, args['sku'], 409,
+                                             "A conflicting part was added at the same time, please retry")
+
+    for sku in skus:
+        part_cache.invalidate(sku)
+
+
+def shard_names(config):                        # Bind keys of the shards: the class names, or '0' up to SHARD_COUNT - 1
+    if config['SHARD_BY'] == 'class_name':
+        return tuple(part_types)
+    if config['SHARD_BY'] == 'sku':
+        return tuple(str(number) for number in range(config['SHARD_COUNT']))
+    raise ValueError(f"SHARD_BY must be 'class_name' or 'sku', not {config['SHARD_BY']!r}")
+
+
+def shard_of(config, class_name, sku):          # Shard a part belongs on
+    if config['SHARD_BY'] == 'class_name':
+        return class_name
+    return str(sku % config['SHARD_COUNT'])
+
+
+class ShardRouter:                              # Routes each part to its shard, and runs queries on every shard that may hold their parts
+
+    def __init__(self):
+        self.config = default_config
+        self.shards = ()                        # Bind keys of the shards, empty unless SHARD_BY is set
+        self.placements = OrderedDict()         # sku -> shard it was last seen on, oldest first
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.shards)
+
+    def configure(self, app):
+        with self.lock:
+            self.config = app.config
+            self.shards = shard_names(app.config) if app.config['SHARD_BY'] is not None else ()
+            self.placements.clear()
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def engines(self):
+        return [db.engines[shard] for shard in self.shards]
+
+    def part_shard(self, class_name, sku):      # Shard a part belongs on, or None when unsharded
+        return shard_of(self.config, class_name, sku) if self.enabled else None
+
+    def class_shards(self, class_name):         # Shards that may hold parts of a class
+        if self.config['SHARD_BY'] == 'class_name':
+            return [class_name]
+        return self.shards
+
+    def use(self, shard):                       # Routes the statements of the current session to a shard
+        db.session.info['shard'] = shard
+
+    def remember(self, placement):              # Keeps sku -> shard pairs, so the next request for those SKUs goes straight to their shard
+        with self.lock:
+            self.placements.update(placement)
+            while len(self.placements) > self.config['SHARD_PLACEMENT_CACHE_SIZE']:
+                self.placements.popitem(last=False)
+
+    def locate(self, skus):                     # sku -> shard, looked up on every shard when sharding by class, leaving out SKUs none holds
+        if self.config['SHARD_BY'] == 'sku':
+            return {sku: shard_of(self.config, None, sku) for sku in skus}
+        query = select(PartModel.sku).where(PartModel.sku.in_(list(skus)))
+        found = self.map(lambda shard: db.session.scalars(query).all(), parallel=False)
+        placement = {sku: shard for shard, shard_skus in zip(self.shards, found) for sku in shard_skus}
+        self.remember(placement)
+        return placement
+
+    def route_sku(self, sku, remembered=True):  # Routes the session to the shard holding sku, returns whether that shard was remembered
+        if not self.enabled:
+            return False
+        shard = self.placements.get(sku) if remembered else None
+        if shard is not None:
+            self.use(shard)
+            return True
+        self.use(self.locate([sku]).get(sku, self.shards[0]))     # The first shard when none holds it
+        return False
+
+    def route_part(self, class_name, sku):      # Routes the session to the shard a new part belongs on
+        if self.enabled:
+            shard = shard_of(self.config, class_name, sku)
+            if self.config['SHARD_BY'] == 'class_name':
+                self.remember({sku: shard})
+            self.use(shard)
+
+    def map(self, call, shards=None, parallel=True):     # [call(shard) for shard in shards], each routed to its shard
+        shards = self.shards if shards is None else shards
+        if not parallel or len(shards) == 1:    # Runs in the caller's session, for calls too quick to be worth a thread
+            results = []
+            for shard in shards:
+                self.use(shard)
+                results.append(call(shard))
+            return results
+
+        app = current_app._get_current_object()
+        totals = current_request_metrics()
+
+        def run(shard):
+            with app.app_context():             # A session of its own, closed once call returns
+                if totals is not None:          # The shard's own totals, since += on the request's isn't atomic across threads
+                    g.request_metrics = {'statements': 0, 'db': 0.0, 'serialize': 0.0}
+                self.use(shard)
+                return call(shard), g.get('request_metrics')
+
+        results = []
+        for result, shard_totals in self.pool().map(run, shards):
+            if shard_totals is not None:        # Added to the request's once every thread is done
+                for name in ('statements', 'db', 'serialize'):
+                    totals[name] += shard_totals[name]
+            results.append(result)
+        return results
+
+    def pool(self):                             # Created on first use, so each forked worker gets its own threads
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.config['SHARD_THREADS'], thread_name_prefix='shard')
+            return self.executor
+
+
+shard_router = ShardRouter()                    # Configured by create_app, does nothing unless SHARD_BY is set
+
+
+def fetch_parts(query, limit=None, shards=None, order_by=None):     # Parts a query selects, merged from the shards that may hold them in the query's order
+    if limit is not None:
+        query = query.limit(limit)
+    if not shard_router.enabled:
+        return db.session.scalars(query).all()
+
+    # Read as rows, which serialize like parts without building the objects that the merge mostly throws away
+    results = shard_router.map(lambda shard: db.session.connection().execute(query).all(), shards)
+    if not order_by or order_by == 'sku':
+        return list(itertools.islice(heapq.merge(*results, key=operator.attrgetter('sku')), limit))
+
+    # Sorted by SKU first, so SKUs still break ties once sorted by the search's own order
+    name = order_by.lstrip('-')
+    parts = sorted(itertools.chain(*results), key=operator.attrgetter('sku'))
+    parts.sort(key=lambda part: (0, 0) if getattr(part, name) is None else (1, getattr(part, name)),
+               reverse=order_by.startswith('-'))
+    return parts[:limit]
+
+
+def fetch_rows(query, shards=None, parallel=True):     # Rows a query selects from each shard that may hold them, in no particular order
+    if not shard_router.enabled:
+        return db.session.execute(query).all()
+    return list(itertools.chain(*shard_router.map(lambda shard: db.session.execute(query).all(), shards, parallel)))
+
+
+def find_part(sku):                             # Finds a part of any class with a primary key lookup on its shard
+    remembered = shard_router.route_sku(sku)
+    part = db.session.get(PartModel, sku)
+    if part is None and remembered:             # Deleted, or added again as another class by a different worker
+        shard_router.route_sku(sku, remembered=False)
+        part = db.session.get(PartModel, sku)
+    return part
+
+
+def find_tagged_part(sku):                      # find_part, also returning the change_tag of its shard from just before the read
+    remembered = shard_router.route_sku(sku)
+    tag = change_tag()
+    part = db.session.get(PartModel, sku)
+    if part is None and remembered:
+        shard_router.route_sku(sku, remembered=False)
+        tag = change_tag()
+        part = db.session.get(PartModel, sku)
+    return part, tag
+
+
+def change_tag():                               # (shard, latest change) of the routed session, or None when the database keeps no change log
+    if db.session.get_bind().dialect.name not in trigger_dialects:
+        return None
+    return db.session.info.get('shard'), latest_change(*db.session.execute(change_state_query()).one())
+
+
+def part_change_query(sku):                     # (sku's latest change, compacted_seq)
+    return select(select(PartChangeModel.seq).where(PartChangeModel.sku == sku).scalar_subquery(),
+                  InventoryVersionModel.compacted_seq).limit(1)
+
+
+def changed_since(sku, tag):                    # Whether sku was changed, by any worker, since a copy of it was read at tag
+    if tag is None:
+        return False                            # Nothing to check against, the copy is kept until it expires
+    shard, seq = tag
+    if shard is not None:
+        shard_router.use(shard)
+    return changed_after(seq, *db.session.execute(part_change_query(sku)).one())
+
+
+def changed_after(seq, changed_seq, compacted_seq):     # Whether a row of part_change_query records a change made after seq
+    if changed_seq is None:                     # Never changed, or deleted and compacted away
+        return compacted_seq is not None and compacted_seq > seq
+    return changed_seq > seq
+
+
+class PartCache:                                # Bounded LRU cache of serialized parts keyed by SKU
+
+    def __init__(self, max_size=default_config['PART_CACHE_SIZE'], ttl=default_config['PART_CACHE_TTL']):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()            # sku -> (expires_at, serialized part, quantity, date_last_updated, change_tag)
+        self.generation = 0                     # Counts invalidations, see begin
+        self.invalidated = OrderedDict()        # sku -> generation of its latest invalidation, for the max_size latest SKUs
+        self.floor = 0                          # Generation of the latest invalidation dropped from invalidated
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, sku):                         # Returns (serialized part, quantity, date_last_updated, change_tag) or None
+        with self.lock:
+            entry = self.entries.get(sku)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] < time.monotonic():     # Expired entries count as a miss
+                del self.entries[sku]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(sku)
+            self.hits += 1
+            return entry[1:]
+
+    def begin(self):                            # Taken before reading a part, then passed to set
+        return self.generation
+
+    def set(self, sku, part, quantity, date_last_updated, tag, started):
+        with self.lock:
+            if started < self.floor or self.invalidated.get(sku, 0) > started:
+                return                          # Read before the part was last invalidated, so it may be the old one
+            self.entries[sku] = (time.monotonic() + self.ttl, part, quantity, date_last_updated, tag)
+            self.entries.move_to_end(sku)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)   # Drops the least recently used part
+                self.evictions += 1
+
+    def invalidate(self, sku):
+        with self.lock:
+            self.entries.pop(sku, None)
+            self.generation += 1
+            self.invalidated[sku] = self.generation
+            self.invalidated.move_to_end(sku)
+            while len(self.invalidated) > self.max_size:
+                self.floor = self.invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        with self.lock:
+            self.forget()
+
+    def configure(self, max_size, ttl):
+        with self.lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.forget()
+
+    def forget(self):                           # Drops every entry and refuses the sets of reads already under way
+        self.entries.clear()
+        self.generation += 1
+        self.invalidated.clear()
+        self.floor = self.generation
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'enabled': current_app.config['PART_CACHE_ENABLED'],
+                    'size': len(self.entries),
+                    'max_size': self.max_size,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+part_cache = PartCache()                        # Sized by create_app from the app's config
+
+
+class Histogram:                                # Prometheus style histogram with one series per set of labels
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}                        # labels -> [count per bucket..., count above the last bucket]
+        self.sums = {}
+
+    def observe(self, labels, value):
+        counts = self.series.get(labels)
+        if counts is None:
+            counts = self.series[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, counts in self.series.items():
+            label_text = format_labels(labels)
+            total = 0
+            for bucket, count in zip(self.buckets + ['+Inf'], counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bucket}"}} {total}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {total}")
+        return lines
+
+
+def format_labels(labels):                      # (('endpoint', 'search'), ('method', 'GET')) -> endpoint="search",method="GET"
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+def render_counter(name, description, values):  # values maps labels to a number
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+    for labels, value in values.items():
+        lines.append(f"{name}{{{format_labels(labels)}}} {value}")
+    return lines
+
+
+class RequestMetrics:                           # Per-route latency, SQL and serialization totals, served at /metrics
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = Histogram('inventory_request_duration_seconds', "Time to handle a request",
+                                 [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+        self.statements = Histogram('inventory_request_sql_statements', "SQL statements run by a request",
+                                    [0, 1, 2, 3, 5, 10, 25, 50, 100])
+        self.requests = {}                      # (endpoint, method, status) labels -> count
+        self.db_seconds = {}                    # (endpoint, method) labels -> seconds
+        self.serialize_seconds = {}
+
+    def record(self, endpoint, method, status, duration, statements, db_seconds, serialize_seconds):
+        labels = (('endpoint', endpoint), ('method', method))
+        with self.lock:
+            self.latency.observe(labels, duration)
+            self.statements.observe(labels, statements)
+            status_labels = labels + (('status', status),)
+            self.requests[status_labels] = self.requests.get(status_labels, 0) + 1
+            self.db_seconds[labels] = self.db_seconds.get(labels, 0.0) + db_seconds
+            self.serialize_seconds[labels] = self.serialize_seconds.get(labels, 0.0) + serialize_seconds
+
+    def render(self):                           # Prometheus text format
+        with self.lock:
+            lines = render_counter('inventory_requests_total', "Requests handled", self.requests)
+            lines += self.latency.render()
+            lines += self.statements.render()
+            lines += render_counter('inventory_request_db_seconds_total', "Time spent running SQL", self.db_seconds)
+            lines += render_counter('inventory_request_serialize_seconds_total', "Time spent serializing responses",
+                                    self.serialize_seconds)
+
+        cache = part_cache.stats()
+        for name in ('hits', 'misses', 'evictions'):
+            lines += [f"# HELP inventory_part_cache_{name}_total Part cache {name}",
+                      f"# TYPE inventory_part_cache_{name}_total counter",
+                      f"inventory_part_cache_{name}_total {cache[name]}"]
+        lines += ["# HELP inventory_part_cache_size Parts held in the part cache",
+                  "# TYPE inventory_part_cache_size gauge",
+                  f"inventory_part_cache_size {cache['size']}"]
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+def current_request_metrics():                  # The running totals of the request being handled, or None
+    if has_app_context():
+        return g.get('request_metrics')
+    return None
 
-        success = {"message": "Part sucessfully added"}
 
-        valid_class_names = ['resistor', 'solder', 'wire', 'display_cable', 'ethernet_cable']
+def add_serialize_time(start):
+    totals = current_request_metrics()
+    if totals is not None:
+        totals['serialize'] += time.perf_counter() - start
 
-        if class_name not in valid_class_names:
-            abort(400, message="Invalid class name. Valid class names are 'resistor', 'solder', 'wire', 'display_cable', and 'ethernet_cable'")
 
-        if args['quantity'] < 0:
-            abort(400, message="Quantity cannot be negative")  # Checks if quantity is negative
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_starts', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['statement_starts'].pop()
+    totals = current_request_metrics()
+    if totals is not None:
+        totals['statements'] += 1
+        totals['db'] += time.perf_counter() - start
 
-        subclasses = [ResistorModel, SolderModel, WireModel, DisplayCableModel, EthernetCableModel]
-        for subclass in subclasses:
-            result = subclass.query.filter_by(sku=sku).first()
-            if result:
-                abort(409, message="SKU taken")  # Checks if SKU exists in database
 
-        if class_name == "resistor":
-            if (not args['resistance']) or (not args['tolerance']):
-                abort(400, message="Resistor characteristics not provided")
+@event.listens_for(Engine, 'handle_error')
+def drop_statement_timer(context):              # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get('statement_starts'):
+        context.connection.info['statement_starts'].pop()
 
-            result = ResistorModel.query.filter_by(resistance=args['resistance'], tolerance=args['tolerance']).first()
 
-            if result:                       # Checks if part already exists in inventory
-                abort(409, message="This resistor already exists in the inventory")
+def start_request_metrics():
+    if current_app.config['METRICS_ENABLED']:
+        g.request_metrics = {'start': time.perf_counter(), 'statements': 0, 'db': 0.0, 'serialize': 0.0}
 
-            part = ResistorModel(sku=args['sku'], class_name=args['class_name'],
-                                 date_last_updated=current_datetime, quantity=args['quantity'],
-                                 resistance=args['resistance'], tolerance=args['tolerance'])
 
-            db.session.add(part)
-            db.session.commit()
+def finish_request_metrics(response):           # Streamed bodies are produced after this, so only their setup is counted
+    totals = g.pop('request_metrics', None)
+    if totals is None:
+        return response
 
-            return success, 201
+    duration = time.perf_counter() - totals['start']
+    request_metrics.record(request.endpoint or 'unknown', request.method, response.status_code,
+                           duration, totals['statements'], totals['db'], totals['serialize'])
 
+    if current_app.config['METRICS_DEBUG_HEADER']:
+        response.headers['X-Request-Metrics'] = (f"total={duration * 1000:.3f}ms; db={totals['db'] * 1000:.3f}ms; "
+                                                 f"statements={totals['statements']}; "
+                                                 f"serialize={totals['serialize'] * 1000:.3f}ms")
+    return response
 
-        elif class_name == "solder":
-            valid_solder_types = ['lead', 'lead-free', 'rosin-core', 'acid-core']
 
-            if (not args['solder_type']) or (not args['solder_length']):
-                abort(400, message="Solder characteristics not provided")
+def find_cached_part(sku):                      # Returns (cache entry, None, None) on a hit, otherwise (None, part from the database or None, read)
+    queued = current_app.config['QUANTITY_WRITE_BEHIND'] and quantity_writer.pending(sku)
+    if queued:                                  # Neither the cache nor the database has this quantity yet
+        result = find_part(sku)
+        if result is None:
+            return None, None, None
+        part = serialize_part(result)
+        part['quantity'], part['date_last_updated'] = queued[0], queued[1].isoformat()
+        return (dump_json(part), *queued), None, None
 
-            result = SolderModel.query.filter_by(solder_type=args['solder_type'], solder_length=args['solder_length']).first()
+    if not current_app.config['PART_CACHE_ENABLED']:
+        return None, find_part(sku), None
+    cached = part_cache.get(sku)
+    if cached and not changed_since(sku, cached[3]):
+        return cached, None, None
+    started = part_cache.begin()                # Before the read, so an invalidation during it keeps the part out of the cache
+    result, tag = find_tagged_part(sku)
+    return None, result, (tag, started)
 
-            if result:
-                abort(409, message="This solder already exists in the inventory")
 
-            if args['solder_type'] not in valid_solder_types:
-                abort(400, message="Invalid solder type. Valid solder types are 'lead', 'lead-free', 'rosin-core', and 'acid-core'")
+def cache_part(result, read):                   # Serializes a part read from the database into a cache entry, cached when read says how
+    entry = (dump_json(serialize_part(result)), result.quantity, result.date_last_updated)
+    if read is not None:
+        part_cache.set(result.sku, *entry, *read)
+    return entry
 
-            part = SolderModel(sku=args['sku'], class_name=args['class_name'],
-                               date_last_updated=current_datetime, quantity=args['quantity'],
-                               solder_type=args['solder_type'], solder_length=args['solder_length'])
 
-            db.session.add(part)
-            db.session.commit()
+def get_cached_part(sku):                       # Read-through lookup returning (serialized part, quantity, date_last_updated) or None
+    cached, result, read = find_cached_part(sku)
+    if cached:
+        return cached
+    if not result:
+        return None
+    return cache_part(result, read)
 
-            return success, 201
 
-        elif class_name == "wire":
-            if (not args['gauge']) or (not args['wire_length']):
-                abort(400, message="Wire characteristics not provided")
+def part_validators(sku, date_last_updated):    # (ETag, Last-Modified) of a part, which change whenever date_last_updated does
+    return f"{sku}-{date_last_updated.strftime('%Y%m%d%H%M%S%f')}", date_last_updated.astimezone(timezone.utc)
 
-            result = WireModel.query.filter_by(gauge=args['gauge'], wire_length=args['wire_length']).first()
 
-            if result:
-                abort(409, message="This wire already exists in the inventory")
+def version_etag(version, values):              # ETag of a collection at one inventory version, for one set of request values
+    digest = hashlib.blake2b(json.dumps(values, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+    return f"v{version}-{digest}"
 
-            part = WireModel(sku=args['sku'], class_name=args['class_name'],
-                             date_last_updated=current_datetime, quantity=args['quantity'],
-                             gauge=args['gauge'], wire_length=args['wire_length'])
 
-            db.session.add(part)
-            db.session.commit()
+def inventory_version_query():
+    return select(InventoryVersionModel.version).limit(1)
 
-            return success, 201
 
-        elif class_name == "display_cable":
-            valid_display_cable_types = ['hdmi', 'vga', 'displayport', 'micro-hdmi']
+def inventory_version():                        # Current inventory version, or None when the database keeps none
+    if shard_router.enabled:                    # Each shard counts its own changes, so their sum moves whenever one does
+        if any(engine.dialect.name not in trigger_dialects for engine in shard_router.engines()):
+            return None
+        return sum(row[0] for row in fetch_rows(inventory_version_query(), parallel=False))
 
-            if (not args['display_cable_type']) or (not args['display_cable_length']) or (not args['display_cable_color']):
-                abort(400, message="Display cable characteristics not provided")
+    if db.engine.dialect.name not in trigger_dialects:
+        return None
+    return db.session.scalar(inventory_version_query())
 
-            result = DisplayCableModel.query.filter_by(display_cable_type=args['display_cable_type'],
-                             display_cable_length=args['display_cable_length'],
-                             display_cable_color=args['display_cable_color']).first()
 
-            if result:
-                abort(409, message="This display cable already exists in the inventory")
+def collection_etag(values, version=None):      # ETag of a collection response, or None when the database keeps no version
+    if version is None:
+        version = inventory_version()
+    if version is None:
+        return None
+    return version_etag(version, {'path': request.path, **values})
 
-            if args['display_cable_type'] not in valid_display_cable_types:
-                abort(400,
-                      message="Invalid display cable type. Valid display cable types are 'hdmi', 'vga', 'displayport', and 'micro-hdmi'")
 
-            part = DisplayCableModel(sku=args['sku'], class_name=args['class_name'],
-                             date_last_updated=current_datetime, quantity=args['quantity'],
-                             display_cable_type=args['display_cable_type'],
-                             display_cable_length=args['display_cable_length'],
-                             display_cable_color=args['display_cable_color'])
+def is_not_modified(headers, etag, last_modified=None):     # Checks If-None-Match, or failing that If-Modified-Since
+    if etag is None:
+        return False
 
-            db.session.add(part)
-            db.session.commit()
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:                # Matches the ETag of any encoding of the response
+        return parse_etags(if_none_match).contains_weak(matched_etag(headers, etag))
+
+    if_modified_since = parse_date(headers.get('If-Modified-Since'))
+    if last_modified is None or if_modified_since is None:
+        return False
+    return last_modified.replace(microsecond=0) <= if_modified_since      # HTTP dates have whole seconds
+
+
+def validator_headers(etag, last_modified=None):    # Sent with full and 304 responses so clients can revalidate next time
+    if etag is None:
+        return {}
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
 
-            return success, 201
 
-        elif class_name == "ethernet_cable":
-            valid_alpha_or_beta_types = ['male', 'female']
-            valid_speeds = ['10mbps', '100mbps', '1gbps', '10gbps']
+def not_modified_response(etag, last_modified=None):
+    return Response(status=304, headers=validator_headers(matched_etag(request.headers, etag), last_modified))
 
-            if (not args['alpha_type']) or (not args['beta_type']) or (not args['speed']) or (not args['ethernet_cable_length']):
-                abort(400, message="Ethernet cable characteristics not provided")
 
-            result = EthernetCableModel.query.filter_by(alpha_type=args['alpha_type'], beta_type=args['beta_type'],
-                             speed=args['speed'], ethernet_cable_length=args['ethernet_cable_length']).first()
+compression_levels = {                          # encoding -> (level for responses compressed as they are sent, level for the cached inventory)
+    'zstd': (3, 10),
+    'br': (4, 9),
+    'gzip': (6, 9),
+}
+available_encodings = tuple(encoding for encoding, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib)) if module)
+compressible_types = frozenset(('application/json', 'application/x-ndjson', 'text/csv', 'text/plain'))
+
+
+def stream_compressor(encoding, level):         # (compress, finish) of a new compressor, both returning bytes
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)     # wbits 31 writes a gzip header and trailer
+        return compressor.compress, compressor.flush
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.finish
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+def compress(body, encoding, level):
+    compress_chunk, finish = stream_compressor(encoding, level)
+    return compress_chunk(body) + finish()
+
+
+def compress_stream(chunks, encoding, level):   # Compresses a streamed body as it is produced
+    compress_chunk, finish = stream_compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            compressed = compress_chunk(chunk)
+            if compressed:
+                yield compressed
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def negotiate_encoding(accept_encoding, config):    # Best encoding an Accept-Encoding header allows, or None to send the body as it is
+    if not config['COMPRESSION_ENABLED'] or not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(available_encodings)
+
+
+def encoded_etag(etag, encoding):               # Each encoding of a response is a representation of its own, so gets its own ETag
+    return f"{etag}-{encoding}"
+
+
+def matched_etag(headers, etag):                # The encoding of etag If-None-Match holds, so a 304 names the copy the client has
+    client_etags = parse_etags(headers.get('If-None-Match'))
+    for encoding in available_encodings:
+        if client_etags.contains_weak(encoded_etag(etag, encoding)):
+            return encoded_etag(etag, encoding)
+    return etag
+
+
+def compress_response(response):                # Sends a body in the best encoding the client accepts, once it is big enough to gain
+    config = current_app.config
+    if not config['COMPRESSION_ENABLED']:
+        return response
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+        return response
+    if response.mimetype not in compressible_types or response.status_code < 200 or response.status_code == 204:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if 'Content-Encoding' not in response.headers:     # Otherwise it was compressed ahead of time
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), config)
+        if encoding is None:
+            return response
+        level = compression_levels[encoding][0]
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, level)
+        else:
+            body = response.get_data()
+            if len(body) < config['COMPRESSION_MIN_SIZE']:
+                return response
+            response.set_data(compress(body, encoding, level))
+        response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, response.headers['Content-Encoding']), weak)
+    return response
+
 
-            if result:
-                abort(409, message="This ethernet cable already exists in the inventory")
+class Add_Part(Resource):
+
+    def put(self):                          # Adds a part
+        args = check_arguments(parse_part(request_values()))
 
-            if args['alpha_type'] not in valid_alpha_or_beta_types:
-                abort(400,
-                      message="Invalid alpha type. Valid alpha types are 'male' and 'female'")
+        error = validate_part(args)
+        if error:
+            abort(error[0], message=error[1])
 
-            if args['beta_type'] not in valid_alpha_or_beta_types:
-                abort(400,
-                      message="Invalid beta type. Valid beta types are 'male' and 'female'")
+        if find_part(args['sku']):
+            abort(409, message="SKU taken")  # Checks if SKU exists in database
 
-            if args['speed'] not in valid_speeds:
-                abort(400,
-                      message="Invalid speed. Valid speeds are '10mbps', '100mbps', '1gbps', and '10gbps'")
+        if find_duplicate_part(args):       # Checks if part already exists in inventory
+            abort(409, message=f"This {part_label(args['class_name'])} already exists in the inventory")
 
-            part = EthernetCableModel(sku=args['sku'], class_name=args['class_name'],
-                             date_last_updated=current_datetime, quantity=args['quantity'],
-                             alpha_type=args['alpha_type'], beta_type=args['beta_type'],
-                             speed=args['speed'], ethernet_cable_length=args['ethernet_cable_length'])
+        part = build_part(args, datetime.now())
 
-            db.session.add(part)
+        shard_router.route_part(args['class_name'], args['sku'])
+        db.session.add(part)
+        try:
             db.session.commit()
+        except IntegrityError:              # Another request added the same SKU or part since the checks above
+            db.session.rollback()
+            if find_part(args['sku']):
+                abort(409, message="SKU taken")
+            abort(409, message=f"This {part_label(args['class_name'])} already exists in the inventory")
+        part_cache.invalidate(args['sku'])
 
-            return success, 201
+        return {"message": "Part sucessfully added"}, 201
+
+
+class Bulk_Add_Parts(Resource):
+
+    def post(self):                         # Adds many parts, reporting a status for each one
+        items = read_bulk_items()
+        results = [None] * len(items)
+        pending = []                        # (index, args) of items that passed validation
+
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = bulk_result(index, None, 400, "Invalid part, must be a JSON object")
+                continue
+
+            args, error = parse_part(item)
+            if error:
+                error = (400, error[1])
+            else:
+                error = validate_part(args)
+            if error:
+                results[index] = bulk_result(index, item.get('sku'), *error)
+                continue
+
+            pending.append((index, args))
+
+        seen_skus = set()
+        seen_characteristics = set()
+        chunk_size = current_app.config['BULK_CHUNK_SIZE']
+        for start in range(0, len(pending), chunk_size):
+            add_part_chunk(pending[start:start + chunk_size], results, seen_skus, seen_characteristics)
+
+        created = sum(1 for result in results if result['status'] == 201)
+        return {'created': created, 'failed': len(results) - created, 'results': results}, 200
 
 
 class Get_or_Delete_Part(Resource):
 
     def get(self, sku):                     # Gets a part
-        # Tries to find the part in each subclass
-        subclasses = [ResistorModel, SolderModel, WireModel, DisplayCableModel, EthernetCableModel]
-        for subclass in subclasses:
-            result = subclass.query.filter_by(sku=sku).first()
-            if result:
-                schema = generate_schema(subclass)
-                marshaled_schema = marshal(result, schema)
-                part = json.dumps(marshaled_schema, indent=4)
-                return part, 200
-
-        # If part not found in any subclass, return 404
-        abort(404, message="Could not find part with that SKU")
+        cached, result, read = find_cached_part(sku)
+        if not cached and not result:
+            # If no part has that SKU, return 404
+            abort(404, message="Could not find part with that SKU")
+
+        validators = part_validators(sku, cached[2] if cached else result.date_last_updated)
+        if is_not_modified(request.headers, *validators):   # Answered before the part is serialized
+            return not_modified_response(*validators)
+
+        if not cached:
+            cached = cache_part(result, read)
+        return Response(cached[0], mimetype='application/json', headers=validator_headers(*validators))
 
     def delete(self, sku):              # Deletes a part
-        subclasses = [ResistorModel, SolderModel, WireModel, DisplayCableModel, EthernetCableModel]
-        for subclass in subclasses:
-            result = subclass.query.filter_by(sku=sku).first()
-            if result:
-                db.session.delete(result)
-                db.session.commit()
-                return 204
-
-        # If part not found in any subclass, return 404
+        flush_queued_quantities()
+        result = find_part(sku)
+        if result:
+            db.session.delete(result)
+            db.session.commit()
+            part_cache.invalidate(sku)
+            return 204
+
+        # If no part has that SKU, return 404
         abort(404, message="Could not find part with that SKU")
 
 
 class Quantity(Resource):
 
     def get(self, sku):                     # Gets the quantity of a part
-        subclasses = [ResistorModel, SolderModel, WireModel, DisplayCableModel, EthernetCableModel]
-        for subclass in subclasses:
-            result = subclass.query.filter_by(sku=sku).first()
-            if result:
-                return {'sku': sku, 'quantity': result.quantity}, 200
-
-        # If part not found in any subclass, return 404
+        cached = get_cached_part(sku)
+        if cached:
+            validators = part_validators(sku, cached[2])
+            if is_not_modified(request.headers, *validators):
+                return not_modified_response(*validators)
+            return {'sku': sku, 'quantity': cached[1]}, 200, validator_headers(*validators)
+
+        # If no part has that SKU, return 404
         abort(404, message="Could not find part with that SKU")
 
 
+part_fields = tuple(dict.fromkeys(field for schema in part_schemas.values() for field in schema))     # Every field some class of part has
+date_fields = frozenset(field for field, kind in common_schema.items() if isinstance(kind, fields.DateTime))
+
+
+def list_values(value, coerce):                 # '1,2,3' or [1, 2, 3] -> [1, 2, 3], raising ValueError for a bad item
+    items = value.split(',') if isinstance(value, str) else value
+    if not isinstance(items, list):
+        raise ValueError(value)
+    return [coerce(item) for item in items]
+
+
+def parse_multi_get(values):                    # Checks the skus and fields of a multi-get, returns (skus, fields)
+    try:
+        skus = list(dict.fromkeys(list_values(values.get('skus'), to_int)))     # Repeated SKUs are only looked up once
+    except (TypeError, ValueError):
+        abort(400, message={'skus': "SKUs are required, as a list of integers"})
+
+    max_skus = current_app.config['MULTI_GET_MAX_SKUS']
+    if len(skus) > max_skus:
+        abort(400, message=f"Too many SKUs, at most {max_skus} can be fetched at once")
+
+    if values.get('fields') is None:
+        return skus, part_fields
+    try:
+        selected = list(dict.fromkeys(list_values(values['fields'], lambda item: to_str(item).strip())))
+    except (TypeError, ValueError):
+        abort(400, message={'fields': "Invalid fields, must be a list of field names"})
+    for field in selected:
+        if field not in part_fields:
+            abort(400, message=f"Invalid field '{field}'")
+    return skus, tuple(selected)
+
+
+def multi_get_query(skus, selected):            # One IN query over every class, loading only the selected columns
+    columns = ('sku', 'class_name') + tuple(field for field in selected if field not in ('sku', 'class_name'))
+    table = PartModel.__table__
+    return columns, select(*(table.c[column] for column in columns)).where(table.c.sku.in_(skus))
+
+
+def multi_get_readers(columns, selected):       # For each class, (field, position in a row, is a date) of the selected fields it has
+    positions = {column: position for position, column in enumerate(columns)}
+    return {class_name: [(field, positions[field], field in date_fields) for field in selected if field in schema]
+            for class_name, schema in part_schemas.items()}
+
+
+def multi_get(skus, selected):                  # {'parts': {sku: part}, 'missing': [sku, ...]} in the order the SKUs were asked for
+    columns, query = multi_get_query(skus, selected)
+    readers = multi_get_readers(columns, selected)
+    rows = {row[0]: row for row in fetch_rows(query)} if skus else {}
+
+    start = time.perf_counter()
+    parts = {}
+    for sku in skus:
+        row = rows.get(sku)
+        if row is None or row[1] not in readers:
+            continue
+        part = {}
+        for field, position, is_date in readers[row[1]]:
+            value = row[position]
+            part[field] = value.isoformat() if is_date and value is not None else value
+        parts[str(sku)] = part
+    add_serialize_time(start)
+
+    return {'parts': parts, 'missing': [sku for sku in skus if str(sku) not in parts]}
+
+
+class Multi_Get_Parts(Resource):
+
+    def get(self):                          # Gets many parts, with skus and fields in the query string
+        values = request_values('args')
+        skus, selected = parse_multi_get(values)
+
+        etag = collection_etag(values)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+        return json_response(multi_get(skus, selected), headers=validator_headers(etag))
+
+    def post(self):                         # Gets many parts, for SKU lists too long for a URL
+        return json_response(multi_get(*parse_multi_get(request_values())))
+
+
+def keyset(query, cursor):                      # Orders a query of parts by SKU, starting after the cursor
+    query = query.order_by(PartModel.sku)
+    if cursor is not None:
+        query = query.where(PartModel.sku > cursor)
+    return query
+
+
+def inventory_query(cursor):                    # Keyset query over every part
+    return keyset(select(PartModel), cursor)
+
+
+search_operators = {                            # Suffixes for range and set predicates, e.g. resistance__gte=1000
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+    'between': lambda column, values: column.between(*values),
+    'in': lambda column, values: column.in_(values),
+}
+
+
+def parse_search_filters(class_name, values):   # Range and set filters such as solder_length__between=1,3 -> [(name, operator, value)]
+    fields = part_types[class_name].searchable + ('quantity',)
+    filters = []
+
+    for key, value in values.items():
+        name, separator, operator = key.partition('__')
+        if not separator:
+            continue
+
+        if name not in fields or operator not in search_operators:
+            abort(400, message=f"Invalid search filter '{key}'")
+
+        coerce = coercions[part_types[class_name].characteristics.get(name, int)]     # quantity is the only other field
+        try:
+            if operator in ('between', 'in'):
+                items = value if isinstance(value, list) else str(value).split(',')
+                value = [coerce(item) for item in items]
+                if operator == 'between' and len(value) != 2:
+                    raise ValueError
+            else:
+                value = coerce(value)
+        except (TypeError, ValueError):
+            abort(400, message=f"Invalid value for search filter '{key}'")
+
+        filters.append((name, operator, value))
+
+    return filters
+
+
+def search_filters(model, class_name, values):  # SQL predicates of the range and set filters in values
+    return [search_operators[operator](getattr(model, name), value)
+            for name, operator, value in parse_search_filters(class_name, values)]
+
+
+def search_order(order_by, model, class_name):  # 'resistance' sorts ascending and '-resistance' descending
+    name = order_by.lstrip('-')
+    if name not in ('sku', 'quantity', 'date_last_updated') + part_types[class_name].searchable:
+        abort(400, message=f"Invalid order_by '{order_by}'")
+
+    column = getattr(model, name)
+    return column.desc() if order_by.startswith('-') else column
+
+
+def search_query(args, values):                 # Builds the search for parsed args and raw values, returns (query, paging)
+    class_name = args['class_name']
+    part_type = part_types[class_name]
+    model = part_type.model
+    conditions = [getattr(model, characteristic) == args[characteristic]
+                  for characteristic in part_type.searchable if args[characteristic]]
+
+    filters = search_filters(model, class_name, values)
+    if args['low_stock_below'] is not None:
+        filters.append(PartModel.quantity < args['low_stock_below'])
+
+    if not conditions and not filters:
+        abort(400, message=f"No {part_type.label} characteristics given")
+
+    # Parts matching any (or with match=all, every) characteristic, each SKU once since a part is a single row.
+    # Range and set filters must always all hold.
+    query = select(model).where(*filters)
+    if conditions:
+        combine = and_ if args['match'] == 'all' else or_
+        query = query.where(combine(*conditions))
+
+    # paging is 'offset' or 'cursor' when a page was asked for, otherwise None
+    if args['order_by'] and args['order_by'] != 'sku':
+        if args['cursor'] is not None:
+            abort(400, message="Cursor can only be used when ordering by sku, use offset instead")
+
+        query = query.order_by(search_order(args['order_by'], model, class_name), PartModel.sku)
+        if args['limit'] is not None or args['offset'] is not None:
+            return query, 'offset'
+        return query, None
+
+    query = keyset(query, args['cursor'])
+    if args['limit'] is not None or args['cursor'] is not None:
+        return query, 'cursor'
+    return query, None
+
+
+def check_limit(limit, max_page_size):
+    if limit is not None and not 0 < limit <= max_page_size:
+        abort(400, message=f"Limit must be between 1 and {max_page_size}")
+
+
+def cursor_page(parts, limit):                  # Turns up to limit + 1 parts in SKU order into a page and the cursor of the next page
+    next_cursor = None
+    if len(parts) > limit:                      # The extra row only tells us there is another page
+        parts = parts[:limit]
+        next_cursor = parts[-1].sku
+
+    return {'parts': serialize_parts(parts), 'next_cursor': next_cursor}
+
+
+def part_page(query, limit, shards=None):       # Gets one page of a keyset query and the cursor of the next page
+    return cursor_page(fetch_parts(query, limit + 1, shards), limit)
+
+
+def numbered_page(parts, offset, limit):        # Turns up to limit + 1 parts from offset into a page and the offset of the next page
+    next_offset = None
+    if len(parts) > limit:
+        parts = parts[:limit]
+        next_offset = offset + limit
+
+    return {'parts': serialize_parts(parts), 'next_offset': next_offset}
+
+
+def offset_page(query, offset, limit, shards=None, order_by=None):   # Gets one page of a query with its own ordering and the offset of the next page
+    if shard_router.enabled:                    # The page is somewhere in the first offset + limit + 1 parts of the shards together
+        parts = fetch_parts(query, offset + limit + 1, shards, order_by)[offset:]
+    else:
+        parts = fetch_parts(query.offset(offset), limit + 1)
+    return numbered_page(parts, offset, limit)
+
+
+def inventory_row_queries():                    # (serializer, query) per class selecting raw rows, so no ORM objects are built
+    return [(serializer, select(*serializer.table_columns).where(PartModel.class_name == class_name).order_by(PartModel.sku))
+            for class_name, serializer in part_serializers.items()]
+
+
+def shard_inventory(shard, cursor, batch):      # One shard's parts after cursor in SKU order, read a batch at a time
+    while True:
+        shard_router.use(shard)
+        parts = db.session.scalars(inventory_query(cursor).limit(batch)).all()
+        yield from parts
+        if len(parts) < batch:
+            return
+        cursor = parts[-1].sku
+
+
+def inventory_parts(cursor, limit):             # Parts after cursor in SKU order, up to limit, read as they are needed
+    batch = current_app.config['INVENTORY_STREAM_BATCH']
+    if not shard_router.enabled:
+        query = inventory_query(cursor).execution_options(yield_per=batch)
+        return db.session.scalars(query if limit is None else query.limit(limit))
+
+    shards = [shard_inventory(shard, cursor, batch) for shard in shard_router.shards]
+    return itertools.islice(heapq.merge(*shards, key=operator.attrgetter('sku')), limit)
+
+
+def stream_inventory(stream_format, cursor, limit, headers=None):    # Streams the inventory as a JSON array or NDJSON
+
+    fast = current_app.config['FAST_JSON']
+    batch = current_app.config['INVENTORY_STREAM_BATCH']
+
+    def generate():                             # Yields a batch of parts at a time, so serializing is timed per batch rather than per part
+        parts = iter(inventory_parts(cursor, limit))
+        separator = b''
+        if stream_format != 'ndjson':
+            yield b'['
+        while chunk := list(itertools.islice(parts, batch)):
+            start = time.perf_counter()
+            encoded = [json_bytes(serialize_part(part), fast) for part in chunk]
+            if stream_format == 'ndjson':
+                body = b''.join(line + b'\n' for line in encoded)
+            else:
+                body = separator + b','.join(encoded)
+                separator = b','
+            add_serialize_time(start)
+            yield body
+        if stream_format != 'ndjson':
+            yield b']'
+
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+new_quantity = func.coalesce(bindparam('new_quantity', type_=db.Integer),
+                             PartModel.quantity + bindparam('delta', type_=db.Integer))
+
+adjust_quantity_statement = (update(PartModel.__table__)          # Sets or adjusts a quantity in place, refusing to go below zero
+                             .where(PartModel.sku == bindparam('part_sku'))
+                             .where(new_quantity >= 0)
+                             .values(quantity=new_quantity, date_last_updated=bindparam('now')))
+
+
+def parse_quantity_entry(entry):                # Checks one entry of a batch quantity patch, returns (params, error)
+    if not isinstance(entry, dict):
+        return None, "Invalid entry, must be a JSON object"
+
+    sku = entry.get('sku')
+    quantity = entry.get('quantity')
+    delta = entry.get('delta')
+
+    if not isinstance(sku, int) or isinstance(sku, bool):
+        return None, "SKU is required"
+
+    if (quantity is None) == (delta is None):
+        return None, "Exactly one of quantity or delta is required"
+
+    if quantity is not None:
+        if not isinstance(quantity, int) or isinstance(quantity, bool):
+            return None, "Invalid quantity, must be integer"
+        if quantity < 0:
+            return None, "Quantity cannot be negative"
+
+    if delta is not None and (not isinstance(delta, int) or isinstance(delta, bool)):
+        return None, "Invalid delta, must be integer"
+
+    return {'part_sku': sku, 'new_quantity': quantity, 'delta': delta or 0}, None
+
+
+def prepare_quantity_entries(entries):          # Checks every entry, returns (results, pending) where pending holds (index, params)
+    results = [None] * len(entries)
+    pending = []
+
+    for index, entry in enumerate(entries):
+        params, error = parse_quantity_entry(entry)
+        if error:
+            sku = entry.get('sku') if isinstance(entry, dict) else None
+            results[index] = bulk_result(index, sku, 400, error)
+            continue
+        pending.append((index, params))
+
+    current_datetime = datetime.now()
+    for index, params in pending:
+        params['now'] = current_datetime
+
+    return results, pending
+
+
+quantity_messages = {
+    200: "Quantity successfully changed",
+    404: "Could not find part with that SKU",
+    409: "Quantity cannot go below zero",
+    503: "Quantity change could not be written",
+}
+
+
+def refused_skus_query(pending, applied):       # Which of the refused SKUs exist, telling 409s from 404s
+    refused_skus = [params['part_sku'] for (index, params), ok in zip(pending, applied) if not ok]
+    return select(PartModel.sku).where(PartModel.sku.in_(refused_skus))
+
+
+def quantity_results(results, pending, applied, existing_skus):
+    for (index, params), ok in zip(pending, applied):
+        sku = params['part_sku']
+        part_cache.invalidate(sku)
+        status = 200 if ok else 409 if sku in existing_skus else 404
+        results[index] = bulk_result(index, sku, status, quantity_messages[status])
+    return quantity_summary(results)
+
+
+def quantity_summary(results):
+    updated = sum(1 for result in results if result['status'] == 200)
+    return {'updated': updated, 'failed': len(results) - updated, 'results': results}
+
+
+def apply_quantity_changes(pending):            # Runs (index, params) changes in one transaction per shard, returns (applied, SKUs of refused ones that exist)
+    if not shard_router.enabled:
+        return write_quantity_changes(pending)
+
+    placement = shard_router.locate({params['part_sku'] for index, params in pending})
+    positions = defaultdict(list)               # shard -> positions in pending of the changes to its parts
+    for position, (index, params) in enumerate(pending):
+        if params['part_sku'] in placement:
+            positions[placement[params['part_sku']]].append(position)
+
+    applied = [False] * len(pending)            # SKUs no shard holds stay refused, and are reported as missing
+    existing_skus = set()
+    results = shard_router.map(lambda shard: write_quantity_changes([pending[position] for position in positions[shard]]),
+                               list(positions))
+    for shard, (shard_applied, shard_existing) in zip(positions, results):
+        for position, ok in zip(positions[shard], shard_applied):
+            applied[position] = ok
+        existing_skus |= shard_existing
+    return applied, existing_skus
+
+
+def write_quantity_changes(pending):            # Runs (index, params) changes in one transaction on the session's database
+    applied = [True] * len(pending)
+    if pending:
+        result = db.session.execute(adjust_quantity_statement, [params for index, params in pending])
+
+        if result.rowcount != len(pending):
+            # Some entries were refused, so redo them one at a time to find out which
+            db.session.rollback()
+            for position, (index, params) in enumerate(pending):
+                applied[position] = db.session.execute(adjust_quantity_statement, params).rowcount == 1
+
+    existing_skus = set(db.session.scalars(refused_skus_query(pending, applied)))
+    db.session.commit()
+    return applied, existing_skus
+
+
+def adjust_quantities(entries):                 # Applies many absolute or relative quantity changes in one transaction
+    results, pending = prepare_quantity_entries(entries)
+    if current_app.config['QUANTITY_WRITE_BEHIND']:
+        for (index, params), status in zip(pending, queue_quantity_changes(pending)):
+            results[index] = bulk_result(index, params['part_sku'], status, quantity_messages[status])
+        return quantity_summary(results)
+
+    applied, existing_skus = apply_quantity_changes(pending)
+    return quantity_results(results, pending, applied, existing_skus)
+
+
+class QuantityBatch:                            # Quantity changes queued together and written in one transaction
+
+    def __init__(self):
+        self.entries = {}                       # sku -> merged adjust_quantity_statement params, with the quantity readers see
+        self.statuses = {}                      # sku -> 200, 404 or 409 once written
+        self.done = threading.Event()
+
+
+class QuantityWriter:                           # Write-behind queue merging quantity changes per SKU, written by a background thread
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()      # One write at a time, whether from the thread or a request
+        self.batch = QuantityBatch()
+        self.flushing = None                    # Batch being written, which readers still see until it commits
+        self.flushes = 0
+        self.thread = None
+        self.app = None
+        self.stopping = False
+
+    def configure(self, app):
+        if self.app is None:
+            atexit.register(self.stop)          # Writes whatever is still queued when the process exits
+        with self.condition:
+            self.app = app
+            self.condition.notify()             # A running thread waits again with the new app's interval
+
+    def queued(self, sku):                      # The newest queued entry for a SKU, or None
+        with self.condition:
+            for batch in (self.batch, self.flushing):
+                if batch is not None and sku in batch.entries:
+                    return batch.entries[sku]
+        return None
+
+    def pending(self, sku):                     # (quantity, date_last_updated) readers should see, or None when nothing is queued
+        entry = self.queued(sku)
+        return (entry['quantity'], entry['now']) if entry else None
+
+    def enqueue(self, pending):                 # Checks and queues (index, params) changes, returns (statuses, batch)
+        skus = {params['part_sku'] for index, params in pending}
+        while True:
+            # Read outside the lock, then retried if a write committed in between and made the values stale
+            flushes = self.flushes
+            quantities = dict(fetch_rows(select(PartModel.sku, PartModel.quantity).where(PartModel.sku.in_(skus))))
+            with self.condition:
+                if flushes == self.flushes:
+                    break
+            db.session.rollback()
+
+        statuses = []
+        with self.condition:
+            batch = self.batch
+            for index, params in pending:
+                sku = params['part_sku']
+                entry = self.queued(sku)
+                if entry is None and sku not in quantities:
+                    statuses.append(404)
+                    continue
+
+                quantity = params['new_quantity']
+                if quantity is None:
+                    quantity = (entry['quantity'] if entry else quantities[sku]) + params['delta']
+                if quantity < 0:
+                    statuses.append(409)
+                    continue
+
+                queued = batch.entries.setdefault(sku, {'part_sku': sku, 'new_quantity': None, 'delta': 0})
+                if params['new_quantity'] is not None:
+                    queued['new_quantity'], queued['delta'] = params['new_quantity'], 0
+                elif queued['new_quantity'] is not None:
+                    queued['new_quantity'] += params['delta']
+                else:
+                    queued['delta'] += params['delta']
+                queued['quantity'], queued['now'] = quantity, params['now']
+                statuses.append(200)
+
+            if len(batch.entries) >= self.app.config['QUANTITY_FLUSH_SIZE']:
+                self.condition.notify()
+        self.start()
+        return statuses, batch
+
+    def flush(self):                            # Writes the queued changes in one transaction, returns how many SKUs were written
+        with self.flush_lock:
+            with self.condition:
+                batch = self.batch
+                if not batch.entries:
+                    return 0
+                self.batch = QuantityBatch()
+                self.flushing = batch
+
+            pending = list(enumerate(batch.entries.values()))
+            try:
+                with self.app.app_context():
+                    applied, existing_skus = apply_quantity_changes(pending)
+                for (index, params), ok in zip(pending, applied):
+                    sku = params['part_sku']
+                    batch.statuses[sku] = 200 if ok else 409 if sku in existing_skus else 404
+                    if not ok:
+                        self.app.logger.warning("Queued quantity change for SKU %s was refused with %s",
+                                                sku, batch.statuses[sku])
+            except Exception:
+                self.app.logger.exception("Writing %d queued quantity changes failed", len(pending))
+                batch.statuses = dict.fromkeys(batch.entries, 503)
+            finally:
+                with self.condition:
+                    self.flushing = None
+                    self.flushes += 1
+                for sku in batch.entries:
+                    part_cache.invalidate(sku)
+                batch.done.set()
+            return len(pending)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.stopping and len(self.batch.entries) < self.app.config['QUANTITY_FLUSH_SIZE']:
+                    self.condition.wait(self.app.config['QUANTITY_FLUSH_INTERVAL'])
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                return
+
+    def start(self):                            # Started on first use, so each forked worker gets its own thread
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping = False
+                self.thread = threading.Thread(target=self.run, name='quantity-writer', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+            thread = self.thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+        if self.app is not None:
+            self.flush()
+
+
+quantity_writer = QuantityWriter()              # Used when QUANTITY_WRITE_BEHIND is set, see create_app
+
+
+def queue_quantity_changes(pending):            # Queues (index, params) changes, waiting for them to be written unless QUANTITY_ACK is 'enqueue'
+    statuses, batch = quantity_writer.enqueue(pending)
+    if current_app.config['QUANTITY_ACK'] == 'enqueue' or 200 not in statuses:
+        return statuses
+
+    db.session.rollback()                       # Hands the connection back to the pool, which the writer may need to flush
+    batch.done.wait()
+    return [batch.statuses.get(params['part_sku'], status) if status == 200 else status
+            for (index, params), status in zip(pending, statuses)]
+
+
+def flush_queued_quantities():                  # Writes queued changes before a write that must come after them
+    if current_app.config['QUANTITY_WRITE_BEHIND']:
+        quantity_writer.flush()
+
+
+def inventory_body():                           # Every part as one JSON array, grouped by class and in SKU order within each
+    queries = inventory_row_queries()
+    if shard_router.enabled:                    # Every shard reads its parts in parallel, then each class is merged by SKU
+        results = shard_router.map(lambda shard: [db.session.execute(query).all() for serializer, query in queries])
+
+    inventory_list = []
+    for position, (serializer, query) in enumerate(queries):
+        if shard_router.enabled:
+            rows = list(heapq.merge(*(result[position] for result in results), key=operator.itemgetter(0)))
+        else:
+            rows = db.session.execute(query).all()
+        start = time.perf_counter()
+        inventory_list.extend(serializer.from_row(row) for row in rows)
+        add_serialize_time(start)
+    return dump_json(inventory_list)
+
+
+class InventoryDump:                            # The full GET /inventory/ body at one inventory version, and its precompressed copies
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()      # One build at a time, which requests for the same version wait for
+        self.version = None
+        self.bodies = {}                        # encoding -> body, None for the uncompressed one, replaced rather than changed
+        self.thread = None
+        self.app = None
+
+    def configure(self, app):
+        with self.lock:
+            self.app = app
+            self.version, self.bodies = None, {}
+
+    def current(self):
+        with self.lock:
+            return self.version, self.bodies
+
+    def bodies_at(self, version):               # Bodies at version, built in the caller's transaction when the cached ones are older
+        cached_version, bodies = self.current()
+        if cached_version == version:
+            return bodies
+
+        with self.build_lock:
+            cached_version, bodies = self.current()
+            if cached_version == version:
+                return bodies
+            bodies = {None: inventory_body()}
+            with self.lock:
+                if self.version is None or version > self.version:
+                    self.version, self.bodies = version, bodies
+        return bodies
+
+    def response(self, version, headers):       # Sends the copy in the client's encoding, or the plain body for compress_response
+        self.start()
+        bodies = self.bodies_at(version)
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), current_app.config)
+        if encoding is not None and encoding in bodies:
+            return Response(bodies[encoding], mimetype='application/json', headers={**headers, 'Content-Encoding': encoding})
+        return Response(bodies[None], mimetype='application/json', headers=headers)
+
+    def refresh(self):                          # Rebuilds the body after writes, then compresses it once in every encoding
+        version = inventory_version()
+        if self.current()[0] != version:
+            self.bodies_at(version)
+        db.session.rollback()                   # Ends the read, so SQLite can checkpoint while compressing
+
+        for encoding in available_encodings:
+            version, bodies = self.current()
+            if encoding not in bodies:
+                compressed = compress(bodies[None], encoding, compression_levels[encoding][1])
+                with self.lock:
+                    if self.version == version:
+                        self.bodies = {**self.bodies, encoding: compressed}
+
+    def run(self):
+        while True:
+            time.sleep(self.app.config['INVENTORY_DUMP_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    self.refresh()
+            except Exception:
+                self.app.logger.exception("Rebuilding the cached inventory failed")
+
+    def start(self):                            # Started by the first full dump, so each forked worker gets its own thread
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='inventory-dump', daemon=True)
+                self.thread.start()
+
+
+inventory_dump = InventoryDump()                # Used when INVENTORY_DUMP_CACHED is set, see create_app
+
+
 class Inventory(Resource):
 
     def patch(self):                 # Adds to the inventory
+        entries = request.get_json(silent=True)
+        if isinstance(entries, list):           # A JSON array changes many quantities at once
+            return adjust_quantities(entries), 200
+
         args = part_patch_args.parse_args()
 
         sku = args['sku']
@@ -445,219 +2166,1136 @@ class Inventory(Resource):
         if quantity < 0:
             abort(400, message="Quantity cannot be negative")  # Checks if quantity given is negative
 
+        if args['reorder_point'] is not None and args['reorder_point'] < 0:
+            abort(400, message="Reorder point cannot be negative")
+
         current_datetime = datetime.now()
-        subclasses = [ResistorModel, SolderModel, WireModel, DisplayCableModel, EthernetCableModel]
-        for subclass in subclasses:
-            result = subclass.query.filter_by(sku=sku).first()
-            if result:
-                result.quantity = quantity
-                result.date_last_updated = current_datetime
-                db.session.commit()
-                success = {"message": "Quantity successfully changed"}
-
-                return success, 200
-
-        # If part not found in any subclass, return 404
+        if current_app.config['QUANTITY_WRITE_BEHIND'] and args['reorder_point'] is None:
+            params = {'part_sku': sku, 'new_quantity': quantity, 'delta': 0, 'now': current_datetime}
+            status = queue_quantity_changes([(0, params)])[0]
+            if status != 200:
+                abort(status, message=quantity_messages[status])
+            return {"message": quantity_messages[200]}, 200
+
+        flush_queued_quantities()
+        result = find_part(sku)
+        if result:
+            result.quantity = quantity
+            if args['reorder_point'] is not None:
+                result.reorder_point = args['reorder_point']
+            result.date_last_updated = current_datetime
+            db.session.commit()
+            part_cache.invalidate(sku)
+            success = {"message": "Quantity successfully changed"}
+
+            return success, 200
+
+        # If no part has that SKU, return 404
         abort(404, message="Could not find part with that SKU")
 
     def get(self):                                          # Gets the inventory
-        inventory_list = []
-        subclasses = [ResistorModel, SolderModel, WireModel, DisplayCableModel, EthernetCableModel]
-        for subclass in subclasses:
-            result = subclass.query.all()
-            for value in result:
-                schema = generate_schema(subclass)
-                marshaled_schema = marshal(value, schema)
-                inventory_list.append(marshaled_schema)
+        args = inventory_get_args.parse_args()
+
+        check_limit(args['limit'], current_app.config['INVENTORY_MAX_PAGE_SIZE'])
+
+        version = inventory_version()
+        etag = collection_etag(args, version)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+        headers = validator_headers(etag)
+
+        if args['stream']:
+            return stream_inventory(args['stream'], args['cursor'], args['limit'], headers)
+
+        if args['limit'] is not None or args['cursor'] is not None:
+            return json_response(part_page(inventory_query(args['cursor']),
+                                           args['limit'] or current_app.config['INVENTORY_MAX_PAGE_SIZE']), headers=headers)
 
-        inventory = json.dumps(inventory_list, indent=4)
-        return inventory, 200
+        if current_app.config['INVENTORY_DUMP_CACHED'] and version is not None:
+            return inventory_dump.response(version, headers)
+
+        return Response(inventory_body(), mimetype='application/json', headers=headers)
 
 
 
 class Search(Resource):
 
     def get(self):                          # Searches for all parts that match the provided characteristics
-        search_list = []
-
-        args = part_search_args.parse_args()
+        values = request_values()
+        args = check_arguments(parse_search(values))
 
         class_name = args['class_name']
+        if class_name not in part_types:
+            return {"message": "No parts found"}, 200
 
-        if class_name == "resistor":
+        check_limit(args['limit'], current_app.config['INVENTORY_MAX_PAGE_SIZE'])
 
-            if args['resistance'] or args['tolerance']:
+        if args['offset'] is not None and args['offset'] < 0:
+            abort(400, message="Offset cannot be negative")
 
-                if args['resistance']:
-                    result = ResistorModel.query.filter_by(resistance=args['resistance']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(ResistorModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+        query, paging = search_query(args, values)
 
-                if args['tolerance']:
-                    result = ResistorModel.query.filter_by(tolerance=args['tolerance']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(ResistorModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+        etag = collection_etag(values)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+        headers = validator_headers(etag)
 
-            else:
-                abort(400, message="No resistor characteristics given")
+        limit = args['limit'] or current_app.config['INVENTORY_MAX_PAGE_SIZE']
+        shards = shard_router.class_shards(class_name)
+        if paging == 'offset':
+            return json_response(offset_page(query, args['offset'] or 0, limit, shards, args['order_by']), headers=headers)
+        if paging == 'cursor':
+            return json_response(part_page(query, limit, shards), headers=headers)
 
+        search_list = serialize_parts(fetch_parts(query, shards=shards, order_by=args['order_by']))
+
+        if len(search_list) == 0:
+            return {"message": "No parts found"}, 200, headers
 
-        elif class_name == "solder":
+        return json_response(search_list, headers=headers)
 
-            if args['solder_type'] or args['solder_length']:
+numeric_characteristics = {                     # Characteristics of each class with numbers for values, which /search/nearest can match
+    class_name: tuple(characteristic for characteristic, kind in part_type.characteristics.items() if kind in (int, float))
+    for class_name, part_type in part_types.items()}
 
-                if args['solder_type']:
-                    result = SolderModel.query.filter_by(solder_type=args['solder_type']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(SolderModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+mirror_columns = {                              # What the search mirror keeps of each part, enough to search and filter on
+    class_name: ('sku', 'quantity') + tuple(part_type.characteristics) for class_name, part_type in part_types.items()}
 
-                if args['solder_length']:
-                    result = SolderModel.query.filter_by(solder_length=args['solder_length']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(SolderModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+mirror_positions = {class_name: {column: position for position, column in enumerate(columns)}
+                    for class_name, columns in mirror_columns.items()}
 
+mirror_readers = {class_name: operator.attrgetter(*columns) for class_name, columns in mirror_columns.items()}
+
+e_series = {                                    # IEC 60063 preferred values for one decade
+    'E6': (1.0, 1.5, 2.2, 3.3, 4.7, 6.8),
+    'E12': (1.0, 1.2, 1.5, 1.8, 2.2, 2.7, 3.3, 3.9, 4.7, 5.6, 6.8, 8.2),
+    'E24': (1.0, 1.1, 1.2, 1.3, 1.5, 1.6, 1.8, 2.0, 2.2, 2.4, 2.7, 3.0,
+            3.3, 3.6, 3.9, 4.3, 4.7, 5.1, 5.6, 6.2, 6.8, 7.5, 8.2, 9.1),
+}
+e_series.update({f'E{count}': tuple(round(10 ** (step / count), 2) for step in range(count)) for count in (48, 96, 192)})
+e_series['E192'] = tuple(9.2 if value == 9.19 else value for value in e_series['E192'])    # The one value the standard rounds differently
+
+row_operators = {                               # search_operators, applied to a value held in memory
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'between': lambda value, bounds: bounds[0] <= value <= bounds[1],
+    'in': lambda value, values: value in values,
+}
+
+
+def snap_to_series(value, series):              # Closest value of an E-series by ratio, e.g. 4600 -> 4700 in E24
+    decade = 10 ** math.floor(math.log10(value))
+    candidates = [step * decade for step in e_series[series]] + [10 * decade]
+    return float(f"{min(candidates, key=lambda candidate: abs(math.log(candidate / value))):.3g}")
+
+
+def mirror_row(values):                         # Strings are interned, so a value shared by many parts is held once
+    return tuple(sys.intern(value) if isinstance(value, str) else value for value in values)
+
+
+class PartMirror:                               # Every part's mirror_columns held in memory and followed from part_changes, with indexes over them
+
+    def __init__(self, *indexes):
+        self.lock = threading.Lock()
+        self.thread_lock = threading.Lock()     # Guards starting the thread, which self.lock can't while a load holds it
+        self.indexes = indexes
+        self.database = None                    # URL of the database that was loaded
+        self.seq = None                         # Last change applied, None when there is no change log to follow
+        self.rows = {}                          # sku -> (class_name, row in the order of its class's mirror_columns)
+        self.thread = None
+        self.app = None
+
+    def configure(self, app):
+        with self.lock:
+            self.app = app                      # The thread of a previous app sees it was replaced and stops
+            self.database, self.seq, self.rows = None, None, {}
+        with self.thread_lock:
+            self.thread = None
+
+    def load(self, database, seq):              # Reads every part, then builds each index in one pass
+        self.database = None                    # Unusable until the load is done, even if it fails part way
+        self.rows = {}
+        for class_name, columns in mirror_columns.items():
+            query = select(*(PartModel.__table__.c[column] for column in columns)).where(PartModel.class_name == class_name)
+            for row in db.session.execute(query.execution_options(yield_per=current_app.config['INVENTORY_STREAM_BATCH'])):
+                self.rows[row[0]] = (class_name, mirror_row(row))
+        for index in self.indexes:
+            index.load(self.rows)
+        self.database, self.seq = database, seq
+
+    def add(self, class_name, row):
+        self.rows[row[0]] = (class_name, row)
+        for index in self.indexes:
+            index.add(class_name, row)
+
+    def remove(self, sku):
+        class_name, row = self.rows.pop(sku, (None, None))
+        if row is not None:
+            for index in self.indexes:
+                index.remove(class_name, row)
+
+    def refresh(self):                          # Applies the changes committed since the last refresh, or reloads
+        database = str(db.engine.url)
+        if db.engine.dialect.name not in trigger_dialects:
+            return self.load(database, None)
+
+        latest_seq, compacted_seq = db.session.execute(change_state_query()).one()
+        latest_seq = latest_change(latest_seq, compacted_seq)
+        if self.database != database or self.seq is None:
+            return self.load(database, latest_seq)
+        compacted = compacted_seq is not None and self.seq < compacted_seq
+        if compacted and latest_seq - self.seq > len(self.rows):
+            return self.load(database, latest_seq)     # Most parts were logged again, e.g. by a snapshot import
+
+        while self.seq < latest_seq:
+            rows = db.session.execute(changes_query(self.seq, current_app.config['INVENTORY_STREAM_BATCH'])).all()
+            if not rows:
+                break
+            for seq, operation, sku, part in rows:
+                self.remove(sku)
+                if part is not None and part.class_name in mirror_readers:     # The part as it is now
+                    self.add(part.class_name, mirror_row(mirror_readers[part.class_name](part)))
+            self.seq = rows[-1][0]
+        self.seq = max(self.seq, latest_seq)
+
+        if compacted:                           # Deletes that were compacted away can't be replayed, so gone SKUs are found instead
+            skus = set(db.session.scalars(select(PartModel.sku)))
+            for sku in [sku for sku in self.rows if sku not in skus]:
+                self.remove(sku)
+
+    def query(self, search, *args):             # Runs an index's search once the indexes are up to date
+        self.start()
+        with self.lock:
+            self.refresh()
+            return search(*args)
+
+    def run(self, app):                         # Loads the mirror once the schema is migrated, then keeps it up to date between searches
+        while self.app is app:
+            try:
+                with app.app_context():
+                    if (inspect(db.engine).has_table(InventoryVersionModel.__tablename__)
+                            and db.session.scalar(inventory_version_query()) is not None):     # Written last by migrate_schema
+                        with self.lock:
+                            self.refresh()
+            except Exception:
+                app.logger.exception("Updating the search indexes failed")
+            time.sleep(app.config['SEARCH_MIRROR_INTERVAL'])
+
+    def start(self):                            # Started by each worker's first request, so imports and CLI commands don't load it
+        thread = self.thread
+        if thread is not None and thread.is_alive():
+            return
+        with self.thread_lock:
+            if (self.app is not None and self.app.config['SEARCH_MIRROR_ENABLED']
+                    and (self.thread is None or not self.thread.is_alive())):
+                self.thread = threading.Thread(target=self.run, args=(self.app,), name='part-mirror', daemon=True)
+                self.thread.start()
+
+    def forked(self):                           # A worker forked mid-load gets fresh locks and loads again
+        self.lock, self.thread_lock, self.thread = threading.Lock(), threading.Lock(), None
+        self.database = None
+
+
+class NearestIndex:                             # Each numeric characteristic's values in sorted arrays
+
+    def __init__(self):
+        self.rows = {}                          # The mirror's rows
+        self.values = {}                        # (class_name, characteristic) -> array of values in ascending order
+        self.skus = {}                          # (class_name, characteristic) -> array of their SKUs, ascending among equal values
+
+    def load(self, rows):                       # Sorts each characteristic's values once
+        entries = {(class_name, characteristic): []
+                   for class_name, characteristics in numeric_characteristics.items() for characteristic in characteristics}
+        positions = {class_name: [(characteristic, mirror_positions[class_name][characteristic]) for characteristic in characteristics]
+                     for class_name, characteristics in numeric_characteristics.items()}
+        for sku, (class_name, row) in rows.items():
+            for characteristic, position in positions[class_name]:
+                if row[position] is not None:
+                    entries[class_name, characteristic].append((row[position], sku))
+
+        for key, pairs in entries.items():
+            pairs.sort()
+            self.values[key] = array('d', [value for value, sku in pairs])
+            self.skus[key] = array('q', [sku for value, sku in pairs])
+        self.rows = rows
+
+    def span(self, key, value, sku):            # Where (value, sku) is or belongs in a characteristic's arrays
+        values = self.values[key]
+        return bisect.bisect_left(self.skus[key], sku, bisect.bisect_left(values, value), bisect.bisect_right(values, value))
+
+    def add(self, class_name, row):
+        for characteristic in numeric_characteristics[class_name]:
+            value = row[mirror_positions[class_name][characteristic]]
+            if value is not None:
+                key = (class_name, characteristic)
+                position = self.span(key, value, row[0])
+                self.values[key].insert(position, value)
+                self.skus[key].insert(position, row[0])
+
+    def remove(self, class_name, row):
+        for characteristic in numeric_characteristics[class_name]:
+            value = row[mirror_positions[class_name][characteristic]]
+            if value is not None:
+                key = (class_name, characteristic)
+                position = self.span(key, value, row[0])
+                del self.values[key][position]
+                del self.skus[key][position]
+
+    def nearest(self, class_name, characteristic, target, limit, direction, matches):
+        # Up to limit SKUs whose rows pass matches, closest to target first, scanning outwards from a binary search
+        values, skus = self.values[class_name, characteristic], self.skus[class_name, characteristic]
+        below = bisect.bisect_left(values, target) - 1  # Last value under the target
+        above = below + 1                               # First value at or over it
+        if direction == 'above':
+            below = -1
+        elif direction == 'below':
+            below, above = bisect.bisect_right(values, target) - 1, len(values)
+
+        found = []
+        while len(found) < limit:
+            if above < len(values) and (below < 0 or values[above] - target <= target - values[below]):
+                position, above = above, above + 1
+            elif below >= 0:
+                position, below = below, below - 1
             else:
-                abort(400, message="No solder characteristics given")
+                break
+            if matches(self.rows[skus[position]][1]):
+                found.append(skus[position])
+        return found
 
 
-        elif class_name == "wire":
+nearest_index = NearestIndex()
 
-            if args['gauge'] or args['wire_length']:
 
-                if args['gauge']:
-                    result = WireModel.query.filter_by(gauge=args['gauge']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(WireModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+nearest_args = RequestArguments()               # Arguments of every nearest search, exact characteristics are in class_search_args
+nearest_args.add_argument("class_name", type=str, help="Class name is required", required=True)
+nearest_args.add_argument("attribute", type=str, help="Attribute is required", required=True)
+nearest_args.add_argument("value", type=float, help="Value is required, must be a finite number", required=True)
+nearest_args.add_argument("limit", type=int, default=1, help="Invalid limit, must be integer", required=False)
+nearest_args.add_argument("direction", type=str, choices=('nearest', 'above', 'below'), default='nearest',
+                          help="Invalid direction, must be 'nearest', 'above' or 'below'", required=False)
+nearest_args.add_argument("series", type=str, choices=tuple(e_series),
+                          help=f"Invalid series. Valid series are {quoted_list(e_series)}", required=False)
+nearest_args.add_argument("min_quantity", type=int, default=0,
+                          help="Invalid min_quantity, must be integer", required=False)
 
-                if args['wire_length']:
-                    result = WireModel.query.filter_by(wire_length=args['wire_length']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(WireModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
 
-            else:
-                abort(400, message="No wire characteristics given")
-
-
-        elif class_name == "display_cable":
-
-            if args['display_cable_type'] or args['display_cable_length'] or args['display_cable_color']:
-
-                if args['display_cable_type']:
-                    result = DisplayCableModel.query.filter_by(display_cable_type=args['display_cable_type']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(DisplayCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
-
-                if args['display_cable_length']:
-                    result = DisplayCableModel.query.filter_by(display_cable_length=args['display_cable_length']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(DisplayCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
-
-                if args['display_cable_color']:
-                    result = DisplayCableModel.query.filter_by(display_cable_color=args['display_cable_color']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(DisplayCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+def nearest_matcher(class_name, args, filters):     # Checks a row against the exact characteristics, range filters and min_quantity
+    positions = mirror_positions[class_name]
+    checks = [(positions[characteristic], operator.eq, args[characteristic])
+              for characteristic in part_types[class_name].searchable if args[characteristic] is not None]
+    checks.extend((positions[name], row_operators[operator_name], value) for name, operator_name, value in filters)
+    if args['min_quantity'] > 0:
+        checks.append((positions['quantity'], operator.ge, args['min_quantity']))
 
-            else:
-                abort(400, message="No display cable characteristics given")
-
-
-        elif class_name == "ethernet_cable":
-
-            if args['alpha_type'] or args['beta_type'] or args['speed'] or args['ethernet_cable_length']:
-
-                if args['alpha_type']:
-                    result = EthernetCableModel.query.filter_by(alpha_type=args['alpha_type']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(EthernetCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
-
-                if args['beta_type']:
-                    result = EthernetCableModel.query.filter_by(beta_type=args['beta_type']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(EthernetCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
-
-                if args['speed']:
-                    result = EthernetCableModel.query.filter_by(speed=args['speed']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(EthernetCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
-
-                if args['ethernet_cable_length']:
-                    result = EthernetCableModel.query.filter_by(ethernet_cable_length=args['ethernet_cable_length']).all()
-                    if result:
-                        for value in result:
-                            schema = generate_schema(EthernetCableModel)
-                            marshaled_schema = marshal(value, schema)
-                            if marshaled_schema not in search_list:
-                                search_list.append(marshaled_schema)
+    def matches(row):
+        return all(row[position] is not None and check(row[position], value) for position, check, value in checks)
+    return matches
 
-            else:
-                abort(400, message="No ethernet cable characteristics given")
 
-        search = json.dumps(search_list, indent=4)
+class Nearest_Search(Resource):
 
-        if len(search_list) == 0:
-            search = {"message": "No parts found"}
+    def get(self):                          # Finds the parts whose characteristic is closest to a value
+        values = request_values()
+        args = check_arguments(parse_class_values(nearest_args, class_search_args, values))
+
+        class_name = args['class_name']
+        if class_name not in part_types:
+            abort(400, message=invalid_class_message)
+        if args['attribute'] not in numeric_characteristics[class_name]:
+            abort(400, message=f"Invalid attribute. Numeric {part_types[class_name].label} attributes are "
+                               f"{quoted_list(numeric_characteristics[class_name])}")
+        check_limit(args['limit'], current_app.config['INVENTORY_MAX_PAGE_SIZE'])
+
+        target = args['value']
+        if not math.isfinite(target):       # Would echo back as NaN or Infinity, which is not JSON
+            abort(400, message={'value': "Value is required, must be a finite number"})
+        if args['series']:
+            if target <= 0:
+                abort(400, message="Value must be positive to snap to a series")
+            target = snap_to_series(target, args['series'])
+        if part_types[class_name].characteristics[args['attribute']] is int and target.is_integer():
+            target = int(target)
+        matches = nearest_matcher(class_name, args, parse_search_filters(class_name, values))
+
+        etag = collection_etag(values)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+
+        skus = part_mirror.query(nearest_index.nearest, class_name, args['attribute'], target, args['limit'],
+                                 args['direction'], matches)
+        parts = read_mirrored_parts((class_name, sku) for sku in skus)
+        return json_response({'target': target, 'parts': [parts[class_name, sku] for sku in skus if (class_name, sku) in parts]},
+                             headers=validator_headers(etag))
+
+
+string_characteristics = {                      # Characteristics of each class with strings for values, which /search/text can match
+    class_name: tuple(characteristic for characteristic, kind in part_type.characteristics.items() if kind is str)
+    for class_name, part_type in part_types.items()}
+
+
+word_pattern = re.compile(r'[a-z0-9]+')
+
+
+def trigrams(text):                             # 'micro-hdmi' -> {'  m', ' mi', 'mic', ..., '  h', ' hd', 'hdm', 'dmi', 'mi '}
+    found = set()
+    for word in word_pattern.findall(text.lower()):     # Each word padded like pg_trgm, so short words still have some
+        padded = f"  {word} "
+        found.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return frozenset(found)
+
+
+class TrigramIndex:                             # Distinct values of the string characteristics, found through their trigrams
+
+    def __init__(self):
+        self.skus = {}                          # (class_name, characteristic, value) -> array of the SKUs with that value, ascending
+        self.ids = {}                           # (class_name, characteristic, value) -> number of the value, cheaper to hash than the key
+        self.keys = {}                          # Number of a value -> its (class_name, characteristic, value)
+        self.trigrams = {}                      # Number of a value -> its trigrams
+        self.postings = defaultdict(set)        # trigram -> numbers of the values that have it
+        self.next_id = 0
+        self.prefixes = []                      # (lowercased value, key) of every value in order, for prefix searches
+
+    def load(self, rows):
+        skus = defaultdict(list)
+        for sku, (class_name, row) in rows.items():
+            for characteristic in string_characteristics[class_name]:
+                value = row[mirror_positions[class_name][characteristic]]
+                if value is not None:
+                    skus[class_name, characteristic, value].append(sku)
+
+        self.skus = {key: array('q', sorted(values)) for key, values in skus.items()}
+        self.ids, self.keys, self.trigrams = {}, {}, {}
+        self.postings = defaultdict(set)
+        for key in self.skus:
+            self.add_value(key)
+        self.prefixes = sorted((key[2].lower(), key) for key in self.skus)
+
+    def add_value(self, key):
+        value_id = self.next_id
+        self.next_id += 1
+        self.ids[key], self.keys[value_id], self.trigrams[value_id] = value_id, key, trigrams(key[2])
+        for trigram in self.trigrams[value_id]:
+            self.postings[trigram].add(value_id)
+
+    def add(self, class_name, row):
+        for characteristic in string_characteristics[class_name]:
+            value = row[mirror_positions[class_name][characteristic]]
+            if value is not None:
+                key = (class_name, characteristic, value)
+                if key not in self.skus:
+                    self.skus[key] = array('q')
+                    self.add_value(key)
+                    bisect.insort(self.prefixes, (value.lower(), key))
+                skus = self.skus[key]
+                skus.insert(bisect.bisect_left(skus, row[0]), row[0])
+
+    def remove(self, class_name, row):
+        for characteristic in string_characteristics[class_name]:
+            value = row[mirror_positions[class_name][characteristic]]
+            if value is not None:
+                key = (class_name, characteristic, value)
+                skus = self.skus[key]
+                del skus[bisect.bisect_left(skus, row[0])]
+                if not skus:                    # The last part with this value is gone, so is the value
+                    del self.skus[key]
+                    del self.prefixes[bisect.bisect_left(self.prefixes, (value.lower(), key))]
+                    value_id = self.ids.pop(key)
+                    del self.keys[value_id]
+                    for trigram in self.trigrams.pop(value_id):
+                        self.postings[trigram].discard(value_id)
+                        if not self.postings[trigram]:
+                            del self.postings[trigram]
+
+    def ranked_values(self, text, prefix, min_similarity):     # [(score, key)] of the values matching text, best first
+        text = text.lower()
+        if prefix:                              # Values starting with text, shortest first
+            scored = []
+            position = bisect.bisect_left(self.prefixes, (text,))
+            while position < len(self.prefixes) and self.prefixes[position][0].startswith(text):
+                key = self.prefixes[position][1]
+                scored.append((len(text) / len(key[2]), key))
+                position += 1
+        else:                                   # Values sharing enough trigrams with text, by Jaccard similarity
+            wanted = trigrams(text)
+            fewest = max(1, math.ceil(min_similarity * len(wanted) - 1e-9))     # Trigrams a value must share to score enough
+            postings = sorted((self.postings.get(trigram, ()) for trigram in wanted), key=len)
+            rarest, others = postings[:len(wanted) - fewest + 1], postings[len(wanted) - fewest + 1:]
+            scored = []
+            for value_id, common in Counter(itertools.chain(*rarest)).items():     # Sharing fewest, it has one of the rarest
+                for posting in others:
+                    if value_id in posting:
+                        common += 1
+                score = common / (len(wanted) + len(self.trigrams[value_id]) - common)
+                if score >= min_similarity:
+                    scored.append((score, self.keys[value_id]))
+        scored.sort(key=lambda item: (-item[0], item[1][2].lower() != text, item[1]))     # Exact matches break ties
+        return scored
+
+    def search(self, text, prefix, min_similarity, class_names, characteristics, offset, limit):
+        # One page of (score, key, sku) for every part with a matching value, and how many there are in all
+        page = []
+        total = 0
+        for score, key in self.ranked_values(text, prefix, min_similarity):
+            if key[0] not in class_names or key[1] not in characteristics:
+                continue
+            skus = self.skus[key]
+            if len(page) < limit and total + len(skus) > offset:    # Past the page, values are only counted
+                start = max(offset - total, 0)
+                page.extend((score, key, sku) for sku in skus[start:start + limit - len(page)])
+            total += len(skus)
+        return page, total
+
+
+text_index = TrigramIndex()
+
+part_mirror = PartMirror(nearest_index, text_index)     # Loaded in the background by each worker, see create_app
+os.register_at_fork(after_in_child=part_mirror.forked)
+
+
+def read_mirrored_parts(keys):                  # {(class_name, sku): serialized part} read from the database for search results
+    skus = defaultdict(list)
+    for class_name, sku in keys:
+        skus[class_name].append(sku)
+
+    rows = {}
+    for class_name, class_skus in skus.items():
+        serializer = part_serializers[class_name]
+        query = select(*serializer.table_columns).where(PartModel.class_name == class_name, PartModel.sku.in_(class_skus))
+        rows.update(((class_name, row[0]), row) for row in db.session.execute(query))
+
+    start = time.perf_counter()
+    parts = {key: part_serializers[key[0]].from_row(row) for key, row in rows.items()}
+    add_serialize_time(start)
+    return parts
+
+
+text_search_args = RequestArguments()
+text_search_args.add_argument("q", type=str, help="Search text is required", required=True)
+text_search_args.add_argument("class_name", type=str, help="Invalid class name, must be string", required=False)
+text_search_args.add_argument("attribute", type=str, help="Invalid attribute, must be string", required=False)
+text_search_args.add_argument("match", type=str, choices=('fuzzy', 'prefix'), default='fuzzy',
+                              help="Invalid match, must be 'fuzzy' or 'prefix'", required=False)
+text_search_args.add_argument("min_similarity", type=float, default=0.3,
+                              help="Invalid min_similarity, must be a number", required=False)
+text_search_args.add_argument("limit", type=int, default=50, help="Invalid limit, must be integer", required=False)
+text_search_args.add_argument("offset", type=int, default=0, help="Invalid offset, must be integer", required=False)
+
+
+class Text_Search(Resource):
+
+    def get(self):                          # Finds the parts with a string characteristic like the search text
+        values = request_values()
+        args = check_arguments(text_search_args.parse(values))
+
+        text = args['q'].strip()
+        if not text:
+            abort(400, message="Search text cannot be empty")
+
+        class_names = part_types.keys()
+        if args['class_name'] is not None:
+            if args['class_name'] not in part_types:
+                abort(400, message=invalid_class_message)
+            class_names = {args['class_name']}
+
+        characteristics = {characteristic for class_name in class_names for characteristic in string_characteristics[class_name]}
+        if args['attribute'] is not None:
+            if args['attribute'] not in characteristics:
+                abort(400, message=f"Invalid attribute. String attributes are {quoted_list(sorted(characteristics))}")
+            characteristics = {args['attribute']}
+
+        check_limit(args['limit'], current_app.config['INVENTORY_MAX_PAGE_SIZE'])
+        if args['offset'] < 0:
+            abort(400, message="Offset cannot be negative")
+        if not 0 <= args['min_similarity'] <= 1:
+            abort(400, message="min_similarity must be between 0 and 1")
+
+        etag = collection_etag(values)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+
+        page, total = part_mirror.query(text_index.search, text, args['match'] == 'prefix', args['min_similarity'],
+                                        class_names, characteristics, args['offset'], args['limit'])
+        parts = read_mirrored_parts((key[0], sku) for score, key, sku in page)
+        matches = [{'score': round(score, 3), 'attribute': key[1], 'value': key[2], 'part': parts[key[0], sku]}
+                   for score, key, sku in page if (key[0], sku) in parts]     # Parts deleted since the search are left out
+        next_offset = args['offset'] + args['limit'] if total > args['offset'] + args['limit'] else None
+        return json_response({'matches': matches, 'total': total, 'next_offset': next_offset}, headers=validator_headers(etag))
+
+
+def stock_levels_query():                       # Every row of stock_levels, a handful per class
+    return select(StockLevelModel.class_name, StockLevelModel.attribute, StockLevelModel.value,
+                  StockLevelModel.part_count, StockLevelModel.total_quantity, StockLevelModel.low_stock_count)
+
+
+def stock_levels():                             # Rows of stock_levels, with the counts of every shard added up
+    if not shard_router.enabled:
+        return db.session.execute(stock_levels_query()).all()
+
+    totals = defaultdict(lambda: [0, 0, 0])
+    for class_name, attribute, value, *counts in fetch_rows(stock_levels_query(), parallel=False):
+        for position, count in enumerate(counts):
+            totals[class_name, attribute, value][position] += count
+    return [(*key, *counts) for key, counts in totals.items()]
+
+
+def stock_report(levels):                       # Nests stock_levels rows by class, then characteristic, then value
+    report = {class_name: {'parts': 0, 'quantity': 0, 'low_stock': 0,
+                           'attributes': {attribute: {} for attribute in attributes}}
+              for class_name, attributes in stock_level_attributes.items()}
+
+    for class_name, attribute, value, part_count, total_quantity, low_stock_count in levels:
+        if class_name not in report:
+            continue
+        totals = {'parts': part_count, 'quantity': total_quantity, 'low_stock': low_stock_count}
+        if attribute == '':
+            report[class_name].update(totals)
+        else:
+            report[class_name]['attributes'].setdefault(attribute, {})[value] = totals
+
+    return report
+
+
+def low_stock_query(class_name, cursor):        # Keyset query over the parts at or below their reorder point
+    query = select(PartModel).where(low_stock)
+    if class_name is not None:
+        if class_name not in part_types:
+            abort(400, message=invalid_class_message)
+        query = query.where(PartModel.class_name == class_name)
+    return keyset(query, cursor)
+
+
+class Stock_Levels(Resource):
+
+    def get(self):                          # Gets part counts and total quantities per class and characteristic
+        etag = collection_etag({})
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+
+        return json_response(stock_report(stock_levels()), headers=validator_headers(etag))
+
+
+class Low_Stock(Resource):
+
+    def get(self):                          # Gets the parts at or below their reorder point
+        args = low_stock_args.parse_args()
+
+        check_limit(args['limit'], current_app.config['INVENTORY_MAX_PAGE_SIZE'])
+
+        query = low_stock_query(args['class_name'], args['cursor'])
+
+        etag = collection_etag(args)
+        if is_not_modified(request.headers, etag):
+            return not_modified_response(etag)
+        headers = validator_headers(etag)
+
+        if args['limit'] is not None or args['cursor'] is not None:
+            return json_response(part_page(query, args['limit'] or current_app.config['INVENTORY_MAX_PAGE_SIZE']),
+                                 headers=headers)
+
+        return json_response(serialize_parts(fetch_parts(query)), headers=headers)
+
+def changes_query(since, limit):                # Changes after since, oldest first, each with the part as it is now
+    return (select(PartChangeModel.seq, PartChangeModel.operation, PartChangeModel.sku, PartModel)
+            .outerjoin(PartModel, PartModel.sku == PartChangeModel.sku)
+            .where(PartChangeModel.seq > since).order_by(PartChangeModel.seq).limit(limit))
+
+
+def change_state_query():                       # (latest sequence number, compacted_seq)
+    return select(select(func.max(PartChangeModel.seq)).scalar_subquery(), InventoryVersionModel.compacted_seq).limit(1)
+
+
+def latest_change(latest_seq, compacted_seq):   # Where a new replica starts, compacted deletes included
+    return max(latest_seq or 0, compacted_seq or 0)
+
+
+def check_since(since, compacted_seq):
+    if compacted_seq is not None and since < compacted_seq:
+        abort(410, message=f"Changes up to {compacted_seq} were compacted, download /inventory/ again")
+
+
+def change_entry(seq, operation, sku, part):
+    change = {'seq': seq, 'operation': operation, 'sku': sku}
+    if operation != 'delete':
+        change['part'] = serialize_part(part) if part is not None else None
+    return change
+
+
+def changes_page(rows, since, limit):           # Turns up to limit + 1 rows of changes_query into a page and where the next one starts
+    more = len(rows) > limit
+    changes = [change_entry(*row) for row in rows[:limit]]
+    return {'changes': changes, 'last_seq': changes[-1]['seq'] if changes else since, 'more': more}
+
+
+def change_event(change, fast=False):           # One Server-Sent Event, whose id lets a reconnecting client resume
+    return b'id: ' + str(change['seq']).encode() + b'\ndata: ' + encode_json(change, fast) + b'\n\n'
+
+
+def stream_changes(since):                      # Streams changes as Server-Sent Events until the client goes away
+    config = current_app.config
+
+    def generate():
+        last_seq = since
+        idle = 0.0
+        while True:
+            rows = db.session.execute(changes_query(last_seq, config['INVENTORY_STREAM_BATCH'])).all()
+            compacted_seq = db.session.scalar(select(InventoryVersionModel.compacted_seq))
+            events = [change_event(change_entry(*row), config['FAST_JSON']) for row in rows]
+            db.session.rollback()               # Ends the read transaction so the next check sees new commits
+
+            if compacted_seq is not None and last_seq < compacted_seq:
+                yield b'event: reset\ndata: {}\n\n'
+                return
+
+            if events:
+                yield b''.join(events)
+                last_seq = rows[-1][0]
+                idle = 0.0
+                continue
+
+            time.sleep(config['CHANGES_POLL_INTERVAL'])
+            idle += config['CHANGES_POLL_INTERVAL']
+            if idle >= config['CHANGES_KEEPALIVE']:     # Keeps proxies from closing an idle connection
+                yield b': keepalive\n\n'
+                idle = 0.0
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+class Changes(Resource):
+
+    def get(self):                          # Gets the changes made after a sequence number, waiting for some if asked to
+        args = changes_get_args.parse_args()
+
+        check_limit(args['limit'], current_app.config['INVENTORY_MAX_PAGE_SIZE'])
+        limit = args['limit'] or current_app.config['INVENTORY_MAX_PAGE_SIZE']
+
+        latest_seq, compacted_seq = db.session.execute(change_state_query()).one()
+        since = args['since']
+        if args['stream'] and request.headers.get('Last-Event-ID', '').isdigit():
+            since = int(request.headers['Last-Event-ID'])
+
+        if since is None:
+            if not args['stream']:          # Tells a new replica where to start before it downloads /inventory/
+                return {'changes': [], 'last_seq': latest_change(latest_seq, compacted_seq), 'more': False}, 200
+            since = latest_change(latest_seq, compacted_seq)
+
+        check_since(since, compacted_seq)
+
+        if args['stream']:
+            return stream_changes(since)
+
+        deadline = time.monotonic() + min(max(args['wait'] or 0, 0), current_app.config['CHANGES_MAX_WAIT'])
+        rows = db.session.execute(changes_query(since, limit + 1)).all()
+        while not rows and time.monotonic() < deadline:
+            db.session.rollback()               # Ends the read transaction so the next check sees new commits
+            time.sleep(current_app.config['CHANGES_POLL_INTERVAL'])
+            rows = db.session.execute(changes_query(since, limit + 1)).all()
+
+        return json_response(changes_page(rows, since, limit))
+
+snapshot_magic = b'INVSNAP\x01'                # Starts every binary snapshot, the last byte is the format version
+snapshot_epoch = datetime(1970, 1, 1)
+one_microsecond = timedelta(microseconds=1)
+array_typecodes = {'int': 'q', 'float': 'd', 'datetime': 'q'}
+
+
+def column_kind(column):                        # How a column of parts is stored in a snapshot
+    for kind, column_type in (('int', db.Integer), ('float', db.Float), ('datetime', db.DateTime), ('str', db.String)):
+        if isinstance(column.type, column_type):
+            return kind
+
+
+snapshot_kinds = {column.name: column_kind(column) for column in PartModel.__table__.columns}
+
+
+def snapshot_columns(class_name):               # Columns stored for each part of a class, class_name is only stored once per block
+    return [column for column in part_serializers[class_name].columns if column != 'class_name']
+
+
+def pack_array(typecode, values):               # Little-endian bytes whatever the machine
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_array(typecode, data):
+    unpacked = array(typecode)
+    unpacked.frombytes(data)
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked
+
+
+def encode_column(kind, values):                # A flag byte per value for NULLs, then the values as one array, compressed
+    nulls = bytes(value is None for value in values)
+    if kind == 'str':
+        encoded = [value.encode() if value is not None else b'' for value in values]
+        data = pack_array('I', map(len, encoded)) + b''.join(encoded)
+    elif kind == 'datetime':
+        data = pack_array('q', ((value - snapshot_epoch) // one_microsecond if value is not None else 0
+                                for value in values))
+    else:
+        data = pack_array(array_typecodes[kind], (value if value is not None else 0 for value in values))
+    return zlib.compress(nulls + data, 1)
+
+
+def decode_column(kind, count, payload):
+    data = zlib.decompress(payload)
+    nulls, data = data[:count], data[count:]
+    if kind == 'str':
+        lengths = unpack_array('I', data[:4 * count])
+        values, position = [], 4 * count
+        for length in lengths:
+            values.append(data[position:position + length].decode())
+            position += length
+    elif kind == 'datetime':
+        values = [snapshot_epoch + value * one_microsecond for value in unpack_array('q', data)]
+    else:
+        values = unpack_array(array_typecodes[kind], data).tolist()
+    return [None if null else value for null, value in zip(nulls, values)]
+
+
+def snapshot_block(class_name, rows):           # One class's rows, stored column by column with each column length-prefixed
+    columns = snapshot_columns(class_name)
+    name = class_name.encode()
+    block = [struct.pack('<H', len(name)), name, struct.pack('<I', len(rows))]
+    for column in columns:
+        payload = encode_column(snapshot_kinds[column], [row[column] for row in rows])
+        block += [struct.pack('<I', len(payload)), payload]
+    return b''.join(block)
+
+
+def snapshot_rows_query():                      # Every part of a known class, grouped by class so blocks hold one class each
+    table = PartModel.__table__
+    return (select(*table.columns).where(table.c.class_name.in_(list(part_types)))
+            .order_by(table.c.class_name, table.c.sku))
+
+
+def export_snapshot(snapshot_format='binary', chunk_size=default_config['SNAPSHOT_CHUNK_SIZE'], bind=None):
+    """Yields a snapshot of every part as bytes, reading chunk_size rows at a time.
+
+    The binary format is the magic bytes, a length-prefixed JSON header naming the columns of each
+    class, then blocks of up to chunk_size parts of one class ending with an empty class name.
+    The CSV format has a header row with every column of parts.
+    """
+    with (bind if bind is not None else db.engine).connect() as connection:
+        # One statement, so one consistent view, fetched chunk_size rows at a time rather than all at once
+        rows = connection.execute(snapshot_rows_query().execution_options(yield_per=chunk_size)).mappings()
+
+        if snapshot_format == 'csv':
+            columns = list(snapshot_kinds)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for chunk in rows.partitions(chunk_size):
+                writer.writerows([[row[column].isoformat() if snapshot_kinds[column] == 'datetime' and row[column]
+                                   else row[column] for column in columns] for row in chunk])
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue().encode()
+            return
+
+        header = json.dumps({'columns': {class_name: [[column, snapshot_kinds[column]] for column in
+                                                      snapshot_columns(class_name)] for class_name in part_types},
+                             'exported_at': datetime.now(timezone.utc).isoformat()}).encode()
+        yield snapshot_magic + struct.pack('<I', len(header)) + header
+        for chunk in rows.partitions(chunk_size):
+            start = 0
+            for end in range(1, len(chunk) + 1):        # Splits a chunk wherever the class changes
+                if end == len(chunk) or chunk[end]['class_name'] != chunk[start]['class_name']:
+                    yield snapshot_block(chunk[start]['class_name'], chunk[start:end])
+                    start = end
+        yield struct.pack('<H', 0)
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            raise ValueError("Snapshot is truncated")
+        data += more
+    return data
+
+
+def read_binary_snapshot(stream):               # Yields lists of part rows, one per block of a binary snapshot
+    if read_exactly(stream, len(snapshot_magic)) != snapshot_magic:
+        raise ValueError("Not an inventory snapshot, or one of an unsupported version")
+    header = json.loads(read_exactly(stream, struct.unpack('<I', read_exactly(stream, 4))[0]))
+
+    while True:
+        name = read_exactly(stream, struct.unpack('<H', read_exactly(stream, 2))[0]).decode()
+        if not name:
+            return
+        if name not in part_types or name not in header['columns']:
+            raise ValueError(f"Snapshot holds parts of unknown class '{name}'")
+
+        count = struct.unpack('<I', read_exactly(stream, 4))[0]
+        rows = [{'class_name': name} for _ in range(count)]
+        for column, kind in header['columns'][name]:
+            payload = read_exactly(stream, struct.unpack('<I', read_exactly(stream, 4))[0])
+            if column in snapshot_kinds:        # Columns since dropped from the models are skipped
+                for row, value in zip(rows, decode_column(kind, count, payload)):
+                    row[column] = value
+        yield rows
+
+
+csv_parsers = {'int': int, 'float': float, 'datetime': datetime.fromisoformat, 'str': str}
+
+
+def is_unique_violation(error):                 # Whether an IntegrityError is a duplicate key rather than, say, a missing value
+    code = (getattr(error.orig, 'sqlite_errorname', None) or getattr(error.orig, 'pgcode', None)
+            or getattr(error.orig, 'sqlstate', None))
+    if code is not None:
+        return code in ('SQLITE_CONSTRAINT_UNIQUE', 'SQLITE_CONSTRAINT_PRIMARYKEY', '23505')
+    return 'unique' in str(error.orig).lower() or 'duplicate' in str(error.orig).lower()
+
+
+def read_csv_snapshot(stream, chunk_size):      # Yields lists of up to chunk_size part rows from a CSV snapshot
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    columns = [column for column in reader.fieldnames or () if column in snapshot_kinds]
+    if 'sku' not in columns or 'class_name' not in columns:
+        raise ValueError("CSV snapshot needs at least the sku and class_name columns")
+
+    rows = []
+    for record in reader:
+        if record['class_name'] not in part_types:
+            raise ValueError(f"Snapshot holds parts of unknown class '{record['class_name']}'")
+        rows.append({column: csv_parsers[snapshot_kinds[column]](record[column]) if record[column] != '' else None
+                     for column in columns})
+        if len(rows) == chunk_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def import_snapshot(stream, snapshot_format='binary', chunk_size=default_config['SNAPSHOT_CHUNK_SIZE'], bind=None):
+    """Replaces every part with those of a snapshot in one transaction, returns how many were loaded.
+
+    The triggers and indexes of parts are dropped while loading and rebuilt once at the end. Every
+    change made before the import is compacted, so replicas of the old inventory get a 410 from
+    /changes and download /inventory/ again.
+    """
+    if not isinstance(bind, Connection):
+        with (bind if bind is not None else db.engine).begin() as connection:
+            return import_snapshot(stream, snapshot_format, chunk_size, connection)
+
+    table = PartModel.__table__
+    changes = PartChangeModel.__table__
+    dialect_name = bind.dialect.name
+    if dialect_name == 'sqlite' and not bind.connection.dbapi_connection.in_transaction:
+        # pysqlite only opens its transaction before DML, the drops below would commit on their own
+        bind.exec_driver_sql('BEGIN')
+    for statement in part_triggers(dialect_name):
+        if statement.startswith('DROP TRIGGER'):
+            bind.execute(text(statement))
+    for index in table.indexes:
+        index.drop(bind, checkfirst=True)
+
+    # Removed parts leave a delete in the change log, like a DELETE /part/ would
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    bind.execute(changes.delete())
+    bind.execute(insert(changes).from_select(['sku', 'operation', 'changed_at'],
+                                             select(table.c.sku, literal('delete'), literal(now)).order_by(table.c.sku)))
+    bind.execute(table.delete())
+
+    blocks = read_csv_snapshot(stream, chunk_size) if snapshot_format == 'csv' else read_binary_snapshot(stream)
+    loaded = 0
+    for rows in blocks:
+        bind.execute(insert(table), rows)
+        loaded += len(rows)
+
+    bind.execute(changes.delete().where(changes.c.sku.in_(select(table.c.sku))))
+    bind.execute(insert(changes).from_select(['sku', 'operation', 'changed_at'],
+                                             select(table.c.sku, literal('insert'), literal(now)).order_by(table.c.sku)))
+    latest_seq = bind.scalar(select(func.max(changes.c.seq)))
+    if latest_seq is not None:
+        bind.execute(update(InventoryVersionModel).values(version=InventoryVersionModel.version + 1,
+                                                          compacted_seq=latest_seq))
+
+    for index in table.indexes:
+        index.create(bind)
+    for statement in part_triggers(dialect_name):
+        bind.execute(text(statement))
+    recount_stock_levels(bind)
+    return loaded
+
+
+snapshot_args = RequestArguments(location='args')
+snapshot_args.add_argument("format", type=str, choices=('binary', 'csv'), default='binary',
+                           help="Invalid format, must be 'binary' or 'csv'", required=False)
+
+
+@click.command('export-snapshot')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'snapshot_format', type=click.Choice(['binary', 'csv']), default='binary')
+@with_appcontext
+def export_snapshot_command(path, snapshot_format):     # flask --app main export-snapshot inventory.snapshot
+    if shard_router.enabled:
+        raise click.UsageError("Snapshots are not supported when SHARD_BY is set")
+    with open(path, 'wb') as output:
+        for data in export_snapshot(snapshot_format, current_app.config['SNAPSHOT_CHUNK_SIZE']):
+            output.write(data)
+
+
+@click.command('import-snapshot')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'snapshot_format', type=click.Choice(['binary', 'csv']), default='binary')
+@with_appcontext
+def import_snapshot_command(path, snapshot_format):     # flask --app main import-snapshot inventory.snapshot
+    if shard_router.enabled:
+        raise click.UsageError("Snapshots are not supported when SHARD_BY is set")
+    with open(path, 'rb') as snapshot:
+        loaded = import_snapshot(snapshot, snapshot_format, current_app.config['SNAPSHOT_CHUNK_SIZE'])
+    part_cache.clear()
+    click.echo(f"Imported {loaded} parts")
+
+
+class Snapshot(Resource):
+
+    def get(self):                          # Streams a snapshot of the inventory
+        args = snapshot_args.parse_args()
+        if args['format'] == 'csv':
+            mimetype, filename = 'text/csv', 'inventory.csv'
+        else:
+            mimetype, filename = 'application/octet-stream', 'inventory.snapshot'
+
+        chunks = export_snapshot(args['format'], current_app.config['SNAPSHOT_CHUNK_SIZE'])
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+    def put(self):                          # Replaces the inventory with the snapshot in the request body
+        args = snapshot_args.parse_args()
+        flush_queued_quantities()
+        try:
+            loaded = import_snapshot(request.stream, args['format'], current_app.config['SNAPSHOT_CHUNK_SIZE'])
+        except (ValueError, KeyError, UnicodeDecodeError, zlib.error, struct.error, csv.Error) as error:
+            abort(400, message=f"Invalid snapshot: {error}")
+        except IntegrityError as error:
+            if not is_unique_violation(error):  # e.g. a CSV snapshot without a quantity column
+                abort(400, message=f"Invalid snapshot: {error.orig}")
+            abort(409, message="Snapshot holds duplicate SKUs or parts")
+        part_cache.clear()
+        return {"message": "Snapshot imported", "parts": loaded}, 200
+
+
+class Cache_Stats(Resource):
+
+    def get(self):                          # Gets the part cache's hit, miss and eviction counters
+        return part_cache.stats(), 200
+
+class Metrics(Resource):
+
+    def get(self):                          # Gets request metrics in the Prometheus text format
+        return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def engine_options(config, uri=None):           # Connection pool sizing, skipped for in-memory SQLite which keeps a single connection
+    url = make_url(uri or config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return {'pool_size': config['DB_POOL_SIZE'], 'max_overflow': config['DB_MAX_OVERFLOW'], 'pool_pre_ping': True}
+
+
+def shard_binds(config):                        # SQLALCHEMY_BINDS entry of each shard, pooled like the default database
+    binds = {}
+    for shard in shard_names(config):
+        uri = config['SHARD_DATABASE_URI'].format(shard=shard)
+        binds[shard] = {'url': uri, **engine_options(config, uri)}
+    return binds
+
+
+def sqlite_pragmas(config):                     # Listener that tunes every new SQLite connection
+    pragmas = [f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+               f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+               f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+               f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}"]
+
+    def tune_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return tune_connection
+
+
+def create_app(config=None):                    # Builds the API from default_config, then INVENTORY_* environment variables, then config
+    app = Flask(__name__)
+    app.config.update(default_config)
+    app.config.from_prefixed_env('INVENTORY')
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    if app.config['SHARD_BY'] is not None:      # Each shard is a bind of its own, which ShardRouter routes sessions to
+        app.config['SQLALCHEMY_BINDS'] = {**app.config.get('SQLALCHEMY_BINDS', {}), **shard_binds(app.config)}
+
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', sqlite_pragmas(app.config))
+
+    shard_router.configure(app)
+    part_cache.configure(app.config['PART_CACHE_SIZE'], app.config['PART_CACHE_TTL'])
+    quantity_writer.configure(app)
+    inventory_dump.configure(app)
+    part_mirror.configure(app)
+    app.before_request(start_request_metrics)
+    app.after_request(finish_request_metrics)
+    app.after_request(compress_response)        # Runs before finish_request_metrics, so compression counts towards latency
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(compact_changes_command)
+    app.cli.add_command(export_snapshot_command)
+    app.cli.add_command(import_snapshot_command)
+
+    api = Api(app)
+
+    api.add_resource(Add_Part, '/part/')            # includes the put method for add_part
+
+    api.add_resource(Bulk_Add_Parts, '/parts/bulk')     # includes the post method for adding many parts at once
+
+    api.add_resource(Get_or_Delete_Part, '/part/<int:sku>')      # includes the get and delete methods for get_part and delete_part
+
+    api.add_resource(Quantity, '/quantity/<int:sku>')      # includes the get method for get_quantity
+
+    api.add_resource(Multi_Get_Parts, '/parts')     # includes the get and post methods for fetching many parts at once
+
+    api.add_resource(Inventory, '/inventory/')
+
+    api.add_resource(Search, '/search/')            # includes the get method for search function
+
+    api.add_resource(Stock_Levels, '/stock/')         # includes the get method for stock totals per class and characteristic
+
+    api.add_resource(Low_Stock, '/stock/low')       # includes the get method for parts at or below their reorder point
+
+    api.add_resource(Cache_Stats, '/stats/cache')   # includes the get method for the part cache counters
+
+    api.add_resource(Metrics, '/metrics')           # includes the get method for request metrics
+
+    if app.config['SHARD_BY'] is None:          # These follow one change log or copy one parts table, which shards don't share
+        api.add_resource(Nearest_Search, '/search/nearest')    # includes the get method for nearest value search
 
-        return search, 200
+        api.add_resource(Text_Search, '/search/text')      # includes the get method for fuzzy and prefix text search
+        if app.config['SEARCH_MIRROR_ENABLED']:
+            app.before_request(part_mirror.start)   # Loads their indexes once the worker serves, rather than in the first search
 
-api.add_resource(Add_Part, '/part/')            # includes the put method for add_part
+        api.add_resource(Changes, '/changes')           # includes the get method for the change feed
 
-api.add_resource(Get_or_Delete_Part, '/part/<int:sku>')      # includes the get and delete methods for get_part and delete_part
+        if app.config['ADMIN_ENABLED']:
+            api.add_resource(Snapshot, '/admin/snapshot')   # includes the get and put methods for exporting and importing snapshots
 
-api.add_resource(Quantity, '/quantity/<int:sku>')      # includes the get method for get_quantity
+    return app
 
-api.add_resource(Inventory, '/inventory/')
 
-api.add_resource(Search, '/search/')            # includes the get method for search function
+app = create_app()      # Served by "python main.py", "flask --app main run" or a WSGI server such as "gunicorn -w 4 main:app"
 
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
+        migrate_schema()
     app.run(debug=False)
\ No newline at end of file
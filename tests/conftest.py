@@ -0,0 +1,69 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Builds an app on a fresh database in tmp_path, create_app reconfigures the module's singletons for it."""
+    def make(**config):
+        app = main.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/inventory.db',
+                               'SHARD_DATABASE_URI': f'sqlite:///{tmp_path}/inventory_{{shard}}.db', **config})
+        with app.app_context():
+            main.migrate_schema()
+        return app
+    return make
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app().test_client()
+
+
+def add_wire(client, sku, gauge, quantity=1, **fields):     # PUTs a wire, the gauge keeps it apart from other wires
+    body = {'sku': sku, 'class_name': 'wire', 'gauge': gauge, 'wire_length': 1.0, 'quantity': quantity, **fields}
+    response = client.put('/part/', json=body)
+    assert response.status_code == 201, response.json
+    return response
+
+
+def part_body(sku):                             # A valid part of every class in turn, unique within its class
+    n = sku // 5 + 1
+    class_name = ('resistor', 'solder', 'wire', 'display_cable', 'ethernet_cable')[sku % 5]
+    body = {'sku': sku, 'class_name': class_name, 'quantity': n % 7}
+    if class_name == 'resistor':
+        body.update(resistance=n, tolerance=n % 20 + 1)
+    elif class_name == 'solder':
+        body.update(solder_type=('lead', 'lead-free', 'rosin-core')[n % 3], solder_length=n / 10)
+    elif class_name == 'wire':
+        body.update(gauge=float(n), wire_length=n / 10)
+    elif class_name == 'display_cable':
+        body.update(display_cable_type=('hdmi', 'vga', 'displayport')[n % 3], display_cable_length=n / 10,
+                    display_cable_color=f'#{n:06X}')
+    else:
+        body.update(alpha_type='male', beta_type='female', speed=('100mbps', '1gbps')[n % 2], ethernet_cable_length=n / 10)
+    return body
+
+
+def without_dates(value):                       # A response body with every date_last_updated left out, for comparing runs
+    if isinstance(value, dict):
+        return {key: without_dates(item) for key, item in value.items() if key != 'date_last_updated'}
+    if isinstance(value, list):
+        return [without_dates(item) for item in value]
+    return value
+
+
+def expected_stock(inventory):                  # GET /stock/ worked out from the parts themselves
+    stock = {class_name: {'parts': 0, 'quantity': 0, 'low_stock': 0, 'attributes': {}} for class_name in main.part_types}
+    for part in inventory:
+        low = int(part['reorder_point'] is not None and part['quantity'] <= part['reorder_point'])
+        totals = [stock[part['class_name']]]
+        for attribute in main.stock_level_attributes[part['class_name']]:
+            if part[attribute] is not None:
+                values = totals[0]['attributes'].setdefault(attribute, {})
+                totals.append(values.setdefault(part[attribute], {'parts': 0, 'quantity': 0, 'low_stock': 0}))
+        for total in totals:
+            total['parts'] += 1
+            total['quantity'] += part['quantity']
+            total['low_stock'] += low
+    return stock
@@ -0,0 +1,14 @@
+def test_form_bodies_are_accepted(client):
+    response = client.put('/part/', data={'sku': '1', 'class_name': 'resistor', 'quantity': '3',
+                                          'resistance': '4', 'tolerance': '5'})
+    assert response.status_code == 201
+
+    response = client.patch('/inventory/', data={'sku': '1', 'quantity': '7'})
+    assert response.status_code == 200
+    assert client.get('/quantity/1').json == {'sku': 1, 'quantity': 7}
+
+
+def test_form_values_are_checked_like_json(client):
+    response = client.put('/part/', data={'sku': 'one', 'class_name': 'resistor', 'quantity': '3'})
+    assert response.status_code == 400
+    assert response.json == {'message': {'sku': "SKU is required"}}
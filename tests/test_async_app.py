@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('httpx')                    # Needed by Starlette's TestClient
+
+from starlette.testclient import TestClient
+
+import main
+from async_app import create_async_app
+from conftest import add_wire, part_body, without_dates
+
+
+@pytest.fixture
+def async_client(tmp_path):
+    app = create_async_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/async.db'})     # Apart from make_app's
+    with TestClient(app) as client:             # Runs the lifespan, which migrates the schema
+        yield client
+
+
+def test_form_bodies_are_accepted(async_client):
+    response = async_client.put('/part/', data={'sku': '1', 'class_name': 'resistor', 'quantity': '3',
+                                                'resistance': '4', 'tolerance': '5'})
+    assert response.status_code == 201
+
+    response = async_client.patch('/inventory/', data={'sku': '1', 'quantity': '7'})
+    assert response.status_code == 200
+    assert async_client.get('/quantity/1').json() == {'sku': 1, 'quantity': 7}
+
+
+def test_form_values_are_checked_like_json(async_client):
+    response = async_client.put('/part/', data={'sku': 'one', 'class_name': 'resistor', 'quantity': '3'})
+    assert response.status_code == 400
+    assert response.json() == {'message': {'sku': "SKU is required"}}
+
+
+workload = [('PUT', '/part/', {'json': part_body(sku)}) for sku in range(1, 21)] + [
+    ('PUT', '/part/', {'json': part_body(3)}),
+    ('PUT', '/part/', {'json': {'sku': 'x'}}),
+    ('GET', '/part/3', {}),
+    ('GET', '/part/99', {}),
+    ('GET', '/quantity/4', {}),
+    ('PATCH', '/inventory/', {'json': {'sku': 4, 'quantity': 9}}),
+    ('PATCH', '/inventory/', {'json': [{'sku': 5, 'delta': 2}, {'sku': 6, 'delta': -50}]}),
+    ('GET', '/part/4', {}),
+    ('DELETE', '/part/7', {}),
+    ('DELETE', '/part/7', {}),
+    ('GET', '/inventory/', {}),
+    ('GET', '/inventory/', {'params': {'limit': 4, 'cursor': 5}}),
+    ('GET', '/inventory/', {'params': {'stream': 'ndjson'}}),
+    ('GET', '/search/', {'params': {'class_name': 'wire', 'gauge__gte': 2}}),
+    ('GET', '/stock/', {}),
+    ('GET', '/stock/low', {}),
+    ('GET', '/changes', {'params': {'since': 0, 'limit': 3}}),
+]
+
+
+def answer(status, content_type, body):         # A response's status and body, without the dates that differ between runs
+    if content_type.startswith('application/x-ndjson'):
+        return status, [without_dates(json.loads(line)) for line in body.splitlines()]
+    return status, without_dates(json.loads(body))
+
+
+def flask_answer(client, method, path, kwargs):
+    response = client.open(path, method=method, json=kwargs.get('json'), query_string=kwargs.get('params'))
+    return answer(response.status_code, response.content_type, response.data)
+
+
+def async_answer(client, method, path, kwargs):
+    response = client.request(method, path, **kwargs)
+    return answer(response.status_code, response.headers['Content-Type'], response.content)
+
+
+def test_answers_like_the_flask_app(make_app, async_client):
+    client = make_app().test_client()
+    expected = [flask_answer(client, *request) for request in workload]
+    main.part_cache.clear()                     # Shared by both apps, which hold the same SKUs
+    assert [async_answer(async_client, *request) for request in workload] == expected
+
+
+def test_starts_no_search_mirror(async_client):
+    add_wire(async_client, 1, 1.0)
+    assert main.part_mirror.thread is None
+
+
+def test_conditional_gets(async_client):
+    add_wire(async_client, 1, 1.0)
+    for path in ('/part/1', '/inventory/'):
+        etag = async_client.get(path).headers['ETag']
+        assert async_client.get(path, headers={'If-None-Match': etag}).status_code == 304
+    etag = async_client.get('/inventory/').headers['ETag']
+    async_client.patch('/inventory/', json={'sku': 1, 'quantity': 4})
+    assert async_client.get('/inventory/', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_long_poll_gives_up_after_wait(async_client):
+    since = async_client.get('/changes').json()['last_seq']
+    response = async_client.get('/changes', params={'since': since, 'wait': 0.2})
+    assert response.json() == {'changes': [], 'last_seq': since, 'more': False}
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from conftest import add_wire
+
+
+def resistor(sku, resistance, quantity=1):
+    return {'sku': sku, 'class_name': 'resistor', 'quantity': quantity, 'resistance': resistance, 'tolerance': 1}
+
+
+@pytest.fixture
+def client(make_app):
+    client = make_app(BULK_CHUNK_SIZE=2).test_client()     # Several chunks, so clashes across chunks are checked too
+    add_wire(client, 1, 1.0)
+    return client
+
+
+def test_each_part_gets_its_own_result(client):
+    parts = [
+        {'sku': 1, 'class_name': 'wire', 'quantity': 1, 'gauge': 2.0, 'wire_length': 1.0},
+        {'sku': 2, 'class_name': 'wire', 'quantity': 1, 'gauge': 1.0, 'wire_length': 1.0},
+        resistor(3, 5),
+        resistor(3, 6),                         # SKU taken earlier in the batch
+        resistor(4, 5),                         # Same characteristics as one earlier in the batch
+        {'sku': 5, 'class_name': 'robot', 'quantity': 1},
+        resistor(6, 7, quantity=-1),
+        'not a part',
+        resistor(7, 8),
+    ]
+    response = client.post('/parts/bulk', json=parts)
+    assert response.status_code == 200
+    assert response.json['created'] == 2 and response.json['failed'] == 7
+    assert [(result['index'], result['sku'], result['status']) for result in response.json['results']] == [
+        (0, 1, 409), (1, 2, 409), (2, 3, 201), (3, 3, 409), (4, 4, 409), (5, 5, 400), (6, 6, 400), (7, None, 400), (8, 7, 201)]
+    messages = [result['message'] for result in response.json['results']]
+    assert messages[:5] == ["SKU taken", "This wire already exists in the inventory", "Part sucessfully added",
+                            "SKU taken", "This resistor already exists in the inventory"]
+    assert messages[6] == "Quantity cannot be negative"
+    assert sorted(part['sku'] for part in client.get('/inventory/').json) == [1, 3, 7]
+
+
+def test_results_match_adding_parts_one_at_a_time(make_app, tmp_path):
+    parts = [resistor(sku, sku % 3) for sku in range(1, 7)] + [resistor(7, 9, quantity=-2)]
+    bulk = make_app(BULK_CHUNK_SIZE=3).test_client().post('/parts/bulk', json=parts).json['results']
+
+    single = make_app(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path}/single.db').test_client()
+    for part, result in zip(parts, bulk):
+        response = single.put('/part/', json=part)
+        assert (result['status'], result['message']) == (response.status_code, response.json['message'])
+
+
+def test_ndjson_bodies(client):
+    lines = [json.dumps(resistor(10, 1)), '', json.dumps(resistor(11, 2)), '{not json']
+    response = client.post('/parts/bulk', data='\n'.join(lines), content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert [result['status'] for result in response.json['results']] == [201, 201, 400]
+    assert client.get('/quantity/11').json == {'sku': 11, 'quantity': 1}
+
+
+def test_body_must_hold_parts(client):
+    response = client.post('/parts/bulk', json={'sku': 1})
+    assert response.status_code == 400
+    assert response.json == {'message': "Request body must be a JSON array or NDJSON of parts"}
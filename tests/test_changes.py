@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+
+import pytest
+
+import main
+from conftest import add_wire
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(CHANGES_POLL_INTERVAL=0.05, CHANGES_KEEPALIVE=0.1)
+
+
+def changes(client, **params):
+    response = client.get('/changes', query_string=params)
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def test_replica_catches_up_from_last_seq(app):
+    client = app.test_client()
+    add_wire(client, 1, 1.0)
+    add_wire(client, 2, 2.0)
+    start = changes(client)['last_seq']         # Where a new replica starts, before downloading /inventory/
+    replica = {part['sku']: part for part in client.get('/inventory/').json}
+
+    add_wire(client, 3, 3.0)
+    client.patch('/inventory/', json={'sku': 1, 'quantity': 5})
+    client.patch('/inventory/', json={'sku': 3, 'quantity': 6})
+    client.delete('/part/2')
+
+    since, seen = start, []
+    while True:
+        page = changes(client, since=since, limit=2)
+        for change in page['changes']:
+            seen.append((change['sku'], change['operation']))
+            if change['operation'] == 'delete':
+                replica.pop(change['sku'], None)
+            else:
+                replica[change['sku']] = change['part']
+        since = page['last_seq']
+        if not page['more']:
+            break
+    assert seen == [(1, 'update'), (3, 'update'), (2, 'delete')]     # Each SKU once, with its latest change
+    assert sorted(replica.values(), key=lambda part: part['sku']) == client.get('/inventory/').json
+
+
+def test_long_poll_returns_once_a_change_commits(app):
+    client = app.test_client()
+    since = changes(client)['last_seq']
+    timer = threading.Timer(0.2, lambda: add_wire(app.test_client(), 1, 1.0))
+    timer.start()
+    start = time.monotonic()
+    page = changes(client, since=since, wait=5)
+    timer.join()
+    assert time.monotonic() - start < 4
+    assert [change['sku'] for change in page['changes']] == [1]
+
+
+def test_long_poll_gives_up_after_wait(app):
+    client = app.test_client()
+    since = changes(client)['last_seq']
+    start = time.monotonic()
+    assert changes(client, since=since, wait=0.2) == {'changes': [], 'last_seq': since, 'more': False}
+    assert time.monotonic() - start >= 0.2
+
+
+def read_events(response, count):               # The first count events of a Server-Sent Events stream as field dicts, keepalives left out
+    events, buffer = [], b''
+    for chunk in response.response:
+        buffer += chunk
+        *blocks, buffer = buffer.split(b'\n\n')
+        events += [dict(line.decode().split(': ', 1) for line in block.split(b'\n'))
+                   for block in blocks if not block.startswith(b':')]
+        if len(events) >= count:
+            response.close()
+            return events[:count]
+
+
+def test_stream_sends_events_and_resumes(app):
+    client = app.test_client()
+    add_wire(client, 1, 1.0)
+    add_wire(client, 2, 2.0)
+    response = client.get('/changes', query_string={'since': 0, 'stream': 'sse'}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    first, second = read_events(response, 2)
+    assert [json.loads(event['data'])['sku'] for event in (first, second)] == [1, 2]
+    assert json.loads(first['data'])['seq'] == int(first['id'])
+
+    response = client.get('/changes', query_string={'since': 0, 'stream': 'sse'}, headers={'Last-Event-ID': first['id']},
+                          buffered=False)
+    assert read_events(response, 1) == [second]
+
+
+def test_stream_resets_once_its_changes_are_compacted(app):
+    client = app.test_client()
+    add_wire(client, 1, 1.0)
+    response = client.get('/changes', query_string={'stream': 'sse'}, buffered=False)     # From the latest change
+    client.delete('/part/1')
+    with app.app_context():
+        main.compact_changes(0)
+    assert read_events(response, 1) == [{'event': 'reset', 'data': '{}'}]
+
+
+def test_compacted_deletes_need_a_new_download(app):
+    client = app.test_client()
+    add_wire(client, 1, 1.0)
+    since = changes(client)['last_seq']
+    client.delete('/part/1')
+    with app.app_context():
+        assert main.compact_changes(0) == 1
+
+    response = client.get('/changes', query_string={'since': since})
+    assert response.status_code == 410
+    assert 'download /inventory/ again' in response.json['message']
+    response = client.get('/changes', query_string={'since': since, 'stream': 'sse'}, buffered=False)
+    assert response.status_code == 410
+
+    last_seq = changes(client)['last_seq']
+    assert changes(client, since=last_seq)['changes'] == []
@@ -0,0 +1,66 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import part_body
+
+
+@pytest.fixture
+def client(make_app):
+    client = make_app().test_client()
+    for sku in range(1, 31):                    # Enough for /inventory/ to pass COMPRESSION_MIN_SIZE
+        assert client.put('/part/', json=part_body(sku)).status_code == 201
+    return client
+
+
+def gzipped(client, url, **kwargs):
+    return client.get(url, headers={'Accept-Encoding': 'gzip', **kwargs.pop('headers', {})}, **kwargs)
+
+
+@pytest.mark.parametrize('params', [{}, {'limit': 30}])
+def test_gzip_holds_the_same_body_under_its_own_etag(client, params):
+    plain = client.get('/inventory/', query_string=params)
+    response = gzipped(client, '/inventory/', query_string=params)
+    assert plain.headers.get('Content-Encoding') is None
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+    assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert response.vary == plain.vary and 'Accept-Encoding' in response.vary
+
+
+def test_not_modified_names_the_encoding_the_client_has(client):
+    etag = gzipped(client, '/inventory/').headers['ETag']
+    response = gzipped(client, '/inventory/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'Accept-Encoding' in response.vary
+
+
+@pytest.mark.parametrize('accept_encoding', ['gzip;q=0', 'identity', ''])
+def test_refused_encodings_send_the_body_as_it_is(client, accept_encoding):
+    response = client.get('/inventory/', headers={'Accept-Encoding': accept_encoding})
+    assert response.headers.get('Content-Encoding') is None
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_small_bodies_are_sent_as_they_are(client):
+    response = gzipped(client, '/part/1')
+    assert response.headers.get('Content-Encoding') is None
+    assert not response.headers['ETag'].endswith('-gzip"')
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_streams_are_compressed_as_they_go(client):
+    response = gzipped(client, '/inventory/', query_string={'stream': 'ndjson'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.data).splitlines()) == 30
+
+
+def test_compression_can_be_turned_off(make_app):
+    client = make_app(COMPRESSION_ENABLED=False).test_client()
+    for sku in range(1, 31):
+        client.put('/part/', json=part_body(sku))
+    response = gzipped(client, '/inventory/')
+    assert response.headers.get('Content-Encoding') is None
+    assert 'Accept-Encoding' not in response.vary
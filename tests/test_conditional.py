@@ -0,0 +1,71 @@
+import main
+from conftest import add_wire
+
+
+def current_version(app):
+    with app.app_context():
+        return main.inventory_version()
+
+
+def test_inventory_etag_and_not_modified(client):
+    add_wire(client, 1, 1.0)
+    response = client.get('/inventory/')
+    etag = response.headers['ETag']
+
+    response = client.get('/inventory/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    add_wire(client, 2, 2.0)
+    response = client.get('/inventory/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [part['sku'] for part in response.json] == [1, 2]
+
+
+def test_collection_etags_differ_by_query(client):
+    add_wire(client, 1, 1.0)
+    assert client.get('/inventory/').headers['ETag'] != client.get('/inventory/?limit=1').headers['ETag']
+
+
+def test_part_etag_and_not_modified(client):
+    add_wire(client, 1, 1.0)
+    etag = client.get('/part/1').headers['ETag']
+    assert client.get('/part/1', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.patch('/inventory/', json={'sku': 1, 'quantity': 5}).status_code == 200
+    response = client.get('/part/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['quantity'] == 5
+
+
+def test_triggers_move_inventory_version(make_app):
+    app = make_app()
+    client = app.test_client()
+    versions = [current_version(app)]
+
+    add_wire(client, 1, 1.0)
+    versions.append(current_version(app))
+    client.patch('/inventory/', json={'sku': 1, 'quantity': 4})
+    versions.append(current_version(app))
+    client.patch('/inventory/', json=[{'sku': 1, 'delta': 2}])
+    versions.append(current_version(app))
+    client.delete('/part/1')
+    versions.append(current_version(app))
+
+    assert versions == sorted(set(versions))    # Every write moved it forward
+
+    client.get('/inventory/')
+    assert current_version(app) == versions[-1]     # Reads don't
+
+
+def test_failed_write_keeps_inventory_version(make_app):
+    app = make_app()
+    client = app.test_client()
+    add_wire(client, 1, 1.0)
+    version = current_version(app)
+
+    assert client.put('/part/', json={'sku': 1, 'class_name': 'wire', 'gauge': 9.0, 'wire_length': 1.0,
+                                      'quantity': 1}).status_code == 409
+    assert client.patch('/inventory/', json=[{'sku': 1, 'delta': -5}]).json['failed'] == 1
+    assert current_version(app) == version
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from conftest import part_body
+
+
+@pytest.fixture
+def client(make_app):
+    client = make_app().test_client()
+    for sku in (5, 1, 9, 3, 7, 2, 8):           # Added out of order, pages and streams come back by SKU
+        assert client.put('/part/', json=part_body(sku)).status_code == 201
+    return client
+
+
+def test_cursor_pages_cover_the_inventory_once(client):
+    skus, cursor = [], None
+    while True:
+        params = {'limit': 3} if cursor is None else {'limit': 3, 'cursor': cursor}
+        page = client.get('/inventory/', query_string=params).json
+        assert len(page['parts']) <= 3
+        skus += [part['sku'] for part in page['parts']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+        assert cursor == skus[-1]
+    assert skus == [1, 2, 3, 5, 7, 8, 9]
+
+
+def test_cursor_alone_starts_after_it(client):
+    page = client.get('/inventory/', query_string={'cursor': 5}).json
+    assert [part['sku'] for part in page['parts']] == [7, 8, 9]
+    assert page['next_cursor'] is None
+
+
+@pytest.mark.parametrize('params', [{'limit': 0}, {'limit': 1001}, {'cursor': 'x'}, {'stream': 'xml'}])
+def test_bad_paging_is_rejected(client, params):
+    assert client.get('/inventory/', query_string=params).status_code == 400
+
+
+@pytest.mark.parametrize('stream', ['json', 'ndjson'])
+def test_streams_hold_the_whole_inventory(client, stream):
+    inventory = sorted(client.get('/inventory/').json, key=lambda part: part['sku'])     # Which lists parts class by class
+    response = client.get('/inventory/', query_string={'stream': stream})
+    assert response.status_code == 200
+    assert response.is_streamed
+    if stream == 'json':
+        assert json.loads(response.data) == inventory
+    else:
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line) for line in response.data.splitlines()] == inventory
@@ -0,0 +1,52 @@
+import pytest
+
+from conftest import part_body
+
+
+@pytest.fixture
+def client(make_app):
+    client = make_app(MULTI_GET_MAX_SKUS=5).test_client()
+    for sku in range(1, 8):
+        assert client.put('/part/', json=part_body(sku)).status_code == 201
+    return client
+
+
+def test_parts_match_single_gets(client):
+    response = client.get('/parts', query_string={'skus': '1,2,4,99'})
+    assert response.status_code == 200
+    assert response.json == {'parts': {str(sku): client.get(f'/part/{sku}').json for sku in (1, 2, 4)}, 'missing': [99]}
+
+
+def test_fields_a_class_has(client):
+    response = client.get('/parts', query_string={'skus': '1,4', 'fields': 'sku,quantity,speed'})
+    assert response.json == {'parts': {'1': {'sku': 1, 'quantity': 1}, '4': {'sku': 4, 'quantity': 1, 'speed': '1gbps'}},
+                             'missing': []}
+
+
+def test_post_takes_lists(client):
+    response = client.post('/parts', json={'skus': [3, 5, 6], 'fields': ['quantity']})
+    assert response.status_code == 200
+    assert response.json == {'parts': {'3': {'quantity': 1}, '5': {'quantity': 2}, '6': {'quantity': 2}}, 'missing': []}
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'skus': '1,2,3,4,5,6'}, "Too many SKUs, at most 5 can be fetched at once"),
+    ({'skus': 'x'}, {'skus': "SKUs are required, as a list of integers"}),
+    ({'fields': 'sku'}, {'skus': "SKUs are required, as a list of integers"}),
+    ({'skus': '1', 'fields': 'bogus'}, "Invalid field 'bogus'"),
+])
+def test_bad_requests(client, params, message):
+    response = client.get('/parts', query_string=params)
+    assert response.status_code == 400
+    assert response.json == {'message': message}
+
+
+def test_etag_changes_with_the_inventory(client):
+    etag = client.get('/parts', query_string={'skus': '1,2'}).headers['ETag']
+    assert client.get('/parts', query_string={'skus': '1,2'}, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/parts', query_string={'skus': '1,3'}).headers['ETag'] != etag
+
+    client.patch('/inventory/', json={'sku': 2, 'quantity': 9})
+    response = client.get('/parts', query_string={'skus': '1,2'}, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['parts']['2']['quantity'] == 9
@@ -0,0 +1,21 @@
+import pytest
+
+from conftest import add_wire
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf'])
+@pytest.mark.parametrize('series', [None, 'E12'])
+def test_non_finite_value_is_rejected(client, value, series):
+    add_wire(client, 1, 1.0)
+    params = {'class_name': 'wire', 'attribute': 'gauge', 'value': value}
+    if series:
+        params['series'] = series
+    response = client.get('/search/nearest', query_string=params)
+    assert response.status_code == 400
+    assert response.json == {'message': {'value': "Value is required, must be a finite number"}}
+
+
+def test_non_finite_value_in_json_body_is_rejected(client):
+    response = client.get('/search/nearest', data='{"class_name": "wire", "attribute": "gauge", "value": NaN}',
+                          content_type='application/json')
+    assert response.status_code == 400
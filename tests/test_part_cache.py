@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import update
+
+import main
+from conftest import add_wire
+
+
+def quantity(client, sku):
+    response = client.get(f'/part/{sku}')
+    assert response.status_code == 200, response.json
+    return response.json['quantity']
+
+
+def test_write_during_a_read_keeps_the_old_part_out_of_the_cache(client, monkeypatch):
+    add_wire(client, 1, 1.0, quantity=5)
+    find_tagged_part = main.find_tagged_part
+
+    def racing_write(sku):                      # The PATCH commits and invalidates after the GET read the part
+        result = find_tagged_part(sku)
+        with ThreadPoolExecutor(1) as executor:     # A thread of its own, so the PATCH gets its own session
+            assert executor.submit(client.patch, '/inventory/', json={'sku': sku, 'quantity': 7}).result().status_code == 200
+        return result
+
+    monkeypatch.setattr(main, 'find_tagged_part', racing_write)
+    assert quantity(client, 1) == 5
+    assert 1 not in main.part_cache.entries
+    monkeypatch.undo()
+    assert quantity(client, 1) == 7
+    assert 1 in main.part_cache.entries
+
+
+def test_change_made_by_another_worker_is_not_served_from_the_cache(make_app):
+    app = make_app()
+    client = app.test_client()
+    add_wire(client, 1, 1.0, quantity=5)
+    add_wire(client, 2, 2.0, quantity=5)
+    assert quantity(client, 1) == 5 and quantity(client, 2) == 5
+
+    with app.app_context():                     # Committed without this worker's invalidate, like another worker's PATCH
+        main.db.session.execute(update(main.PartModel).where(main.PartModel.sku == 1).values(quantity=9))
+        main.db.session.commit()
+    assert quantity(client, 1) == 9
+    assert client.get('/quantity/1').json['quantity'] == 9
+
+    hits = main.part_cache.hits
+    assert quantity(client, 2) == 5             # Other parts stay cached
+    assert main.part_cache.hits == hits + 1
+
+    with app.app_context():
+        main.db.session.execute(main.PartModel.__table__.delete().where(main.PartModel.sku == 2))
+        main.db.session.commit()
+    assert client.get('/part/2').status_code == 404
+
+
+def test_invalidations_refuse_earlier_reads():
+    cache = main.PartCache(max_size=2, ttl=60)
+    started = cache.begin()
+    cache.invalidate(1)
+    cache.set(1, b'{}', 1, None, None, started)
+    cache.set(2, b'{}', 1, None, None, started)     # Not invalidated since the read began
+    assert list(cache.entries) == [2]
+
+    cache.invalidate(3)
+    cache.invalidate(4)                         # Drops 1 from the invalidations kept, so a read from before it is refused
+    cache.set(5, b'{}', 1, None, None, started)
+    assert 5 not in cache.entries
+    cache.set(5, b'{}', 1, None, None, cache.begin())
+    assert 5 in cache.entries
+
+
+def test_every_write_invalidates_the_part(client):
+    add_wire(client, 1, 1.0, quantity=5)
+    assert quantity(client, 1) == 5
+    assert 1 in main.part_cache.entries        # Cached on read
+
+    assert client.patch('/inventory/', json={'sku': 1, 'quantity': 6}).status_code == 200
+    assert 1 not in main.part_cache.entries
+    assert quantity(client, 1) == 6
+
+    assert client.patch('/inventory/', json=[{'sku': 1, 'delta': 2}]).status_code == 200
+    assert 1 not in main.part_cache.entries
+    assert client.get('/quantity/1').json == {'sku': 1, 'quantity': 8}
+
+    assert client.delete('/part/1').status_code == 200
+    assert client.get('/part/1').status_code == 404
+    add_wire(client, 1, 2.0, quantity=3)
+    assert client.get('/part/1').json['gauge'] == 2.0
+
+    stats = client.get('/stats/cache').json
+    assert stats['enabled'] and stats['size'] == 1 and stats['hits'] + stats['misses'] > 0
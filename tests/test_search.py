@@ -0,0 +1,92 @@
+import pytest
+
+from conftest import part_body
+
+
+@pytest.fixture
+def client(make_app):
+    client = make_app().test_client()
+    for sku in range(1, 41):                    # Resistors 5, 10, ... 40 with resistance 2 to 9 and tolerance 3 to 10
+        assert client.put('/part/', json=part_body(sku)).status_code == 201
+    return client
+
+
+def search(client, **params):
+    response = client.get('/search/', query_string=params)
+    assert response.status_code == 200, response.json
+    if isinstance(response.json, dict) and 'parts' in response.json:
+        return [part['sku'] for part in response.json['parts']], response.json
+    return [part['sku'] for part in response.json], None
+
+
+def test_any_matches_each_part_once(client):
+    assert search(client, class_name='resistor', resistance=2, tolerance=4) == ([5, 10], None)
+    assert search(client, class_name='resistor', resistance=2, tolerance=3) == ([5], None)    # Matches both, listed once
+
+
+def test_all_needs_every_characteristic(client):
+    assert search(client, class_name='resistor', resistance=2, tolerance=3, match='all') == ([5], None)
+    response = client.get('/search/', query_string={'class_name': 'resistor', 'resistance': 2, 'tolerance': 4, 'match': 'all'})
+    assert response.json == {'message': "No parts found"}
+
+
+def test_cursor_pages(client):
+    params = {'class_name': 'solder', 'solder_type': 'lead-free', 'solder_length': 0.5, 'limit': 3}     # Matched by 1, 16, 21 and 31
+    skus, page = search(client, **params)
+    assert skus == [1, 16, 21] and page['next_cursor'] == 21
+    skus, page = search(client, **params, cursor=21)
+    assert skus == [31] and page['next_cursor'] is None
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'class_name': 'resistor'}, "No resistor characteristics given"),
+    ({'class_name': 'resistor', 'resistance': 2, 'match': 'some'}, {'match': "Invalid match, must be 'any' or 'all'"}),
+])
+def test_bad_searches(client, params, message):
+    response = client.get('/search/', query_string=params)
+    assert response.status_code == 400
+    assert response.json == {'message': message}
+
+
+@pytest.mark.parametrize('params, skus', [
+    ({'resistance__between': '3,6'}, [10, 15, 20, 25]),
+    ({'resistance__gte': 3, 'resistance__lt': 6, 'order_by': '-resistance'}, [20, 15, 10]),
+    ({'resistance__in': '2,9', 'tolerance__lte': 3}, [5]),
+    ({'low_stock_below': 3, 'resistance__gt': 0}, [5, 30, 35, 40]),
+    ({'quantity__gte': 5, 'resistance__lte': 9}, [20, 25]),
+    ({'resistance': 2, 'resistance__gt': 2}, []),     # Filters apply on top of the characteristics
+])
+def test_range_and_set_filters(client, params, skus):
+    response = client.get('/search/', query_string={'class_name': 'resistor', **params})
+    assert response.status_code == 200
+    if skus:
+        assert [part['sku'] for part in response.json] == skus
+    else:
+        assert response.json == {'message': "No parts found"}
+
+
+def test_json_list_values(client):
+    response = client.get('/search/', json={'class_name': 'solder', 'solder_type__in': ['lead', 'rosin-core'],
+                                            'solder_length__between': [0.2, 0.6]})
+    assert [part['sku'] for part in response.json] == [6, 11, 21, 26]
+
+
+def test_ordered_pages_use_offsets(client):
+    params = {'class_name': 'resistor', 'resistance__gte': 0, 'order_by': 'quantity', 'limit': 3}
+    skus, page = search(client, **params)
+    assert skus == [30, 35, 5] and page['next_offset'] == 3     # Ties broken by SKU
+    skus, page = search(client, **params, offset=3)
+    assert skus == [40, 10, 15] and page['next_offset'] == 6
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'resistance__gte': 'x'}, "Invalid value for search filter 'resistance__gte'"),
+    ({'speed__in': '1gbps'}, "Invalid search filter 'speed__in'"),
+    ({'resistance__gte': 0, 'order_by': 'bogus'}, "Invalid order_by 'bogus'"),
+    ({'resistance__gte': 0, 'order_by': 'quantity', 'cursor': 3},
+     "Cursor can only be used when ordering by sku, use offset instead"),
+])
+def test_bad_filters(client, params, message):
+    response = client.get('/search/', query_string={'class_name': 'resistor', **params})
+    assert response.status_code == 400
+    assert response.json == {'message': message}
@@ -0,0 +1,113 @@
+import pytest
+
+import main
+from conftest import add_wire
+
+
+def nearest(client, value, **params):
+    response = client.get('/search/nearest', query_string={'class_name': 'wire', 'attribute': 'gauge', 'value': value,
+                                                           'limit': 5, **params})
+    assert response.status_code == 200, response.json
+    return [part['sku'] for part in response.json['parts']]
+
+
+def expected_nearest(client, value, limit=5, min_quantity=0):     # The same search done over the whole inventory
+    wires = [part for part in client.get('/inventory/').json if part['class_name'] == 'wire' and part['quantity'] >= min_quantity]
+    return [part['sku'] for part in sorted(wires, key=lambda part: abs(part['gauge'] - value))[:limit]]
+
+
+def prefix_search(client, text):
+    response = client.get('/search/text', query_string={'q': text, 'match': 'prefix', 'limit': 1000})
+    assert response.status_code == 200, response.json
+    return response.json['total'], sorted(match['part']['sku'] for match in response.json['matches'])
+
+
+def add_cable(client, sku, cable_type):
+    response = client.put('/part/', json={'sku': sku, 'class_name': 'display_cable', 'quantity': 1, 'display_cable_type': cable_type,
+                                          'display_cable_length': float(sku), 'display_cable_color': 'black'})
+    assert response.status_code == 201, response.json
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(SEARCH_MIRROR_INTERVAL=3600)     # Only searches bring the mirror up to date
+    client = app.test_client()
+    for sku in range(1, 31):
+        add_wire(client, sku, float(sku), quantity=sku % 3)
+    for sku in range(101, 111):
+        add_cable(client, sku, 'hdmi' if sku % 2 else 'vga')
+    return app
+
+
+def test_nearest_follows_writes(app):
+    client = app.test_client()
+    assert nearest(client, 10.3) == expected_nearest(client, 10.3)
+
+    client.delete('/part/10')
+    client.delete('/part/11')
+    add_wire(client, 40, 10.2)
+    client.patch('/inventory/', json={'sku': 9, 'quantity': 0})
+    assert nearest(client, 10.3) == expected_nearest(client, 10.3)
+    assert nearest(client, 10.3, min_quantity=1) == expected_nearest(client, 10.3, min_quantity=1)
+    assert nearest(client, 10.3)[0] == 40
+
+
+def test_nearest_directions(app):
+    client = app.test_client()
+    assert nearest(client, 10.5, direction='above', limit=3) == [11, 12, 13]
+    assert nearest(client, 10.5, direction='below', limit=3) == [10, 9, 8]
+
+
+def test_text_search_follows_writes(app):
+    client = app.test_client()
+    assert prefix_search(client, 'hd') == (5, [101, 103, 105, 107, 109])
+
+    client.delete('/part/101')
+    add_cable(client, 120, 'hdmi')
+    client.patch('/inventory/', json={'sku': 102, 'quantity': 3})
+    assert prefix_search(client, 'hd') == (5, [103, 105, 107, 109, 120])
+    match = client.get('/search/text', query_string={'q': 'vga', 'limit': 1}).json['matches'][0]
+    assert (match['part']['sku'], match['part']['quantity']) == (102, 3)     # Parts are read as they are now
+
+
+def test_searches_stay_correct_after_compaction_without_reloading(app, monkeypatch):
+    client = app.test_client()
+    nearest(client, 1.0)                        # Loads the mirror
+    loads = []
+    monkeypatch.setattr(main.part_mirror, 'load', lambda *args: loads.append(args))
+
+    for sku in (101, 103, 20, 21):
+        client.delete(f'/part/{sku}')
+    with app.app_context():
+        assert main.compact_changes(-1) == 4
+    add_cable(client, 121, 'hdmi')
+
+    assert prefix_search(client, 'hd') == (4, [105, 107, 109, 121])
+    assert nearest(client, 20.4) == expected_nearest(client, 20.4)
+    assert loads == []
+
+
+def test_mirror_holds_only_what_searches_need(app):
+    client = app.test_client()
+    nearest(client, 1.0)
+    class_name, row = main.part_mirror.rows[101]
+    assert class_name == 'display_cable'
+    assert row == (101, 1, 'hdmi', 101.0, 'black')
+
+
+def test_mirror_thread_starts_with_the_first_request(make_app):
+    app = make_app()
+    assert main.part_mirror.thread is None      # Not by create_app, so imports and CLI commands don't load it
+    assert app.test_cli_runner().invoke(args=['migrate']).exit_code == 0
+    assert main.part_mirror.thread is None
+    app.test_client().get('/quantity/1')
+    assert main.part_mirror.thread.is_alive()
+
+
+def test_disabled_mirror_loads_in_the_first_search(make_app):
+    app = make_app(SEARCH_MIRROR_ENABLED=False)
+    client = app.test_client()
+    for sku in range(1, 11):
+        add_wire(client, sku, float(sku))
+    assert nearest(client, 3.2, limit=2) == [3, 4]
+    assert main.part_mirror.thread is None
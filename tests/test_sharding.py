@@ -0,0 +1,136 @@
+import sqlite3
+
+import pytest
+
+import main
+from conftest import expected_stock, part_body, without_dates
+
+
+def workload_part(sku):
+    return part_body(sku) | {'reorder_point': 2 if sku % 4 == 0 else None}
+
+
+def run_workload(client):                       # The same requests against any app, returning what each answered by name
+    answers = {}
+
+    def record(name, response):
+        answers[name] = (response.status_code, without_dates(response.get_json(silent=True)))
+
+    for sku in range(1, 41):
+        record(f'add {sku}', client.put('/part/', json=workload_part(sku)))
+    record('bulk', client.post('/parts/bulk', json=[part_body(sku) for sku in range(41, 61)] + [part_body(3)]))
+    # Same characteristics as SKU 7, maybe on another shard
+    record('duplicate', client.put('/part/', json=part_body(7) | {'sku': 500}))
+    record('taken', client.put('/part/', json=part_body(8)))
+
+    for sku in (1, 2, 13, 59, 99):
+        record(f'part {sku}', client.get(f'/part/{sku}'))
+        record(f'quantity {sku}', client.get(f'/quantity/{sku}'))
+    record('multi-get', client.get('/parts', query_string={'skus': '5,1,33,99,20', 'fields': 'sku,quantity'}))
+
+    record('patch', client.patch('/inventory/', json={'sku': 4, 'quantity': 1}))
+    record('deltas', client.patch('/inventory/', json=[{'sku': 6, 'delta': 3}, {'sku': 16, 'delta': -100},
+                                                       {'sku': 99, 'delta': 1}]))
+    for sku in (10, 11, 12, 99):
+        record(f'delete {sku}', client.delete(f'/part/{sku}'))
+
+    record('inventory', client.get('/inventory/'))
+    cursor, pages = None, 0
+    while pages < 20:
+        response = client.get('/inventory/', query_string={'limit': 7} | ({'cursor': cursor} if cursor else {}))
+        record(f'page {pages}', response)
+        cursor, pages = response.json['next_cursor'], pages + 1
+        if cursor is None:
+            break
+    record('wires', client.get('/search/', query_string={'class_name': 'wire', 'gauge__gte': 3, 'order_by': '-wire_length'}))
+    record('resistors', client.get('/search/', query_string={'class_name': 'resistor', 'quantity__lte': 3, 'limit': 2,
+                                                             'offset': 1, 'order_by': 'resistance'}))
+    record('solder', client.get('/search/', query_string={'class_name': 'solder', 'solder_type': 'lead', 'limit': 2}))
+    record('stock', client.get('/stock/'))
+    record('low stock', client.get('/stock/low'))
+    record('low stock page', client.get('/stock/low', query_string={'limit': 3}))
+    return answers
+
+
+def check_workload(answers):                    # What run_workload must answer, worked out from part_body
+    parts = {sku: workload_part(sku) for sku in range(1, 61)}
+    for sku in range(41, 61):
+        parts[sku]['reorder_point'] = None
+    parts[4]['quantity'] = 1
+    parts[6]['quantity'] += 3
+    for sku in (10, 11, 12):
+        del parts[sku]
+
+    assert {answers[f'add {sku}'][0] for sku in range(1, 41)} == {201}
+    assert (answers['bulk'][1]['created'], answers['bulk'][1]['failed']) == (20, 1)
+    assert answers['duplicate'] == (409, {'message': "This wire already exists in the inventory"})
+    assert answers['taken'] == (409, {'message': "SKU taken"})
+    for sku in (1, 2, 13, 59):
+        assert answers[f'part {sku}'] == (200, parts[sku])
+        assert answers[f'quantity {sku}'] == (200, {'sku': sku, 'quantity': parts[sku]['quantity']})
+    assert answers['part 99'][0] == answers['quantity 99'][0] == 404
+    assert answers['multi-get'] == (200, {'parts': {str(sku): {'sku': sku, 'quantity': parts[sku]['quantity']}
+                                                    for sku in (5, 1, 33, 20)}, 'missing': [99]})
+    assert [result['status'] for result in answers['deltas'][1]['results']] == [200, 409, 404]
+    assert [answers[f'delete {sku}'][0] for sku in (10, 11, 12, 99)] == [200, 200, 200, 404]
+
+    assert sorted(answers['inventory'][1], key=lambda part: part['sku']) == list(parts.values())
+    pages = [answers[f'page {page}'][1]['parts'] for page in range(9)]
+    assert [part['sku'] for page in pages for part in page] == list(parts) and 'page 9' not in answers
+
+    wires = [part for part in parts.values() if part['class_name'] == 'wire' and part['gauge'] >= 3]
+    assert answers['wires'] == (200, sorted(wires, key=lambda part: -part['wire_length']))
+    resistors = sorted((part for part in parts.values() if part['class_name'] == 'resistor' and part['quantity'] <= 3),
+                       key=lambda part: part['resistance'])
+    assert answers['resistors'] == (200, {'parts': resistors[1:3], 'next_offset': 3})
+    assert answers['stock'] == (200, expected_stock(parts.values()))
+    low = [part for part in parts.values() if part['reorder_point'] is not None and part['quantity'] <= part['reorder_point']]
+    assert answers['low stock'] == (200, low)
+    assert answers['low stock page'] == (200, {'parts': low[:3], 'next_cursor': low[2]['sku']})
+
+
+def shard_of_sku(app, sku):                     # Which shard databases hold sku
+    found = []
+    for shard in main.shard_names(app.config):
+        path = app.config['SHARD_DATABASE_URI'].format(shard=shard).removeprefix('sqlite:///')
+        with sqlite3.connect(path) as connection:
+            if connection.execute("SELECT 1 FROM parts WHERE sku = ?", (sku,)).fetchone():
+                found.append(shard)
+    return found
+
+
+@pytest.mark.parametrize('shard_by', ['class_name', 'sku'])
+def test_sharded_app_answers_like_a_single_database(make_app, shard_by):
+    expected = run_workload(make_app().test_client())
+    check_workload(expected)
+
+    app = make_app(SHARD_BY=shard_by, SHARD_COUNT=3)
+    client = app.test_client()
+    answers = run_workload(client)
+    check_workload(answers)
+    assert answers == expected
+
+    for part in client.get('/inventory/').json:
+        assert shard_of_sku(app, part['sku']) == [main.shard_of(app.config, part['class_name'], part['sku'])]
+
+
+@pytest.mark.parametrize('shard_by', ['class_name', 'sku'])
+def test_single_database_endpoints_are_not_served_when_sharded(make_app, shard_by):
+    client = make_app(SHARD_BY=shard_by, SHARD_COUNT=3, ADMIN_ENABLED=True).test_client()
+    for path in ('/search/nearest', '/search/text', '/changes', '/admin/snapshot'):
+        assert client.get(path).status_code == 404
+
+
+def test_class_name_shards_skip_other_classes(make_app):
+    app = make_app(SHARD_BY='class_name')
+    client = app.test_client()
+    for sku in range(1, 11):
+        client.put('/part/', json=part_body(sku))
+    with app.app_context():
+        assert main.shard_router.class_shards('wire') == ['wire']
+    assert sorted(shard_of_sku(app, 2) + shard_of_sku(app, 7)) == ['wire', 'wire']
+
+
+def test_unknown_shard_by_is_refused(make_app):
+    with pytest.raises(ValueError):
+        make_app(SHARD_BY='colour')
@@ -0,0 +1,114 @@
+import io
+import sqlite3
+
+import pytest
+
+import main
+from conftest import add_wire, part_body
+
+
+def schema_objects(app):                        # Counts the indexes and triggers of the database behind app
+    path = app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///')
+    with sqlite3.connect(path) as connection:
+        return dict(connection.execute("SELECT type, count(*) FROM sqlite_master "
+                                       "WHERE type IN ('index', 'trigger') GROUP BY type").fetchall())
+
+
+@pytest.fixture
+def admin_app(make_app):
+    app = make_app(ADMIN_ENABLED=True, SNAPSHOT_CHUNK_SIZE=3)
+    client = app.test_client()
+    for sku in range(1, 11):
+        assert client.put('/part/', json=part_body(sku)).status_code == 201
+    return app
+
+
+@pytest.mark.parametrize('snapshot_format', ['binary', 'csv'])
+def test_export_then_import_restores_inventory(admin_app, snapshot_format):
+    client = admin_app.test_client()
+    inventory = client.get('/inventory/').json
+    stock = client.get('/stock/').json
+    snapshot = client.get('/admin/snapshot', query_string={'format': snapshot_format}).data
+
+    client.delete('/part/1')
+    client.patch('/inventory/', json={'sku': 2, 'quantity': 40})
+    assert client.put('/part/', json=part_body(50)).status_code == 201
+
+    response = client.put('/admin/snapshot', query_string={'format': snapshot_format}, data=snapshot)
+    assert response.json == {'message': 'Snapshot imported', 'parts': 10}
+    assert client.get('/inventory/').json == inventory
+    assert client.get('/stock/').json == stock
+
+
+def test_import_compacts_the_change_log(admin_app):
+    client = admin_app.test_client()
+    snapshot = client.get('/admin/snapshot').data
+    last_seq = client.get('/changes').json['last_seq']
+
+    client.put('/admin/snapshot', data=snapshot)
+    assert client.get('/changes', query_string={'since': last_seq}).status_code == 410
+
+
+def test_failed_import_keeps_indexes_and_triggers(make_app):
+    app = make_app(ADMIN_ENABLED=True)
+    client = app.test_client()
+    add_wire(client, 1, 1.0)
+    before = schema_objects(app)
+    snapshot = client.get('/admin/snapshot').data
+
+    response = client.put('/admin/snapshot', data=snapshot[:-20])
+    assert response.status_code == 400
+    assert schema_objects(app) == before
+    assert [part['sku'] for part in client.get('/inventory/').json] == [1]
+
+    etag = client.get('/inventory/').headers['ETag']
+    add_wire(client, 2, 2.0)
+    assert client.get('/inventory/').headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('body, status', [
+    (b'sku,class_name\n1,robot\n', 400),
+    (b'sku,class_name,quantity,date_last_updated\n1,wire,1,2024-01-01T00:00:00\n1,wire,2,2024-01-01T00:00:00\n', 409),
+    (b'sku,class_name,date_last_updated\n1,wire,2024-01-01T00:00:00\n', 400),     # No quantity column, which parts can't do without
+])
+def test_rejected_csv_import_rolls_back(admin_app, body, status):
+    client = admin_app.test_client()
+    inventory = client.get('/inventory/').json
+    before = schema_objects(admin_app)
+
+    assert client.put('/admin/snapshot', query_string={'format': 'csv'}, data=body).status_code == status
+    assert client.get('/inventory/').json == inventory
+    assert schema_objects(admin_app) == before
+
+
+def test_missing_values_are_an_invalid_snapshot(admin_app):
+    response = admin_app.test_client().put('/admin/snapshot', query_string={'format': 'csv'},
+                                           data=b'sku,class_name,date_last_updated\n1,wire,2024-01-01T00:00:00\n')
+    assert response.json == {'message': "Invalid snapshot: NOT NULL constraint failed: parts.quantity"}
+
+
+def test_export_reads_chunk_size_rows_at_a_time(admin_app, monkeypatch):
+    options = []
+    execute = main.Connection.execute
+
+    def recording_execute(self, statement, *args, **kwargs):
+        options.append(statement.get_execution_options())
+        return execute(self, statement, *args, **kwargs)
+
+    monkeypatch.setattr(main.Connection, 'execute', recording_execute)
+    with admin_app.app_context():
+        assert b''.join(main.export_snapshot('csv', 4)).count(b'\n') == 11
+    assert options == [{'yield_per': 4}]
+
+
+def test_snapshot_needs_admin(client):
+    assert client.get('/admin/snapshot').status_code == 404
+
+
+def test_export_and_import_functions_round_trip(admin_app):
+    client = admin_app.test_client()
+    inventory = client.get('/inventory/').json
+    with admin_app.app_context():
+        data = b''.join(main.export_snapshot('binary', 4))
+        assert main.import_snapshot(io.BytesIO(data), 'binary', 4) == 10
+    assert client.get('/inventory/').json == inventory
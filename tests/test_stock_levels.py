@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import insert, text
+
+import main
+from conftest import expected_stock, part_body
+
+
+def stock_rows(connection):
+    return sorted(connection.execute(text("SELECT * FROM stock_levels")).all())
+
+
+@pytest.mark.parametrize('statement', [
+    "UPDATE parts SET quantity = quantity + 1",
+    "UPDATE parts SET reorder_point = quantity WHERE sku % 3 = 0",
+    "UPDATE parts SET date_last_updated = CURRENT_TIMESTAMP",
+    "UPDATE parts SET solder_type = 'acid-core', quantity = 3 WHERE sku % 10 = 1",
+    "UPDATE parts SET display_cable_type = NULL WHERE class_name = 'display_cable' AND sku % 4 = 3",
+    "UPDATE parts SET class_name = 'resistor', resistance = 1000 + sku, tolerance = 1 WHERE class_name = 'wire' AND sku < 30",
+    "DELETE FROM parts WHERE sku % 7 = 0",
+    "DELETE FROM parts WHERE class_name = 'ethernet_cable' AND speed = '1gbps'",
+])
+def test_triggers_keep_counts_like_a_recount(make_app, statement):
+    app = make_app()
+    with app.app_context(), main.db.engine.begin() as connection:
+        rows = []
+        for sku in range(1, 101):
+            row = dict.fromkeys(column.name for column in main.PartModel.__table__.columns)
+            rows.append(row | part_body(sku) | {'date_last_updated': main.datetime.now(), 'reorder_point': sku % 4})
+        connection.execute(insert(main.PartModel.__table__), rows)
+        connection.execute(text(statement))
+
+        counted = stock_rows(connection)
+        main.recount_stock_levels(connection)
+        assert counted == stock_rows(connection)
+        assert all(row.part_count > 0 for row in counted)
+
+
+def test_stock_endpoints_follow_adds_changes_and_deletes(client):
+    for sku in range(1, 41):
+        assert client.put('/part/', json=part_body(sku) | {'reorder_point': sku % 3}).status_code == 201
+    for sku in range(1, 41, 4):
+        assert client.patch('/inventory/', json={'sku': sku, 'quantity': sku % 5, 'reorder_point': 2}).status_code == 200
+    for sku in list(range(5, 41, 5)) + [4, 9, 14]:     # Every resistor and some ethernet cables
+        assert client.delete(f'/part/{sku}').status_code == 200
+
+    inventory = client.get('/inventory/').json
+    stock = client.get('/stock/').json
+    assert stock == expected_stock(inventory)
+    assert stock['resistor']['parts'] == 0 and stock['ethernet_cable']['parts'] == 5
+
+    low = client.get('/stock/low').json
+    assert [part['sku'] for part in low] == sorted(part['sku'] for part in inventory if part['quantity'] <= part['reorder_point'])
+    page = client.get('/stock/low', query_string={'class_name': 'solder', 'limit': 2}).json
+    assert [part['sku'] for part in page['parts']] == [part['sku'] for part in low if part['class_name'] == 'solder'][:2]
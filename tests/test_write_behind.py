@@ -0,0 +1,85 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from conftest import add_wire
+
+
+def stored_quantity(app, sku):                  # The quantity committed to the database, ignoring anything queued
+    path = app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///')
+    with sqlite3.connect(path) as connection:
+        row = connection.execute("SELECT quantity FROM parts WHERE sku = ?", (sku,)).fetchone()
+    return row and row[0]
+
+
+def test_flush_ack_answers_once_written(make_app):
+    app = make_app(QUANTITY_WRITE_BEHIND=True, QUANTITY_ACK='flush')
+    client = app.test_client()
+    add_wire(client, 1, 1.0, quantity=8)
+
+    assert client.patch('/inventory/', json=[{'sku': 1, 'delta': -3}]).json['updated'] == 1
+    assert stored_quantity(app, 1) == 5
+    assert client.patch('/inventory/', json={'sku': 1, 'quantity': 20}).status_code == 200
+    assert stored_quantity(app, 1) == 20
+
+
+def test_enqueue_ack_merges_changes_until_flushed(make_app):
+    app = make_app(QUANTITY_WRITE_BEHIND=True, QUANTITY_ACK='enqueue', QUANTITY_FLUSH_INTERVAL=3600)
+    client = app.test_client()
+    add_wire(client, 1, 1.0, quantity=8)
+    add_wire(client, 2, 2.0, quantity=1)
+
+    body = client.patch('/inventory/', json=[{'sku': 1, 'delta': -3}, {'sku': 1, 'delta': 1}, {'sku': 2, 'quantity': 4}]).json
+    assert body['updated'] == 3
+    assert stored_quantity(app, 1) == 8         # Queued, not written yet
+    assert client.get('/quantity/1').json == {'sku': 1, 'quantity': 6}
+    assert client.get('/part/2').json['quantity'] == 4
+    assert set(main.quantity_writer.batch.entries) == {1, 2}    # One entry per SKU
+
+    with app.app_context():
+        assert main.quantity_writer.flush() == 2
+    assert (stored_quantity(app, 1), stored_quantity(app, 2)) == (6, 4)
+    assert not main.quantity_writer.batch.entries
+
+
+def test_queued_changes_are_checked_when_they_arrive(make_app):
+    app = make_app(QUANTITY_WRITE_BEHIND=True, QUANTITY_ACK='enqueue', QUANTITY_FLUSH_INTERVAL=3600)
+    client = app.test_client()
+    add_wire(client, 1, 1.0, quantity=2)
+
+    results = client.patch('/inventory/', json=[{'sku': 1, 'delta': -1}, {'sku': 1, 'delta': -2},
+                                                {'sku': 99, 'delta': 1}]).json['results']
+    assert [result['status'] for result in results] == [200, 409, 404]
+    assert client.patch('/inventory/', json={'sku': 99, 'quantity': 1}).status_code == 404
+
+    with app.app_context():
+        main.quantity_writer.flush()
+    assert stored_quantity(app, 1) == 1
+
+
+def test_delete_writes_queued_changes_first(make_app):
+    app = make_app(QUANTITY_WRITE_BEHIND=True, QUANTITY_ACK='enqueue', QUANTITY_FLUSH_INTERVAL=3600)
+    client = app.test_client()
+    add_wire(client, 1, 1.0, quantity=2)
+    add_wire(client, 2, 2.0, quantity=2)
+
+    client.patch('/inventory/', json=[{'sku': 1, 'delta': 3}, {'sku': 2, 'delta': 1}])
+    assert client.delete('/part/2').status_code == 200
+    assert not main.quantity_writer.batch.entries
+    assert stored_quantity(app, 1) == 5
+    assert client.get('/quantity/2').status_code == 404
+
+
+def test_waiting_requests_leave_connections_for_the_writer(make_app):
+    app = make_app(QUANTITY_WRITE_BEHIND=True, QUANTITY_ACK='flush', QUANTITY_FLUSH_INTERVAL=0.2,
+                   SQLALCHEMY_ENGINE_OPTIONS={'pool_size': 2, 'max_overflow': 0, 'pool_timeout': 3})
+    client = app.test_client()
+    for sku in range(1, 5):
+        add_wire(client, sku, float(sku), quantity=10)
+
+    def patch(sku):
+        return app.test_client().patch('/inventory/', json={'sku': sku, 'quantity': sku * 2}).status_code
+
+    with ThreadPoolExecutor(4) as executor:     # More requests waiting on one flush than the pool has connections
+        assert list(executor.map(patch, range(1, 5))) == [200] * 4
+    assert [stored_quantity(app, sku) for sku in range(1, 5)] == [2, 4, 6, 8]